@@ -1,14 +1,19 @@
+import sys
 import json
 from typing import TypedDict, Optional
 from langgraph.graph import StateGraph, END
 import argparse
 
+from dataset_io import DatasetWriter, iter_records, variant_path
+
 # Define the state structure using TypedDict
 class AgentState(TypedDict):
     input_file: str
     output_file: str
     system_message: Optional[str]
+    variants: Optional[dict[str, str]]  # Variant name -> system message, each written to its own file
     dataset: Optional[list[dict]]
+    error: Optional[str]  # Set by add_system_context if the outputs could not be written
 
 # Node to get the system message if not provided
 def get_system_message(state: AgentState) -> AgentState:
@@ -24,40 +29,69 @@ def get_system_message(state: AgentState) -> AgentState:
         state["system_message"] = system_message
     return state
 
+def with_system_message(conversation: dict, system_message: str) -> tuple[dict, bool]:
+    """
+    Return a copy of the conversation whose first turn is the system message, replacing an existing
+    leading system turn rather than stacking another. The input entry is not modified, so one entry
+    can be shared by several variants. The flag is True if a system turn was replaced.
+    """
+    turns = conversation["conversations"]
+    replaced = bool(turns) and isinstance(turns[0], dict) and turns[0].get("from") == "system"
+    system_turn = {"from": "system", "value": system_message}
+    return {**conversation, "conversations": [system_turn] + turns[1 if replaced else 0:]}, replaced
+
 # Node to add the system context to the dataset
 def add_system_context(state: AgentState) -> AgentState:
     """
-    Loads the dataset from the input file, adds the system message to each conversation,
-    and saves the updated dataset to the output file.
+    Streams the dataset from the input file (JSON array or JSONL) and writes one output per system
+    message: the system message to the output file and each variant to its variant path.
+    Outputs go through a temp file and an atomic rename, so the output may be the input file.
+    On failure nothing is written and the error is recorded in the state.
     """
     input_file = state["input_file"]
-    output_file = state["output_file"]
-    system_message = state["system_message"]
+    targets = {state["output_file"]: state["system_message"]}
+    for name, message in (state.get("variants") or {}).items():
+        targets[variant_path(state["output_file"], name)] = message
     
+    writers = []
     try:
-        # Load the dataset from the input file
-        with open(input_file, 'r') as f:
-            dataset = json.load(f)
-        
-        # Add the system message to each conversation
-        for conversation in dataset:
-            if "conversations" in conversation:
-                conversation['conversations'].insert(0, {"from": "system", "value": system_message})
-            else:
+        for path, message in targets.items():
+            writers.append((DatasetWriter(path), message))
+        count = replaced = 0
+        for conversation, error in iter_records(input_file):
+            if error is not None:
+                print(f"Warning: Skipping unreadable entry: {error}")
+                continue
+            if not isinstance(conversation, dict) or not isinstance(conversation.get("conversations"), list):
                 print(f"Warning: Skipping entry missing 'conversations' key: {conversation}")
+                for writer, _ in writers:
+                    writer.write(conversation)
+                count += 1
+                continue
+            for writer, message in writers:
+                updated, had_system = with_system_message(conversation, message)
+                writer.write(updated)
+            replaced += had_system
+            count += 1
+        for writer, _ in writers:
+            writer.close()
         
-        # Save the updated dataset to the output file
-        with open(output_file, 'w') as f:
-            json.dump(dataset, f, indent=2)
-        
-        print(f"System context added to {len(dataset)} conversations. Saved to {output_file}")
+        print(f"System context added to {count} conversations ({replaced} existing system turns replaced).")
+        for path in targets:
+            print(f"Saved to {path}")
     
     except FileNotFoundError:
-        print(f"Error: Input file {input_file} not found.")
+        state["error"] = f"Input file {input_file} not found."
     except json.JSONDecodeError:
-        print(f"Error: Invalid JSON in {input_file}.")
+        state["error"] = f"Invalid JSON in {input_file}."
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        state["error"] = f"An unexpected error occurred: {e}"
+    finally:
+        for writer, _ in writers:
+            if not writer.file.closed:
+                writer.abort()
+    if state.get("error"):
+        print(f"Error: {state['error']}")
     
     return state
 
@@ -105,6 +139,10 @@ def parse_args():
     parser.add_argument("--input_file", default="dataset.json", help="Path to the input dataset JSON file.")
     parser.add_argument("--output_file", default="dataset_with_system.json", help="Path to the output JSON file.")
     parser.add_argument("--system_message", help="The system context message to add (optional).")
+    parser.add_argument("--variants_file",
+                        help="JSON object mapping variant names to system messages; each variant is written "
+                             "next to the output file as <output>.<name>.json in the same pass, in addition "
+                             "to the output file itself (optional).")
     return parser.parse_args()
 
 # Main execution block
@@ -112,14 +150,23 @@ if __name__ == "__main__":
     # Parse arguments
     args = parse_args()
     
+    variants = None
+    if args.variants_file:
+        with open(args.variants_file, 'r', encoding='utf-8') as f:
+            variants = json.load(f)
+    
     # Initialize the state
     initial_state = {
         "input_file": args.input_file,
         "output_file": args.output_file,
         "system_message": args.system_message if args.system_message else None,
-        "dataset": None
+        "variants": variants,
+        "dataset": None,
+        "error": None
     }
     
     # Run the graph with the initial state
     result = graph.invoke(initial_state)
+    if result.get("error"):
+        sys.exit(1)
     print("Process completed.")
\ No newline at end of file
@@ -0,0 +1,499 @@
+import os
+import re
+import sys
+import json
+import asyncio
+import time
+import yaml
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from dataset_io import DatasetWriter, iter_records, variant_path
+
+STAGES = ("crawler", "prompt_generator", "dataset_cleaner", "add_system_context", "formatter")
+PRODUCT = "Bench Product"
+DOCUMENT = "Bench Document"
+PRETTY_URL = "Bench/Bench-Document/Start"
+
+WORDS = ("alert", "agent", "endpoint", "process", "network", "rule", "incident", "dataset", "field", "query",
+         "tenant", "policy", "event", "host", "user", "severity", "filter", "analytics", "log", "sensor")
+XQL_FIELDS = ("agent_hostname", "action_process_image_name", "actor_effective_username", "action_local_ip",
+              "action_remote_port", "event_type", "causality_actor_process_command_line")
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def make_toc(depth, width, prefix="t"):
+    """Synthetic TOC: width items per level, depth levels deep."""
+    if depth == 0:
+        return []
+    return [{"title": f"Topic {prefix}{i}", "contentId": f"{prefix}{i}",
+             "children": make_toc(depth - 1, width, f"{prefix}{i}_")} for i in range(width)]
+
+def topic_page(content_id, revision, words):
+    """A topic page with about `words` words of content in paragraphs, a list and a table."""
+    rng = random.Random(f"{content_id}:{revision}")
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        count = min(remaining, rng.randint(25, 60))
+        paragraphs.append(f"<p>{sentence(rng, count)}</p>")
+        remaining -= count
+    items = "".join(f"<li>{sentence(rng, 6)}</li>" for _ in range(3))
+    rows = "".join(f"<tr><td>{rng.choice(XQL_FIELDS)}</td><td>{sentence(rng, 4)}</td></tr>" for _ in range(3))
+    return ("<html><head><title>Topic</title></head><body><nav>Menu</nav>"
+            f"<div class=\"content-locale-en-US\"><h2>{content_id}</h2>{''.join(paragraphs)}"
+            f"<ul>{items}</ul><table><tr><th>Field</th><th>Meaning</th></tr>{rows}</table></div>"
+            "<footer>Footer</footer></body></html>")
+
+class FakeKhub:
+    """
+    Local stand-in for the docs portal API the crawler uses: pretty-URL resolution, document
+    map (fingerprint), paginated TOC and topic content with ETags, so revalidation gets 304s.
+    revise() changes the fingerprint and a share of the topics, like a docs update, and
+    throttle() makes the next requests fail with 429/503 and an optional Retry-After.
+    """
+
+    def __init__(self, depth=3, width=5, topic_words=300, latency=0.0):
+        self.toc = make_toc(depth, width)
+        self.topic_words = topic_words
+        self.latency = latency
+        self.fingerprint = "fp-0"
+        self.revisions = {}
+        self.requests = 0
+        self.not_modified = 0
+        self.throttled = 0
+        self.active = 0
+        self.peak_active = 0
+        self.faults = []
+        self._lock = threading.Lock()
+        khub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body=b"", content_type="application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_fault(self):
+                """Answer with the next injected fault, if any; True if one was sent."""
+                fault = khub.next_fault()
+                if fault is None:
+                    return False
+                status, retry_after = fault
+                self.send(status, b"{}", headers={"Retry-After": str(retry_after)} if retry_after is not None else None)
+                return True
+
+            def do_POST(self):
+                with khub.serving():
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                    if not self.send_fault():
+                        self.send(200, json.dumps({"documentId": "bench-doc", "tocId": "bench-toc"}).encode())
+
+            def do_GET(self):
+                with khub.serving():
+                    if not self.send_fault():
+                        self.serve_get()
+
+            def serve_get(self):
+                path = urlparse(self.path).path
+                if re.fullmatch(r"/api/khub/maps/[^/]+", path):
+                    return self.send(200, json.dumps({"fingerprint": khub.fingerprint}).encode())
+                if path.endswith("/pages"):
+                    return self.send(200, json.dumps({"paginatedToc": [{"pageToc": khub.toc}]}).encode())
+                match = re.fullmatch(r"/api/khub/maps/[^/]+/topics/([^/]+)/content", path)
+                if not match:
+                    return self.send(404, b"{}")
+                content_id = match.group(1)
+                revision = khub.revisions.get(content_id, 0)
+                etag = f'"{content_id}-{revision}"'
+                if self.headers.get("If-None-Match") == etag:
+                    with khub._lock:
+                        khub.not_modified += 1
+                    return self.send(304, headers={"ETag": etag})
+                body = topic_page(content_id, revision, khub.topic_words).encode()
+                self.send(200, body, "text/html; charset=utf-8", {"ETag": etag})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @contextlib.contextmanager
+    def serving(self):
+        """Count a request and the requests in flight with it, after the configured latency."""
+        with self._lock:
+            self.requests += 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def throttle(self, count, status=429, retry_after=None):
+        """Answer the next `count` requests with `status`, sending Retry-After (seconds) if given."""
+        with self._lock:
+            self.faults.extend([(status, retry_after)] * count)
+
+    def next_fault(self):
+        with self._lock:
+            if not self.faults:
+                return None
+            self.throttled += 1
+            return self.faults.pop(0)
+
+    def topic_ids(self):
+        stack, ids = list(self.toc), []
+        while stack:
+            item = stack.pop()
+            ids.append(item["contentId"])
+            stack.extend(item["children"])
+        return sorted(ids)
+
+    def revise(self, share, seed=0):
+        """Publish a new fingerprint with `share` of the topics changed."""
+        ids = self.topic_ids()
+        for content_id in random.Random(seed).sample(ids, max(1, int(len(ids) * share))):
+            self.revisions[content_id] = self.revisions.get(content_id, 0) + 1
+        self.fingerprint = f"fp-{seed + 1}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeOllama:
+    """Local stand-in for Ollama's /api/generate that answers every prompt after a fixed latency."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        ollama = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with ollama._lock:
+                    ollama.calls += 1
+                time.sleep(ollama.latency)
+                name = request.get("prompt", "").partition("- Name: ")[2].split("\n")[0]
+                body = json.dumps({
+                    "model": request.get("model"), "created_at": "2025-01-01T00:00:00Z",
+                    "response": f"{{I want to find {name.lower()}}}", "done": True,
+                    "eval_count": 12, "eval_duration": int(ollama.latency * 1e9),
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def synthetic_xql(rng):
+    fields = rng.sample(XQL_FIELDS, 3)
+    return (f"dataset = xdr_data\n"
+            f"| filter {fields[0]} = \"{rng.choice(WORDS)}{rng.randint(1, 999)}\" and action_remote_port > {rng.randint(1, 65535)}\n"
+            f"| fields {', '.join(fields)}\n"
+            f"| limit {rng.choice((10, 100, 1000))}")
+
+def write_yaml_corpus(yaml_dir, rows, seed=0):
+    """Write `rows` query YAML files in the layout prompt_generator reads."""
+    os.makedirs(yaml_dir, exist_ok=True)
+    rng = random.Random(seed)
+    for i in range(rows):
+        query = {
+            "name": f"Bench query {i}",
+            "description": sentence(rng, 12),
+            "categories": [rng.choice(WORDS)],
+            "sources": ["xdr_data"],
+            "xql": synthetic_xql(rng) + "\n// trailing comment",
+        }
+        with open(os.path.join(yaml_dir, f"query_{i:07d}.yml"), "w", encoding="utf-8") as f:
+            yaml.safe_dump(query, f)
+
+def write_sharegpt_corpus(path, rows, seed=0):
+    """Stream `rows` ShareGPT conversations to path (any layout DatasetWriter writes)."""
+    rng = random.Random(seed)
+    with DatasetWriter(path) as writer:
+        for _ in range(rows):
+            writer.write({"conversations": [
+                {"from": "human", "value": f"I want to {sentence(rng, rng.randint(6, 20)).lower()}"},
+                {"from": "gpt", "value": synthetic_xql(rng)},
+            ]})
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Silence a stage's progress output so printing does not dominate its timing."""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+def bench_crawler(args, workdir, khub):
+    # crawler reads its endpoints and request pacing from the environment when imported
+    os.environ["CRAWLER_BASE_URL"] = khub.url
+    os.environ["CRAWLER_RATE"] = "0"
+    import crawler
+    logging.getLogger(crawler.__name__).setLevel(logging.WARNING)
+    topics = len(khub.topic_ids())
+    results = {"topics": topics}
+    for label, prepare in (("cold", None), ("unchanged", None), ("revised", lambda: khub.revise(args.revise_share))):
+        if prepare:
+            prepare()
+        requests_before, not_modified_before = khub.requests, khub.not_modified
+        with quiet(args.quiet):
+            _, seconds = timed(crawler.process_document, PRETTY_URL, PRODUCT, DOCUMENT, workers=args.crawl_workers)
+        results[label] = {"seconds": round(seconds, 3), "topics_per_sec": rate(topics, seconds),
+                          "requests": khub.requests - requests_before,
+                          "not_modified": khub.not_modified - not_modified_before}
+    return results
+
+def bench_formatter(args, workdir, khub):
+    import crawler
+    import formatter
+    doc_dir = os.path.join(workdir, crawler.OUTPUT_DIR, crawler.sanitize_filename(PRODUCT), crawler.sanitize_filename(DOCUMENT))
+    pages_dir = os.path.join(doc_dir, "pages")
+    if not os.path.isdir(pages_dir):
+        raise RuntimeError("the formatter stage converts the crawler stage's output; run it with the crawler stage")
+    pages = sum(len([name for name in files if name.endswith(".html")]) for _, _, files in os.walk(pages_dir))
+    doctree = {"children": [{"name": PRODUCT, "children": [{"name": DOCUMENT, "link": PRETTY_URL}]}]}
+    results = {"pages": pages}
+    for label in ("pages_cold", "pages_unchanged"):
+        with quiet(args.quiet):
+            _, seconds = timed(lambda: asyncio.run(formatter.convert_html_recursively(
+                pages_dir, os.path.join(workdir, "markdown_pages"), concurrency=args.workers * 2,
+                engine="static", workers=args.workers)))
+        results[label] = {"seconds": round(seconds, 3), "pages_per_sec": rate(pages, seconds)}
+    for label in ("doctree_cold", "doctree_unchanged"):
+        with quiet(args.quiet):
+            totals, seconds = timed(formatter.convert_doctree, doctree, crawler.OUTPUT_DIR,
+                                    os.path.join(workdir, "markdown_doctree"), workers=args.workers)
+        results[label] = {"seconds": round(seconds, 3), "sections_per_sec": rate(totals["sections"], seconds),
+                          "topics_converted": totals["converted"]}
+    return results
+
+def bench_prompt_generator(args, workdir, ollama):
+    yaml_dir = os.path.join(workdir, "xql_queries")
+    write_yaml_corpus(yaml_dir, args.yaml_rows, args.seed)
+    with quiet(args.quiet):
+        import prompt_generator
+    results = {"files": args.yaml_rows}
+    for label in ("cold", "cached"):
+        calls_before = ollama.calls
+        generator = prompt_generator.DatasetGenerator(
+            yaml_dir, os.path.join(workdir, f"dataset_{label}.json"), ollama.url, "bench-model",
+            parallel=args.ollama_parallel, prompt_cache_file=os.path.join(workdir, "prompt_cache.sqlite"))
+        generator.state = prompt_generator.StateIndex(generator.state_index_file, generator.fingerprint())
+        try:
+            with quiet(args.quiet):
+                _, seconds = timed(generator.process_files)
+                generator.state.commit()
+                _, export_seconds = timed(generator.save_dataset)
+        finally:
+            generator.state.close()
+            generator.prompt_cache.close()
+        results[label] = {"seconds": round(seconds, 3), "files_per_sec": rate(args.yaml_rows, seconds),
+                          "export_seconds": round(export_seconds, 3), "ollama_calls": ollama.calls - calls_before}
+    return results
+
+def count_rows(path):
+    """Rows in a dataset file; raises if the stage did not write it."""
+    if not os.path.exists(path):
+        raise RuntimeError(f"stage did not write {path}")
+    return sum(1 for _ in iter_records(path))
+
+def remove_outputs(*paths):
+    """Delete a stage's previous outputs, so a failed run can't pass for a successful one."""
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def bench_dataset_cleaner(args, workdir, corpus):
+    import dataset_cleaner
+    output_file = os.path.join(workdir, "clean_dataset.jsonl")
+    remove_outputs(output_file)
+    with quiet(args.quiet):
+        report, seconds = timed(dataset_cleaner.validate_dataset, corpus, output_file,
+                                os.path.join(workdir, "clean_dataset.report.json"), args.workers, 256)
+    if report is None:
+        raise RuntimeError("validate_dataset could not read the corpus")
+    if report["total_entries"] != args.rows or count_rows(output_file) != report["kept_entries"]:
+        raise RuntimeError(f"validated {report['total_entries']} of {args.rows} rows and reported "
+                           f"{report['kept_entries']} kept, but {output_file} has {count_rows(output_file)}")
+    return {"rows": args.rows, "kept": report["kept_entries"], "seconds": round(seconds, 3),
+            "rows_per_sec": rate(args.rows, seconds)}
+
+def bench_add_system_context(args, workdir, corpus):
+    import add_system_context
+    output_file = os.path.join(workdir, "dataset_with_system.jsonl")
+    variants = {"short": "Answer with XQL only."}
+    outputs = [output_file] + [variant_path(output_file, name) for name in variants]
+    remove_outputs(*outputs)
+    state = {"input_file": corpus, "output_file": output_file,
+             "system_message": "You translate requests into Cortex XQL queries.", "variants": variants, "dataset": None}
+    with quiet(args.quiet):
+        _, seconds = timed(add_system_context.graph.invoke, state)
+    for path in outputs:  # add_system_context reports its own errors and returns normally
+        rows = count_rows(path)
+        if rows != args.rows:
+            raise RuntimeError(f"{path} has {rows} rows, expected {args.rows}")
+    return {"rows": args.rows, "outputs": len(outputs), "seconds": round(seconds, 3),
+            "rows_per_sec": rate(args.rows, seconds)}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, baseline_file):
+    """Print each stage's timings against a previous results file (ratio > 1 is slower)."""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline_file} (commit {baseline.get('commit')}):")
+    old_config = baseline.get("config", {})
+    changed = sorted(key for key, value in results["config"].items() if key != "stages" and old_config.get(key) != value)
+    if changed:
+        print(f"  Warning: corpus or settings differ ({', '.join(changed)}); timings are not like for like")
+    for stage, stats in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {})
+        for label, value in stats.items():
+            old = before.get(label)
+            if isinstance(value, dict) and isinstance(old, dict):
+                value, old = value.get("seconds"), old.get("seconds")
+            elif label != "seconds":
+                continue
+            if value and old:
+                print(f"  {stage} {label}: {old:.3f}s -> {value:.3f}s ({value / old:.2f}x)")
+
+def run_benchmarks(args):
+    """Run the selected stages against the fakes in a scratch directory and return the results."""
+    stages = [stage for stage in STAGES if stage in args.stages]
+    if "formatter" in stages and "crawler" not in stages:
+        stages.insert(0, "crawler")
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="xql-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "workdir")},
+        "stages": {},
+    }
+    khub = FakeKhub(args.toc_depth, args.toc_width, args.topic_words, args.khub_latency)
+    ollama = FakeOllama(args.ollama_latency)
+    cwd = os.getcwd()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    try:
+        corpus = None
+        if {"dataset_cleaner", "add_system_context"} & set(stages):
+            corpus = os.path.join(workdir, "sharegpt_corpus.jsonl")
+            _, seconds = timed(write_sharegpt_corpus, corpus, args.rows, args.seed)
+            print(f"Wrote {args.rows} synthetic conversations in {seconds:.2f}s")
+        runners = {
+            "crawler": lambda: bench_crawler(args, workdir, khub),
+            "formatter": lambda: bench_formatter(args, workdir, khub),
+            "prompt_generator": lambda: bench_prompt_generator(args, workdir, ollama),
+            "dataset_cleaner": lambda: bench_dataset_cleaner(args, workdir, corpus),
+            "add_system_context": lambda: bench_add_system_context(args, workdir, corpus),
+        }
+        for stage in stages:
+            print(f"Running {stage} benchmark ...")
+            try:
+                results["stages"][stage] = runners[stage]()
+            except Exception as e:
+                results["stages"][stage] = {"error": f"{type(e).__name__}: {e}"}
+            print(f"  {json.dumps(results['stages'][stage])}")
+    finally:
+        os.chdir(cwd)
+        khub.close()
+        ollama.close()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages against local fakes of khub and Ollama.")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"Comma-separated stages to run (default: all of {', '.join(STAGES)})")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous results file to compare the timings with")
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary scratch directory")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpora")
+    parser.add_argument("--toc-depth", type=int, default=3, help="Levels of the synthetic TOC")
+    parser.add_argument("--toc-width", type=int, default=5, help="Items per TOC level")
+    parser.add_argument("--topic-words", type=int, default=300, help="Words of content per topic")
+    parser.add_argument("--khub-latency", type=float, default=0.0, help="Seconds the fake portal waits per request")
+    parser.add_argument("--revise-share", type=float, default=0.1, help="Share of topics changed before the recrawl")
+    parser.add_argument("--crawl-workers", type=int, default=8, help="Concurrent topic fetches")
+    parser.add_argument("--ollama-latency", type=float, default=0.05, help="Seconds the fake Ollama takes per prompt")
+    parser.add_argument("--ollama-parallel", type=int, default=4, help="Concurrent generate requests")
+    parser.add_argument("--yaml-rows", type=int, default=200, help="Synthetic YAML query files")
+    parser.add_argument("--rows", type=int, default=10000, help="Synthetic ShareGPT conversations")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes for CPU-bound stages")
+    parser.add_argument("--verbose", dest="quiet", action="store_false", help="Show the stages' own output")
+    args = parser.parse_args()
+    args.stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+    return args
+
+def main():
+    args = parse_args()
+    results = run_benchmarks(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved to '{args.output}'.")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
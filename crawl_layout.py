@@ -0,0 +1,54 @@
+import os
+import re
+import json
+import logging
+
+# On-disk layout of a crawled document, shared by the crawler and the formatter
+MANIFEST_FILE = "manifest.json"
+TOPICS_DIR = ".topics"
+
+logger = logging.getLogger(__name__)
+
+def sanitize_filename(title):
+    """Sanitize a title to create a valid filename, preserving spaces and special characters minimally."""
+    return re.sub(r'[<>:"/\\|?*]', '_', title).strip()
+
+def count_toc_items(toc):
+    """Recursively count all items in the TOC for progress tracking."""
+    total = 0
+    for item in toc:
+        total += 1
+        if item["children"]:
+            total += count_toc_items(item["children"])
+    return total
+
+def iter_toc(toc):
+    """Yield every TOC item in document (pre-)order."""
+    for item in toc:
+        yield item
+        if item["children"]:
+            yield from iter_toc(item["children"])
+
+def topic_level(item, prefix):
+    """Heading level of a TOC item: its topic-level, or its depth given its number prefix."""
+    return item.get("topic-level", len(prefix.split('.')) + 1 if prefix else 1)
+
+def load_manifest(doc_dir):
+    """Load the crawl manifest of a document, or None if there is no usable manifest."""
+    manifest_file = os.path.join(doc_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable manifest {manifest_file}: {e}")
+        return None
+
+def save_manifest(doc_dir, manifest):
+    """Atomically write the crawl manifest of a document."""
+    manifest_file = os.path.join(doc_dir, MANIFEST_FILE)
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
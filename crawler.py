@@ -1,19 +1,36 @@
 import requests
+import hashlib
 import json
 import os
+import random
 import re
 import shutil
+import sqlite3
+import sys
+import threading
 import time
+import zlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 import logging
 
+from crawl_layout import (MANIFEST_FILE, TOPICS_DIR, count_toc_items, iter_toc, load_manifest, sanitize_filename,
+                          save_manifest, topic_level)
+from formatter import convert_document
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Base API endpoints and constants from the Postman collection
-BASE_URL = "https://docs-cortex.paloaltonetworks.com"
+# CRAWLER_BASE_URL lets the crawler run against a local stand-in for the docs portal
+BASE_URL = os.getenv("CRAWLER_BASE_URL", "https://docs-cortex.paloaltonetworks.com")
 PRETTY_URL_ENDPOINT = f"{BASE_URL}/internal/api/webapp/pretty-url/reader"
 DOCUMENT_MAP_ENDPOINT = f"{BASE_URL}/api/khub/maps/{{document_id}}"
 PAGES_ENDPOINT = f"{BASE_URL}/api/khub/maps/{{document_id}}/pages"
@@ -22,6 +39,42 @@ CONTENT_ENDPOINT = f"{BASE_URL}/api/khub/maps/{{document_id}}/topics/{{topic_id}
 # Output directory
 OUTPUT_DIR = "cortex_docs"
 
+# Default number of concurrent topic fetches per document (1 keeps the sequential crawl)
+DEFAULT_WORKERS = int(os.getenv("CRAWLER_WORKERS", "8"))
+
+# Default number of documents crawled at once, and the cap on in-flight requests across all of them
+DEFAULT_JOBS = int(os.getenv("CRAWLER_JOBS", "4"))
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("CRAWLER_MAX_IN_FLIGHT", "16"))
+
+# Request pacing and retry policy shared by every crawler request
+DEFAULT_RATE = float(os.getenv("CRAWLER_RATE", "10"))  # Requests per second, 0 disables the token bucket
+DEFAULT_LATENCY_TARGET = float(os.getenv("CRAWLER_LATENCY_TARGET", "5"))  # Seconds before concurrency backs off
+MAX_ATTEMPTS = int(os.getenv("CRAWLER_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_AFTER_MAX = 300.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError)
+THROTTLE_STATUSES = {429, 503}
+
+# Optional on-disk cache of raw HTTP responses (see HTTPCache)
+DEFAULT_CACHE_DIR = os.getenv("CRAWLER_CACHE_DIR")
+DEFAULT_CACHE_MAX_MB = int(os.getenv("CRAWLER_CACHE_MAX_MB", "1024"))
+CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+# Topic pages keep their content in the first div with this class
+CONTENT_CLASS = "content-locale-en-US"
+
+# How topic content is extracted: "soup" (parses the whole page) or "scan" (parses only the content div,
+# falls back to "soup"; faster on pages with a lot of markup around the content). Both produce the same markup
+DEFAULT_EXTRACTOR = os.getenv("CRAWLER_EXTRACTOR", "soup")
+
+# Per-thread sessions so every worker reuses its own keep-alive connection pool
+_thread_local = threading.local()
+
+# Serializes updates to progress bars shared between documents
+_progress_lock = threading.Lock()
+
 # Basic HTML template for individual files
 HTML_TEMPLATE = """<!DOCTYPE html>
 <html lang="en">
@@ -34,42 +87,314 @@ HTML_TEMPLATE = """<!DOCTYPE html>
 </body>
 </html>"""
 
-def make_request(method, url, **kwargs):
+def get_session():
+    """Return this thread's requests.Session, creating it with a keep-alive connection pool on first use."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _thread_local.session = session
+    return session
+
+class RequestLimiter:
+    """
+    Limiter shared by all crawler requests.
+    A token bucket caps the request rate, and an AIMD window caps in-flight requests: it halves
+    on throttling or errors, shrinks while the latency average exceeds latency_target, and grows
+    back by about one slot per window of successful requests. Per-host counters are kept for
+    the end-of-run summary.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=None, max_concurrency=DEFAULT_MAX_IN_FLIGHT, min_concurrency=1,
+                 latency_target=DEFAULT_LATENCY_TARGET):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(self.max_concurrency)
+        self.latency_target = latency_target
+        self.latency_avg = None
+        self.in_flight = 0
+        self.cooldowns = {}
+        self.stats = {}
+        self._cond = threading.Condition()
+
+    def _host_stats(self, host):
+        return self.stats.setdefault(host, {"requests": 0, "retries": 0, "errors": 0, "throttled": 0,
+                                            "wait_time": 0.0, "latency": 0.0})
+
+    def acquire(self, host):
+        """Block until the host is out of cooldown, a rate token is available and the window has room."""
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.cooldowns.get(host, 0) - now
+                if wait <= 0 and self.in_flight < int(self.concurrency):
+                    if self.rate <= 0 or self.tokens >= 1:
+                        self.tokens -= 1
+                        self.in_flight += 1
+                        break
+                    wait = (1 - self.tokens) / self.rate
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            stats = self._host_stats(host)
+            stats["requests"] += 1
+            stats["wait_time"] += time.monotonic() - start
+
+    def release(self, host, latency, error=False, throttled=False):
+        """Record the outcome of a request and adjust the concurrency window."""
+        with self._cond:
+            self.in_flight -= 1
+            stats = self._host_stats(host)
+            stats["latency"] += latency
+            self.latency_avg = latency if self.latency_avg is None else 0.8 * self.latency_avg + 0.2 * latency
+            if error or throttled:
+                stats["errors"] += 1
+                stats["throttled"] += throttled
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            elif self.latency_avg > self.latency_target:
+                self.concurrency = max(self.min_concurrency, self.concurrency * 0.9)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._cond.notify_all()
+
+    def cooldown(self, host, delay):
+        """Hold back every request to a host for delay seconds (e.g. after a Retry-After)."""
+        with self._cond:
+            self.cooldowns[host] = max(self.cooldowns.get(host, 0), time.monotonic() + delay)
+
+    def record_retry(self, host, delay):
+        with self._cond:
+            stats = self._host_stats(host)
+            stats["retries"] += 1
+            stats["wait_time"] += delay
+
+# Shared by every request of the run; main() replaces it to apply command-line settings
+request_limiter = RequestLimiter()
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a request has no cached response."""
+
+class CachedResponse:
+    """Minimal stand-in for requests.Response served from the HTTP cache."""
+
+    from_cache = True
+
+    def __init__(self, url, status_code, headers, content, encoding):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        """Only successful responses are cached, so there is nothing to raise."""
+
+class HTTPCache:
+    """
+    On-disk cache of raw HTTP responses.
+    Bodies are zlib-compressed and stored by the SHA-256 of their content under objects/, and a
+    SQLite index maps request keys (method, URL, params and body) to them. Once the stored bodies
+    exceed max_bytes, the least recently used entries are evicted. In offline mode every request
+    must be served from the cache.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024, offline=False):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, body_hash TEXT NOT NULL, "
+                        "status INTEGER NOT NULL, headers TEXT NOT NULL, encoding TEXT, last_access REAL NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS objects (hash TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self.db.commit()
+
+    @staticmethod
+    def request_key(method, url, params=None, json_body=None, data=None):
+        """Hash the parts of a request that determine its response."""
+        payload = json.dumps([method.upper(), url, sorted((params or {}).items()), json_body, data],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _object_path(self, body_hash):
+        return os.path.join(self.objects_dir, body_hash[:2], f"{body_hash}.zz")
+
+    def get(self, key, url):
+        """Return the cached response for a request key, or None."""
+        with self._lock:
+            row = self.db.execute("SELECT body_hash, status, headers, encoding FROM entries WHERE key = ?",
+                                  (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            body_hash, status, headers, encoding = row
+            try:
+                with open(self._object_path(body_hash), "rb") as f:
+                    content = zlib.decompress(f.read())
+            except (OSError, zlib.error):
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.db.commit()
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+        return CachedResponse(url, status, json.loads(headers), content, encoding)
+
+    def put(self, key, response):
+        """Store a successful response under a request key."""
+        content = response.content
+        body_hash = hashlib.sha256(content).hexdigest()
+        headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        encoding = response.encoding or response.apparent_encoding
+        object_path = self._object_path(body_hash)
+        with self._lock:
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                compressed = zlib.compress(content)
+                tmp_path = f"{object_path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(compressed)
+                os.replace(tmp_path, object_path)
+                self.db.execute("INSERT OR REPLACE INTO objects (hash, size) VALUES (?, ?)", (body_hash, len(compressed)))
+            self.db.execute("INSERT OR REPLACE INTO entries (key, body_hash, status, headers, encoding, last_access) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, body_hash, response.status_code, json.dumps(headers), encoding, time.time()))
+            self.db.commit()
+            self.stores += 1
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries, and bodies nothing refers to, until under max_bytes."""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        while total > self.max_bytes:
+            row = self.db.execute("SELECT key, body_hash FROM entries ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            key, body_hash = row
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.evictions += 1
+            if self.db.execute("SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1", (body_hash,)).fetchone() is None:
+                size = self.db.execute("SELECT size FROM objects WHERE hash = ?", (body_hash,)).fetchone()[0]
+                self.db.execute("DELETE FROM objects WHERE hash = ?", (body_hash,))
+                if os.path.exists(self._object_path(body_hash)):
+                    os.remove(self._object_path(body_hash))
+                total -= size
+        self.db.commit()
+
+# Set by main() when --cache-dir is given; None disables the cache
+http_cache = None
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given (0-based) attempt."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into a delay in seconds, or None."""
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(RETRY_AFTER_MAX, max(0.0, delay))
+
+def make_request(method, url, immutable=False, **kwargs):
     """
     Helper function to make HTTP requests with retry logic.
-    Retries up to 5 times on timeout and connection errors,
-    sleeping 10 seconds before each retry.
+    Every attempt goes through the shared request limiter and releases its slot exactly once,
+    whatever the outcome. Timeouts, connection errors, truncated bodies and retryable statuses
+    (429 and 5xx) are retried up to MAX_ATTEMPTS times with jittered
+    exponential backoff; a Retry-After header overrides the backoff and pauses the whole host.
+
+    With the HTTP cache enabled, successful responses are stored. Requests marked immutable
+    (versioned by the document fingerprint) are served from the cache; others are always
+    fetched live unless the cache is offline, in which case everything must come from it.
     """
-    attempts = 5
-    for attempt in range(attempts):
+    if method.lower() not in ("get", "post"):
+        raise ValueError(f"Unsupported HTTP method: {method}")
+    cache_key = None
+    if http_cache is not None:
+        cache_key = HTTPCache.request_key(method, url, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"))
+        if immutable or http_cache.offline:
+            cached = http_cache.get(cache_key, url)
+            if cached is not None:
+                return cached
+        if http_cache.offline:
+            raise CacheMiss(f"No cached response for {method.upper()} {url} in offline mode")
+    host = urlparse(url).netloc
+    for attempt in range(MAX_ATTEMPTS):
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        request_limiter.acquire(host)
+        start = time.monotonic()
         try:
-            if method.lower() == "get":
-                response = requests.get(url, timeout=10, **kwargs)
-            elif method.lower() == "post":
-                response = requests.post(url, timeout=10, **kwargs)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-            response.raise_for_status()
-            return response
-        except (requests.Timeout, requests.ConnectionError) as e:
-            logger.warning(f"Error on {url} attempt {attempt+1} of {attempts}: {e}. Retrying in 10 seconds...")
-            time.sleep(10)
-            if attempt == attempts - 1:
-                logger.error(f"Failed to fetch {url} after {attempts} attempts.")
+            response = get_session().request(method.upper(), url, timeout=10, **kwargs)
+        except RETRY_EXCEPTIONS as e:
+            request_limiter.release(host, time.monotonic() - start, error=True)
+            if last_attempt:
+                logger.error(f"Failed to fetch {url} after {MAX_ATTEMPTS} attempts.")
                 raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"Error on {url} attempt {attempt+1} of {MAX_ATTEMPTS}: {e}. Retrying in {delay:.1f} seconds...")
+        except BaseException:
+            # Not retryable (e.g. TooManyRedirects, InvalidURL, ContentDecodingError): free the slot and give up
+            request_limiter.release(host, time.monotonic() - start, error=True)
+            raise
+        else:
+            latency = time.monotonic() - start
+            if response.status_code not in RETRY_STATUSES:
+                request_limiter.release(host, latency)
+                response.raise_for_status()
+                if cache_key is not None and response.status_code == 200:
+                    http_cache.put(cache_key, response)
+                return response
+            throttled = response.status_code in THROTTLE_STATUSES
+            request_limiter.release(host, latency, error=True, throttled=throttled)
+            if last_attempt:
+                logger.error(f"Failed to fetch {url} after {MAX_ATTEMPTS} attempts.")
+                response.raise_for_status()
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            if retry_after is not None:
+                request_limiter.cooldown(host, delay)
+            logger.warning(f"HTTP {response.status_code} on {url} attempt {attempt+1} of {MAX_ATTEMPTS}. Retrying in {delay:.1f} seconds...")
+        request_limiter.record_retry(host, delay)
+        time.sleep(delay)
 
-def sanitize_filename(title):
-    """Sanitize a title to create a valid filename, preserving spaces and special characters minimally."""
-    return re.sub(r'[<>:"/\\|?*]', '_', title).strip()
-
-def count_toc_items(toc):
-    """Recursively count all items in the TOC for progress tracking."""
-    total = 0
-    for item in toc:
-        total += 1
-        if item["children"]:
-            total += count_toc_items(item["children"])
-    return total
+def log_request_stats():
+    """Log the per-host request counters collected by the shared request limiter."""
+    for host, stats in request_limiter.stats.items():
+        avg_latency = stats["latency"] / stats["requests"] if stats["requests"] else 0.0
+        logger.info(f"{host}: {stats['requests']} requests, {stats['retries']} retries, {stats['errors']} errors "
+                    f"({stats['throttled']} throttled), {stats['wait_time']:.1f}s waiting, {avg_latency:.3f}s avg latency")
+    logger.info(f"Final concurrency window: {request_limiter.concurrency:.1f} of {request_limiter.max_concurrency}")
+    if http_cache is not None:
+        logger.info(f"HTTP cache: {http_cache.hits} hits, {http_cache.misses} misses, {http_cache.stores} stores, "
+                    f"{http_cache.evictions} evictions")
 
 def fetch_pretty_url(pretty_url):
     """Step 1: Resolve Pretty URL to get documentId and tocId."""
@@ -94,90 +419,425 @@ def fetch_pages(document_id, fingerprint):
     url = PAGES_ENDPOINT.format(document_id=document_id)
     params = {"v": fingerprint}
     logger.info(f"Fetching TOC for documentId: {document_id} with fingerprint: {fingerprint}")
-    response = make_request("get", url, params=params)
+    response = make_request("get", url, immutable=True, params=params)
     toc = response.json()["paginatedToc"][0]["pageToc"]
     logger.info(f"TOC fetched with {len(toc)} top-level items")
     return toc
 
-def fetch_content(document_id, topic_id, fingerprint):
-    """Step 4: Fetch HTML content for a specific topic with error handling."""
+def fetch_content_response(document_id, topic_id, fingerprint, headers=None):
+    """Fetch the raw response for a topic. Conditional headers may produce a 304 Not Modified."""
     url = CONTENT_ENDPOINT.format(document_id=document_id, topic_id=topic_id)
     params = {"target": "DESIGNED_READER", "v": fingerprint}
     logger.info(f"Fetching content for topicId: {topic_id}")
+    return make_request("get", url, immutable=True, params=params, headers=headers)
+
+def fetch_content(document_id, topic_id, fingerprint):
+    """Step 4: Fetch HTML content for a specific topic with error handling."""
     try:
-        response = make_request("get", url, params=params)
+        response = fetch_content_response(document_id, topic_id, fingerprint)
         logger.debug(f"Content fetched for topicId: {topic_id}")
         return response.text
     except Exception as e:
         logger.error(f"Failed to fetch content for topicId {topic_id}: {e}")
         return f"<!-- Error fetching content for topicId {topic_id}: {e} -->"
 
-def build_section_content(toc, document_id, fingerprint, prefix=""):
-    """Build HTML content for a section including all subsections recursively."""
-    section_html = []
-    for idx, item in enumerate(toc, start=1):
-        title = item["title"]
-        content_id = item["contentId"]
-        number_prefix = f"{prefix}{idx}" if prefix else str(idx)
-        html_content = fetch_content(document_id, content_id, fingerprint)
-        soup = BeautifulSoup(html_content, 'html.parser')
-        content_div = soup.find('div', class_='content-locale-en-US') or soup
-        topic_level = item.get("topic-level", len(prefix.split('.')) + 1 if prefix else 1)
-        
-        # Append current item's content
-        section_html.append(f"<section id='{content_id}'><h{topic_level}>{number_prefix} {title}</h{topic_level}>{str(content_div)}</section>")
-        
-        # Recursively append children content
+def slim_toc(toc):
+    """Keep only what the TOC is used for after the crawl (titles, topics, levels and nesting)."""
+    items = []
+    for item in toc:
+        slim = {"title": item["title"], "contentId": item["contentId"], "children": slim_toc(item["children"] or [])}
+        if "topic-level" in item:
+            slim["topic-level"] = item["topic-level"]
+        items.append(slim)
+    return items
+
+def count_unique_topics(toc):
+    """Count the distinct topics (contentIds) in the TOC, i.e. the fetches a crawl makes."""
+    return len({item["contentId"] for item in iter_toc(toc)})
+
+def count_legacy_fetches(toc, depth=0):
+    """
+    Count the topic fetches the non-memoized crawl would make for this TOC.
+    A topic at depth d was fetched once for its own file and once for each
+    aggregated section (its own and every ancestor's) it appears in.
+    """
+    total = 0
+    for item in toc:
+        total += depth + 2
         if item["children"]:
-            section_html.append(build_section_content(item["children"], document_id, fingerprint, f"{number_prefix}."))
-    
-    return "\n".join(section_html)
+            total += count_legacy_fetches(item["children"], depth + 1)
+    return total
+
+# Tokens the scanner cares about: comments and script/style bodies (skipped so markup inside
+# them is ignored), div start tags (with quoted attribute values that may contain '>') and div end tags
+_TAG_ATTRS = r"""(?:[^>"']|"[^"]*"|'[^']*')*"""
+_SCAN_TOKEN_RE = re.compile(
+    r"(?P<skip><!--.*?(?:-->|$)|<(?P<raw>script|style)\b" + _TAG_ATTRS + r">.*?(?:</(?P=raw)\s*>|$))"
+    r"|(?P<open><div\b(?P<attrs>" + _TAG_ATTRS + r")>)"
+    r"|(?P<close></div\s*>)",
+    re.IGNORECASE | re.DOTALL)
+_CLASS_ATTR_RE = re.compile(r"""\bclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))""", re.IGNORECASE)
+
+def scan_content(html_content):
+    """
+    Return the first content div, found with a single regex pass over the page and then parsed
+    on its own, so only the div (not the page around it) is built into a tree. Serialized the
+    way soup_content serializes it. Returns None if there is no such div or it is never closed,
+    so the caller can fall back to the BeautifulSoup path.
+    """
+    start = None
+    depth = 0
+    for match in _SCAN_TOKEN_RE.finditer(html_content):
+        if match.group("skip"):
+            continue
+        if match.group("close"):
+            if start is not None:
+                depth -= 1
+                if depth == 0:
+                    return str(BeautifulSoup(html_content[start:match.end()], 'html.parser').div)
+            continue
+        attrs = match.group("attrs")
+        if attrs.rstrip().endswith("/"):  # <div/> opens and closes in one tag
+            continue
+        if start is not None:
+            depth += 1
+            continue
+        class_attr = _CLASS_ATTR_RE.search(attrs)
+        if class_attr and CONTENT_CLASS in next(filter(None, class_attr.groups()), "").split():
+            start = match.start()
+            depth = 1
+    return None
+
+def soup_content(html_content):
+    """Extract the content fragment with a full BeautifulSoup parse, falling back to the whole page."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    content_div = soup.find('div', class_=CONTENT_CLASS) or soup
+    return str(content_div)
+
+# Set by main() from --extractor
+content_extractor = DEFAULT_EXTRACTOR
+
+def extract_content(html_content, extractor=None):
+    """
+    Extract the content-locale-en-US fragment from a topic page, falling back to the whole page.
+    Both extractors return BeautifulSoup's serialization of the div, so the output does not
+    depend on the extractor.
+    """
+    extractor = extractor or content_extractor
+    if extractor == "scan":
+        fragment = scan_content(html_content)
+        if fragment is not None:
+            return fragment
+    elif extractor != "soup":
+        raise ValueError(f"Unknown content extractor: {extractor}")
+    return soup_content(html_content)
 
-def build_html_structure(toc, document_id, fingerprint, full_html, prefix="", parent_path="", progress_bar=None):
-    """Build HTML structure with separate subsection files and full section content in parent files."""
+def hash_text(text):
+    """Return the SHA-256 hex digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class TopicStore:
+    """
+    Per-document store of fetched topics keyed by (documentId, contentId, fingerprint).
+    Each topic is downloaded and parsed once; later lookups are served from the store.
+
+    With a topics_dir, extracted fragments are kept on disk by content hash instead of in
+    memory, and the store only holds each topic's hash and HTTP validators. Topics recorded
+    in a previous manifest are then revalidated with If-None-Match/If-Modified-Since, and a
+    304 reuses the stored fragment instead of downloading and parsing it again.
+
+    A progress_bar, which may be shared between documents, is advanced once per fetched topic.
+    """
+
+    def __init__(self, topics_dir=None, previous=None, progress_bar=None):
+        self.topics = {}
+        self.topics_dir = topics_dir
+        self.previous = previous or {}
+        self.progress_bar = progress_bar
+        self.fetches = 0
+        self.bytes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.changed = 0
+        self._lock = threading.Lock()
+        if topics_dir:
+            os.makedirs(topics_dir, exist_ok=True)
+
+    def _fragment_path(self, content_hash):
+        return os.path.join(self.topics_dir, f"{content_hash}.html")
+
+    def _conditional_headers(self, record):
+        """Build revalidation headers for a topic from the previous crawl, if its fragment is still on disk."""
+        if not record or not self.topics_dir or not os.path.exists(self._fragment_path(record["hash"])):
+            return {}
+        headers = {}
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    def _read_fragment(self, content_hash):
+        with open(self._fragment_path(content_hash), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _fetch(self, document_id, content_id, fingerprint):
+        """
+        Fetch a topic, revalidating it against the previous crawl when possible.
+        Returns the record to store and the extracted fragment (None if it is only on disk).
+        """
+        record = self.previous.get(content_id)
+        headers = self._conditional_headers(record)
+        try:
+            response = fetch_content_response(document_id, content_id, fingerprint, headers=headers or None)
+        except Exception as e:
+            logger.error(f"Failed to fetch content for topicId {content_id}: {e}")
+            html_content = f"<!-- Error fetching content for topicId {content_id}: {e} -->"
+            fragment = extract_content(html_content)
+            return {"html": html_content, "fragment": fragment, "hash": None}, fragment
+
+        if response.status_code == 304:
+            with self._lock:
+                self.revalidated += 1
+            return {"hash": record["hash"], "etag": record.get("etag"),
+                    "last_modified": record.get("last_modified")}, None
+
+        html_content = response.text
+        fragment = extract_content(html_content)
+        content_hash = hash_text(fragment)
+        with self._lock:
+            self.bytes += len(response.content)
+            if not record or record.get("hash") != content_hash:
+                self.changed += 1
+        topic = {"hash": content_hash, "etag": response.headers.get("ETag"),
+                 "last_modified": response.headers.get("Last-Modified")}
+        if self.topics_dir:
+            if not os.path.exists(self._fragment_path(content_hash)):
+                with open(self._fragment_path(content_hash), "w", encoding="utf-8") as f:
+                    f.write(fragment)
+        else:
+            topic.update(html=html_content, fragment=fragment)
+        return topic, fragment
+
+    def manifest_topics(self):
+        """Return the per-topic manifest records (content hash and HTTP validators) of this crawl."""
+        records = {}
+        for (_, content_id, _), topic in self.topics.items():
+            if topic["hash"] is None:  # Failed fetches are listed by failed_topics and retried on the next crawl
+                continue
+            records[content_id] = {"hash": topic["hash"], "etag": topic.get("etag"),
+                                   "last_modified": topic.get("last_modified")}
+        return records
+
+    def failed_topics(self):
+        """Return the sorted contentIds whose fetch failed in this crawl."""
+        return sorted({content_id for (_, content_id, _), topic in self.topics.items() if topic["hash"] is None})
+
+    def prune_fragments(self):
+        """Delete stored fragments that no topic of this crawl refers to."""
+        if not self.topics_dir:
+            return
+        keep = {f"{topic['hash']}.html" for topic in self.topics.values() if topic["hash"]}
+        for name in os.listdir(self.topics_dir):
+            if name not in keep:
+                os.remove(os.path.join(self.topics_dir, name))
+
+    def get(self, document_id, content_id, fingerprint):
+        """Return the stored topic, fetching and extracting it on first access."""
+        key = (document_id, content_id, fingerprint)
+        with self._lock:
+            topic = self.topics.get(key)
+            if topic is not None:
+                self.hits += 1
+        fragment = None
+        if topic is None:
+            topic, fragment = self._fetch(document_id, content_id, fingerprint)
+            with self._lock:
+                self.topics[key] = topic
+                self.fetches += 1
+            if self.progress_bar:
+                with _progress_lock:
+                    self.progress_bar.update(1)
+        if "fragment" in topic:
+            return topic
+        if fragment is None:
+            fragment = self._read_fragment(topic["hash"])
+        return {**topic, "fragment": fragment}
+
+    def prefetch(self, toc, document_id, fingerprint, workers=DEFAULT_WORKERS):
+        """
+        Fetch every topic in the TOC with up to `workers` concurrent requests.
+        Files are still assembled afterwards in TOC order, so only the fetching runs in parallel.
+        """
+        content_ids = list(dict.fromkeys(item["contentId"] for item in iter_toc(toc)))
+        pending = [cid for cid in content_ids if (document_id, cid, fingerprint) not in self.topics]
+        if workers <= 1 or not pending:
+            return
+
+        def fetch(content_id):
+            self.get(document_id, content_id, fingerprint)
+
+        logger.info(f"Prefetching {len(pending)} topics with {workers} workers")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(fetch, pending):
+                pass
+
+def render_section(item, fragment, prefix, number_prefix):
+    """Render a TOC item as a <section> holding its heading and content fragment."""
+    title = item["title"]
+    content_id = item["contentId"]
+    level = topic_level(item, prefix)
+    return f"<section id='{content_id}'><h{level}>{number_prefix} {title}</h{level}>{fragment}</section>"
+
+def split_template(title):
+    """Split HTML_TEMPLATE around its content for the given title, returning (head, tail)."""
+    head, tail = HTML_TEMPLATE.split("{content}")
+    return head.format(title=title), tail
+
+def copy_section_content(path, title, out, chunk_size=1 << 16):
+    """Stream the section content of a written section file (without its HTML wrapper) to out."""
+    head, tail = split_template(title)
+    with open(path, "r", encoding="utf-8") as f:
+        if f.read(len(head)) != head:
+            raise ValueError(f"Unexpected section file layout: {path}")
+        pending = ""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            pending += chunk
+            # Hold back enough characters to strip the template tail at the end
+            out.write(pending[:-len(tail)])
+            pending = pending[-len(tail):]
+    if pending != tail:
+        raise ValueError(f"Unexpected section file layout: {path}")
+
+class HashingWriter:
+    """Text writer wrapper that keeps a SHA-256 digest of everything written through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def write(self, text):
+        self.f.write(text)
+        self.sha.update(text.encode("utf-8"))
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
+
+class SectionWriter:
+    """
+    Writes section files, skipping those whose content is unchanged since the previous crawl.
+    Content hashes are keyed by file path relative to root_dir and recorded in the manifest.
+    """
+
+    def __init__(self, root_dir=".", previous=None):
+        self.root_dir = root_dir
+        self.previous = previous or {}
+        self.sections = {}
+        self.written = 0
+        self.unchanged = 0
+
+    def write(self, path, title, section, children=()):
+        """
+        Write a section file from its own <section> followed by the content of its already
+        written child section files (given as (path, title) pairs), streamed from disk.
+        The file is replaced only if it changed since the previous crawl. Returns True if written.
+        """
+        head, tail = split_template(title)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            out = HashingWriter(f)
+            out.write(head)
+            out.write(section)
+            for child_path, child_title in children:
+                out.write("\n")
+                copy_section_content(child_path, child_title, out)
+            out.write(tail)
+        rel_path = os.path.relpath(path, self.root_dir)
+        content_hash = out.hexdigest()
+        self.sections[rel_path] = content_hash
+        if self.previous.get(rel_path) == content_hash and os.path.exists(path):
+            os.remove(tmp_path)
+            self.unchanged += 1
+            return False
+        os.replace(tmp_path, path)
+        self.written += 1
+        return True
+
+    def remove_stale(self):
+        """Delete section files from the previous crawl that are no longer in the TOC."""
+        for rel_path in set(self.previous) - set(self.sections):
+            path = os.path.join(self.root_dir, rel_path)
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info(f"Deleted stale section file: {path}")
+        for dirpath, _, _ in os.walk(self.root_dir, topdown=False):
+            if dirpath != self.root_dir and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
+def build_html_structure(toc, document_id, fingerprint, full_doc=None, prefix="", parent_path="", progress_bar=None, topic_store=None, section_writer=None):
+    """
+    Build HTML structure with separate subsection files and full section content in parent files.
+    Sections are assembled bottom-up: children are written first and each parent file is produced
+    by streaming its own topic followed by its children's files from disk, so only one topic is
+    held in memory at a time. If full_doc (a writable text file) is given, each item's section and
+    all its subsections are appended to it in document order as soon as its subtree is written.
+    Returns, per item in toc, the (path, title) of its section file followed by those of all its
+    descendants in document order.
+    """
+    topic_store = topic_store if topic_store is not None else TopicStore()
+    section_writer = section_writer if section_writer is not None else SectionWriter()
+    subtrees = []
     for idx, item in enumerate(toc, start=1):
         title = item["title"]
-        content_id = item["contentId"]
-        topic_level = item.get("topic-level", len(prefix.split('.')) if prefix else 1)
         number_prefix = f"{prefix}{idx}" if prefix else str(idx)
         sanitized_title = sanitize_filename(title)
         numbered_title = f"{number_prefix}_{sanitized_title}"
         current_path = os.path.join(parent_path, numbered_title) if parent_path else numbered_title
+        section_title = f"{number_prefix} {title}"
 
-        # Fetch content for this item
-        html_content = fetch_content(document_id, content_id, fingerprint)
-        soup = BeautifulSoup(html_content, 'html.parser')
-        content_div = soup.find('div', class_='content-locale-en-US') or soup
-
-        # Build full content for this section (current item + subsections)
-        section_content = build_section_content([item], document_id, fingerprint, prefix)
+        # Write children first; their files make up the rest of this section
+        child_subtrees = []
+        if item["children"]:
+            child_subtrees = build_html_structure(item["children"], document_id, fingerprint, None, f"{number_prefix}.", current_path, progress_bar, topic_store, section_writer)
+        children = [subtree[0] for subtree in child_subtrees]
 
-        # Append to full HTML for the complete documentation
-        full_html.append(section_content)
+        # Fetch content for this item (once per document)
+        topic = topic_store.get(document_id, item["contentId"], fingerprint)
+        section = render_section(item, topic["fragment"], prefix, number_prefix)
+        del topic
 
         # Handle file writing based on level
         if not parent_path:  # Top-level section
             page_dir = os.path.join(parent_path, numbered_title) if parent_path else numbered_title
             os.makedirs(page_dir, exist_ok=True)
-            page_file = os.path.join(page_dir, f"{numbered_title}.html")
-            logger.info(f"Writing top-level section file (with subsections): {page_file}")
-            with open(page_file, "w", encoding="utf-8") as f:
-                f.write(HTML_TEMPLATE.format(title=f"{number_prefix} {title}", content=section_content))
+            section_file = os.path.join(page_dir, f"{numbered_title}.html")
+            if section_writer.write(section_file, section_title, section, children):
+                logger.info(f"Wrote top-level section file (with subsections): {section_file}")
         else:  # Subsection
             section_dir = parent_path
             os.makedirs(section_dir, exist_ok=True)
             section_file = os.path.join(section_dir, f"{numbered_title}.html")
-            logger.info(f"Writing subsection file (with aggregated sub-sections): {section_file}")
-            with open(section_file, "w", encoding="utf-8") as f:
-                f.write(HTML_TEMPLATE.format(title=f"{number_prefix} {title}", content=section_content))
+            if section_writer.write(section_file, section_title, section, children):
+                logger.info(f"Wrote subsection file (with aggregated sub-sections): {section_file}")
 
-        # Recurse into children
-        if item["children"]:
-            build_html_structure(item["children"], document_id, fingerprint, full_html, f"{number_prefix}.", current_path, progress_bar)
+        subtree = [(section_file, section_title)]
+        for child_subtree in child_subtrees:
+            subtree.extend(child_subtree)
+        subtrees.append(subtree)
+
+        # Append this section and every subsection to the full documentation
+        if full_doc is not None:
+            for path, path_title in subtree:
+                full_doc.write("\n")
+                copy_section_content(path, path_title, full_doc)
 
         # Update progress bar
         if progress_bar:
             progress_bar.update(1)
+    return subtrees
 
 def check_existing_files(doc_dir):
     """
@@ -188,56 +848,261 @@ def check_existing_files(doc_dir):
     return os.path.exists(full_html_file)
 
 def delete_existing_files(doc_dir):
-    """Delete existing HTML files and pages directory if they exist."""
-    full_html_file = os.path.join(doc_dir, "full_documentation.html")
-    pages_dir = os.path.join(doc_dir, "pages")
-    if os.path.exists(full_html_file):
-        os.remove(full_html_file)
-        logger.info(f"Deleted existing file: {full_html_file}")
-    if os.path.exists(pages_dir):
-        shutil.rmtree(pages_dir)
-        logger.info(f"Deleted existing directory: {pages_dir}")
-
-def process_document(pretty_url, product_folder, doc_name, update=False):
-    """Process a single document and save it under the product folder."""
+    """Delete existing HTML files, pages directory and crawl state if they exist."""
+    for file_name in ("full_documentation.html", MANIFEST_FILE):
+        file_path = os.path.join(doc_dir, file_name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            logger.info(f"Deleted existing file: {file_path}")
+    for dir_name in ("pages", TOPICS_DIR):
+        dir_path = os.path.join(doc_dir, dir_name)
+        if os.path.exists(dir_path):
+            shutil.rmtree(dir_path)
+            logger.info(f"Deleted existing directory: {dir_path}")
+
+def prepare_document(pretty_url, product_folder, doc_name, update=False):
+    """
+    Resolve a document and fetch its TOC (steps 1 to 3), returning a crawl job for
+    crawl_document, or None if the document is skipped.
+    A document with a manifest from a previous crawl is recrawled incrementally: it is skipped
+    if its fingerprint is unchanged, otherwise only new or changed topics are downloaded and
+    only the affected section files are rewritten. update=True forces a full recrawl.
+    """
     doc_output_dir = os.path.join(OUTPUT_DIR, product_folder, sanitize_filename(doc_name))
     pages_dir = os.path.join(doc_output_dir, "pages")
 
     # Check update flag and existing files (fully pulled means full_documentation.html exists)
-    if not update and check_existing_files(doc_output_dir):
-        logger.info(f"Skipping {doc_name} in {product_folder} as full_documentation.html already exists.")
-        return
-    elif update:
+    manifest = None
+    if update:
         delete_existing_files(doc_output_dir)
+    else:
+        manifest = load_manifest(doc_output_dir)
+        if manifest is None and check_existing_files(doc_output_dir):
+            logger.info(f"Skipping {doc_name} in {product_folder} as full_documentation.html already exists.")
+            return None
 
-    os.makedirs(pages_dir, exist_ok=True)
-    logger.info(f"Processing document: {doc_name} in {doc_output_dir}")
-
-    # Step 1: Get documentId
-    document_id, _ = fetch_pretty_url(pretty_url)
+    # Step 1: Get documentId (known from the manifest for documents crawled before)
+    if manifest and manifest.get("pretty_url") == pretty_url:
+        document_id = manifest["document_id"]
+    else:
+        document_id, _ = fetch_pretty_url(pretty_url)
 
     # Step 2: Get fingerprint
     fingerprint = fetch_document_map(document_id)
+    # Manifests without a TOC predate the Markdown pipeline; recrawl them (cheaply, by revalidation) to record it.
+    # Documents with topics that failed to fetch are recrawled too, so the failed topics are fetched again.
+    if (manifest and manifest.get("fingerprint") == fingerprint and "toc" in manifest and not manifest.get("failed")
+            and check_existing_files(doc_output_dir)):
+        logger.info(f"Skipping {doc_name} in {product_folder}: fingerprint {fingerprint} unchanged since last crawl.")
+        return None
 
     # Step 3: Get TOC and count items
     toc = fetch_pages(document_id, fingerprint)
-    total_items = count_toc_items(toc)
-    logger.info(f"Total TOC items to process for {doc_name}: {total_items}")
-
-    # Step 4: Build HTML and file structure with progress bar
-    full_html = [f"<!DOCTYPE html><html lang='en'><head><meta charset='UTF-8'><title>{doc_name}</title></head><body>"]
-    with tqdm(total=total_items, desc=f"Processing {doc_name}") as pbar:
-        build_html_structure(toc, document_id, fingerprint, full_html, progress_bar=pbar, parent_path=pages_dir)
-    full_html.append("</body></html>")
-
-    # Write full HTML file
-    full_html_file = os.path.join(doc_output_dir, "full_documentation.html")
-    logger.info(f"Writing full documentation: {full_html_file}")
-    with open(full_html_file, "w", encoding="utf-8") as f:
-        f.write("\n".join(full_html))
+    logger.info(f"Total TOC items to process for {doc_name}: {count_toc_items(toc)}")
+    return {
+        "pretty_url": pretty_url,
+        "product": product_folder,
+        "doc_name": doc_name,
+        "doc_dir": doc_output_dir,
+        "pages_dir": pages_dir,
+        "document_id": document_id,
+        "fingerprint": fingerprint,
+        "toc": toc,
+        "manifest": manifest,
+    }
+
+def crawl_document(job, workers=DEFAULT_WORKERS, progress_bar=None, markdown_dir=None):
+    """
+    Fetch and write a prepared document (step 4) and record its manifest.
+    progress_bar may be shared between documents; without one a per-document bar is shown.
+    With a markdown_dir, the document's Markdown is also written there from the fetched topic
+    fragments (see formatter.convert_document). Returns the crawl statistics of the document.
+    """
+    doc_name = job["doc_name"]
+    doc_output_dir = job["doc_dir"]
+    pages_dir = job["pages_dir"]
+    document_id = job["document_id"]
+    fingerprint = job["fingerprint"]
+    toc = job["toc"]
+    manifest = job["manifest"]
+    start = time.time()
+
+    os.makedirs(pages_dir, exist_ok=True)
+    logger.info(f"Processing document: {doc_name} in {doc_output_dir}")
+
+    # Step 4: Build HTML and file structure with progress bar, streaming the full documentation
+    own_progress_bar = progress_bar is None
+    if own_progress_bar:
+        progress_bar = tqdm(total=count_unique_topics(toc), desc=f"Processing {doc_name}")
+    topic_store = TopicStore(topics_dir=os.path.join(doc_output_dir, TOPICS_DIR),
+                             previous=manifest["topics"] if manifest else None,
+                             progress_bar=progress_bar)
+    section_writer = SectionWriter(pages_dir, previous=manifest["sections"] if manifest else None)
+    try:
+        if workers > 1:
+            topic_store.prefetch(toc, document_id, fingerprint, workers=workers)
+        full_html_file = os.path.join(doc_output_dir, "full_documentation.html")
+        tmp_full_html_file = f"{full_html_file}.tmp"
+        logger.info(f"Writing full documentation: {full_html_file}")
+        with open(tmp_full_html_file, "w", encoding="utf-8") as full_doc:
+            full_doc.write(f"<!DOCTYPE html><html lang='en'><head><meta charset='UTF-8'><title>{doc_name}</title></head><body>")
+            build_html_structure(toc, document_id, fingerprint, full_doc, parent_path=pages_dir, topic_store=topic_store, section_writer=section_writer)
+            full_doc.write("\n</body></html>")
+        os.replace(tmp_full_html_file, full_html_file)
+    finally:
+        if own_progress_bar:
+            progress_bar.close()
+    section_writer.remove_stale()
+    if markdown_dir:
+        def crawled_fragment(content_id):  # None for topics that failed to fetch, so they are reported as missing
+            topic = topic_store.get(document_id, content_id, fingerprint)
+            return topic["fragment"] if topic["hash"] is not None else None
+
+        markdown_doc_dir = os.path.join(markdown_dir, job["product"], sanitize_filename(doc_name))
+        convert_document(toc, crawled_fragment, markdown_doc_dir, doc_name)
+    avoided = count_legacy_fetches(toc) - topic_store.fetches
+    logger.info(f"Fetched {topic_store.fetches} topics ({topic_store.hits} store hits), avoided {avoided} redundant fetches")
+    if manifest:
+        logger.info(f"Incremental recrawl: {topic_store.changed} new or changed topics, {topic_store.revalidated} unchanged (304), "
+                    f"{section_writer.written} section files rewritten, {section_writer.unchanged} kept")
+
+    failed = topic_store.failed_topics()
+    if failed:
+        logger.warning(f"{len(failed)} topics of {doc_name} failed to fetch and will be retried on the next crawl: "
+                       f"{', '.join(failed)}")
+
+    # Record the crawl state for the next incremental recrawl
+    topic_store.prune_fragments()
+    save_manifest(doc_output_dir, {
+        "pretty_url": job["pretty_url"],
+        "document_id": document_id,
+        "fingerprint": fingerprint,
+        "toc": slim_toc(toc),
+        "topics": topic_store.manifest_topics(),
+        "failed": failed,
+        "sections": section_writer.sections,
+    })
     logger.info(f"Completed processing {doc_name}")
+    return {"product": job["product"], "doc_name": doc_name, "topics": topic_store.fetches,
+            "bytes": topic_store.bytes, "failed_topics": len(failed), "start": start, "end": time.time()}
+
+def process_document(pretty_url, product_folder, doc_name, update=False, workers=DEFAULT_WORKERS):
+    """Process a single document and save it under the product folder. Returns its crawl statistics, or None if skipped."""
+    job = prepare_document(pretty_url, product_folder, doc_name, update)
+    if job is None:
+        return None
+    return crawl_document(job, workers=workers)
+
+def summarize_throughput(results):
+    """Aggregate per-document crawl statistics into per-product throughput over wall-clock time."""
+    summary = {}
+    for result in results:
+        product = summary.setdefault(result["product"], {"documents": 0, "topics": 0, "bytes": 0,
+                                                          "start": result["start"], "end": result["end"]})
+        product["documents"] += 1
+        product["topics"] += result["topics"]
+        product["bytes"] += result["bytes"]
+        product["start"] = min(product["start"], result["start"])
+        product["end"] = max(product["end"], result["end"])
+    for product in summary.values():
+        elapsed = max(product.pop("end") - product.pop("start"), 1e-9)
+        product["seconds"] = elapsed
+        product["topics_per_sec"] = product["topics"] / elapsed
+        product["bytes_per_sec"] = product["bytes"] / elapsed
+    return summary
+
+def crawl_doctree(doctree, jobs=DEFAULT_JOBS, workers=DEFAULT_WORKERS, markdown_dir=None):
+    """
+    Crawl every linked document in the doctree with up to `jobs` documents in flight, also
+    writing each one's Markdown under markdown_dir if given.
+    All documents are prepared first (pretty URL, fingerprint and TOC) and then crawled largest
+    TOC first, so the longest job does not start last. Progress is shown on one bar for the whole
+    run, and a failing document is logged without stopping the others.
+    Returns the per-product throughput summary and the (product, document) pairs that failed,
+    including documents written with topics that failed to fetch.
+    """
+    documents = [(sanitize_filename(product["name"]), doc)
+                 for product in doctree["children"] for doc in product["children"] if doc.get("link")]
+    failures = []
+
+    def prepare(entry):
+        product_name, doc = entry
+        try:
+            return prepare_document(doc["link"], product_name, doc["name"], doc.get("update", False))
+        except Exception as e:
+            logger.error(f"Failed to prepare {doc['name']} in {product_name}: {e}")
+            failures.append((product_name, doc["name"]))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        prepared = [job for job in executor.map(prepare, documents) if job is not None]
+    prepared.sort(key=lambda job: count_toc_items(job["toc"]), reverse=True)
+    logger.info(f"Crawling {len(prepared)} documents ({len(documents) - len(prepared) - len(failures)} up to date) "
+                f"with {jobs} jobs")
+
+    results = []
+
+    def crawl(job):
+        try:
+            result = crawl_document(job, workers=workers, progress_bar=progress_bar, markdown_dir=markdown_dir)
+            results.append(result)
+            if result["failed_topics"]:
+                failures.append((job["product"], job["doc_name"]))
+        except Exception as e:
+            logger.error(f"Failed to crawl {job['doc_name']} in {job['product']}: {e}")
+            failures.append((job["product"], job["doc_name"]))
+
+    total_topics = sum(count_unique_topics(job["toc"]) for job in prepared)
+    with tqdm(total=total_topics, desc="Crawling documentation") as progress_bar:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for _ in executor.map(crawl, prepared):
+                pass
+
+    summary = summarize_throughput(results)
+    for product_name, product in summary.items():
+        logger.info(f"{product_name}: {product['documents']} documents, {product['topics']} topics, "
+                    f"{product['bytes'] / 1024:.0f} KB in {product['seconds']:.1f}s "
+                    f"({product['topics_per_sec']:.1f} topics/sec, {product['bytes_per_sec'] / 1024:.1f} KB/sec)")
+    for product_name, doc_name in failures:
+        logger.error(f"Failed document: {doc_name} in {product_name}")
+    return summary, failures
+
+def parse_args():
+    """Parse command-line arguments for the crawler."""
+    parser = argparse.ArgumentParser(description="Crawl Cortex documentation listed in doctree.json.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Concurrent topic fetches per document (1 crawls sequentially)")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS,
+                        help="Documents crawled at the same time")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="Cap on concurrent HTTP requests across all documents")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="Maximum requests per second across the crawl (0 for no limit)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory of the on-disk HTTP response cache (disabled if not set)")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_MB,
+                        help="Size limit of the cached response bodies in MB")
+    parser.add_argument("--extractor", choices=("scan", "soup"), default=DEFAULT_EXTRACTOR,
+                        help="Topic content extractor: soup parses the whole page, scan only the content div "
+                             "(faster when pages carry a lot of navigation); the output is the same")
+    parser.add_argument("--markdown-dir",
+                        help="Also write each crawled document as Markdown under this directory, converted from its topics")
+    parser.add_argument("--offline", action="store_true",
+                        help="Replay every request from the HTTP cache without touching the network")
+    args = parser.parse_args()
+    if args.offline and not args.cache_dir:
+        parser.error("--offline requires --cache-dir")
+    return args
 
 def main():
+    global request_limiter, http_cache, content_extractor
+    args = parse_args()
+    content_extractor = args.extractor
+    request_limiter = RequestLimiter(rate=args.rate, max_concurrency=args.max_in_flight)
+    if args.cache_dir:
+        http_cache = HTTPCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024, offline=args.offline)
+        logger.info(f"HTTP cache enabled at {args.cache_dir}{' (offline replay)' if args.offline else ''}")
+
     # Load the doctree.json file
     with open("doctree.json", "r", encoding="utf-8") as f:
         doctree = json.load(f)
@@ -246,18 +1111,13 @@ def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     logger.info(f"Base output directory setup: {OUTPUT_DIR}")
 
-    # Process each product and its children
-    for product in doctree["children"]:
-        product_name = sanitize_filename(product["name"])
-        logger.info(f"Processing product: {product_name}")
-        
-        for doc in product["children"]:
-            doc_name = doc["name"]
-            pretty_url = doc.get("link")
-            update = doc.get("update", False)
-            if pretty_url:  # Only process if link exists
-                process_document(pretty_url, product_name, doc_name, update)
+    # Process every product's documents
+    _, failures = crawl_doctree(doctree, jobs=args.jobs, workers=args.workers, markdown_dir=args.markdown_dir)
 
+    log_request_stats()
+    if failures:
+        logger.error(f"{len(failures)} documents failed or are incomplete; crawl again to retry them")
+        sys.exit(1)
     logger.info("All documentation generation complete")
 
 if __name__ == "__main__":
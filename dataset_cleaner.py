@@ -1,45 +1,44 @@
+import os
+import sys
 import json
-from typing import List, Dict
+import time
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
 
-def load_dataset(file_path: str) -> List[Dict]:
+from dataset_io import DatasetWriter, iter_records
+from xql_validator import validate_xql
+
+EXAMPLES_PER_RULE = 20
+
+def add_issue(issues: Dict[str, List[str]], level: str, rule: str, message: str, location: Dict = None) -> None:
     """
-    Load the dataset from a JSON file and return it as a list of dictionaries.
+    Record an issue message under 'errors' or 'warnings' along with its rule code and, for XQL
+    issues, its location (message number, line and column).
     """
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            dataset = json.load(f)
-        if not isinstance(dataset, list):
-            raise ValueError("Dataset must be a JSON list of conversations.")
-        return dataset
-    except FileNotFoundError:
-        print(f"Error: Dataset file '{file_path}' not found.")
-        return []
-    except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON in '{file_path}': {str(e)}")
-        return []
-    except Exception as e:
-        print(f"Error: Unexpected error loading dataset: {str(e)}")
-        return []
+    issues[level].append(message)
+    issues["rules"].append((level, rule, message, location))
 
 def validate_conversation(conversation: Dict, index: int) -> Dict[str, List[str]]:
     """
     Validate a single conversation entry in ShareGPT format.
-    Returns a dictionary of errors and warnings.
+    Returns a dictionary of errors and warnings, plus the rule code of each issue.
     """
-    issues = {"errors": [], "warnings": []}
+    issues = {"errors": [], "warnings": [], "rules": []}
 
     # Check for required 'conversations' key
     if "conversations" not in conversation:
-        issues["errors"].append(f"Entry {index}: Missing 'conversations' key.")
+        add_issue(issues, "errors", "missing_conversations", f"Entry {index}: Missing 'conversations' key.")
         return issues
 
     conversations = conversation["conversations"]
     if not isinstance(conversations, list):
-        issues["errors"].append(f"Entry {index}: 'conversations' must be a list.")
+        add_issue(issues, "errors", "conversations_not_list", f"Entry {index}: 'conversations' must be a list.")
         return issues
 
     if len(conversations) == 0:
-        issues["errors"].append(f"Entry {index}: 'conversations' list is empty.")
+        add_issue(issues, "errors", "empty_conversations", f"Entry {index}: 'conversations' list is empty.")
         return issues
 
     # Track roles for order validation
@@ -49,77 +48,167 @@ def validate_conversation(conversation: Dict, index: int) -> Dict[str, List[str]
     for i, message in enumerate(conversations):
         # Ensure message is a dictionary
         if not isinstance(message, dict):
-            issues["errors"].append(f"Entry {index}, Message {i}: Message must be a dictionary.")
+            add_issue(issues, "errors", "message_not_dict", f"Entry {index}, Message {i}: Message must be a dictionary.")
             continue
 
         # Check required fields
         if "from" not in message:
-            issues["errors"].append(f"Entry {index}, Message {i}: Missing 'from' field.")
+            add_issue(issues, "errors", "missing_from", f"Entry {index}, Message {i}: Missing 'from' field.")
         if "value" not in message:
-            issues["errors"].append(f"Entry {index}, Message {i}: Missing 'value' field.")
+            add_issue(issues, "errors", "missing_value", f"Entry {index}, Message {i}: Missing 'value' field.")
 
         # Validate role
         role = message.get("from", "").lower()
         if role not in ["human", "gpt", "system"]:
-            issues["warnings"].append(f"Entry {index}, Message {i}: Unknown role '{role}'.")
+            add_issue(issues, "warnings", "unknown_role", f"Entry {index}, Message {i}: Unknown role '{role}'.")
         else:
             if role in ["human", "gpt"]:
                 expected_role = role_pattern[current_role_index % 2]
                 if role != expected_role:
-                    issues["warnings"].append(f"Entry {index}, Message {i}: Role '{role}' out of order.")
+                    add_issue(issues, "warnings", "role_order", f"Entry {index}, Message {i}: Role '{role}' out of order.")
                 current_role_index += 1
 
         # Validate value
         value = message.get("value", "").strip()
         if not value:
-            issues["errors"].append(f"Entry {index}, Message {i}: 'value' is empty or whitespace.")
+            add_issue(issues, "errors", "empty_value", f"Entry {index}, Message {i}: 'value' is empty or whitespace.")
 
         # Additional checks
         if role == "human" and len(value.split()) < 2:
-            issues["warnings"].append(f"Entry {index}, Message {i}: Human prompt '{value}' is too short.")
-        if role == "gpt":
-            if "datamodel" not in value.lower() and "preset" not in value.lower():
-                issues["warnings"].append(f"Entry {index}, Message {i}: GPT response may not be a valid XQL query.")
+            add_issue(issues, "warnings", "short_prompt", f"Entry {index}, Message {i}: Human prompt '{value}' is too short.")
+        if role == "gpt" and value:
+            for xql_issue in validate_xql(message["value"]):
+                add_issue(issues, "errors" if xql_issue.severity == "error" else "warnings", f"xql_{xql_issue.rule}",
+                          f"Entry {index}, Message {i}: XQL line {xql_issue.line}, column {xql_issue.column}: "
+                          f"{xql_issue.message}.",
+                          {"message": i, "line": xql_issue.line, "column": xql_issue.column})
 
     # Ensure both human and gpt messages exist
     human_count = sum(1 for msg in conversations if msg.get("from", "").lower() == "human")
     gpt_count = sum(1 for msg in conversations if msg.get("from", "").lower() == "gpt")
     if human_count == 0 or gpt_count == 0:
-        issues["errors"].append(f"Entry {index}: Missing human or gpt messages.")
+        add_issue(issues, "errors", "missing_role", f"Entry {index}: Missing human or gpt messages.")
 
     return issues
 
-def validate_dataset(file_path: str) -> List[Dict]:
+def validate_batch(start_index: int, entries: List) -> List[Dict[str, List[str]]]:
+    """Validate a batch of entries in a worker process; entry numbers start at start_index."""
+    results = []
+    for index, entry in enumerate(entries, start_index):
+        try:
+            if not isinstance(entry, dict):
+                issues = {"errors": [], "warnings": [], "rules": []}
+                add_issue(issues, "errors", "entry_not_dict", f"Entry {index}: Entry must be a dictionary.")
+            else:
+                issues = validate_conversation(entry, index)
+        except Exception as e:
+            issues = {"errors": [], "warnings": [], "rules": []}
+            add_issue(issues, "errors", "invalid_entry", f"Entry {index}: Could not be validated: {e}")
+        results.append(issues)
+    return results
+
+def iter_batches(file_path: str, batch_size: int) -> Iterator:
+    """Group streamed entries into (start_index, entries, read_errors) batches."""
+    batch, read_errors = [], {}
+    start_index = 1
+    for entry, error in iter_records(file_path):
+        if error is not None:
+            read_errors[len(batch)] = error
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield start_index, batch, read_errors
+            start_index += len(batch)
+            batch, read_errors = [], {}
+    if batch:
+        yield start_index, batch, read_errors
+
+def iter_validated(file_path: str, workers: int, batch_size: int) -> Iterator:
     """
-    Validate the dataset and return only conversations with no errors or warnings.
+    Yield (index, entry, issues) for every entry in file order. Batches are validated on a
+    process pool with at most 2 * workers batches in flight, so memory stays bounded.
     """
-    dataset = load_dataset(file_path)
-    if not dataset:
-        return []
+    batches = iter_batches(file_path, batch_size)
+
+    def merge(start_index, entries, read_errors, results):
+        for offset, (entry, issues) in enumerate(zip(entries, results)):
+            if offset in read_errors:
+                issues = {"errors": [], "warnings": [], "rules": []}
+                add_issue(issues, "errors", "invalid_json", f"Entry {start_index + offset}: {read_errors[offset]}")
+            yield start_index + offset, entry, issues
+
+    if workers <= 1:
+        for start_index, entries, read_errors in batches:
+            yield from merge(start_index, entries, read_errors, validate_batch(start_index, entries))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for start_index, entries, read_errors in batches:
+            in_flight.append((start_index, entries, read_errors, executor.submit(validate_batch, start_index, entries)))
+            if len(in_flight) >= 2 * workers:
+                start_index, entries, read_errors, future = in_flight.popleft()
+                yield from merge(start_index, entries, read_errors, future.result())
+        while in_flight:
+            start_index, entries, read_errors, future = in_flight.popleft()
+            yield from merge(start_index, entries, read_errors, future.result())
 
-    valid_entries = []
+def validate_dataset(file_path: str, output_file: str, report_file: str = None, workers: int = 1,
+                     batch_size: int = 256, verbose: bool = False) -> Optional[Dict]:
+    """
+    Stream-validate the dataset, write conversations with no errors or warnings to output_file
+    in their original order, and return (and optionally save) a report with counts per rule.
+    Returns None if the dataset could not be read; output_file is then left as it was.
+    """
+    start_time = time.time()
     error_count = 0
     warning_only_count = 0
     clean_count = 0
+    total_entries = 0
+    rule_counts = Counter()
+    rule_levels = {}
+    rule_examples = {}
+    writer = DatasetWriter(output_file)
 
-    for i, entry in enumerate(dataset, 1):
-        issues = validate_conversation(entry, i)
-        if issues["errors"]:
-            error_count += 1
-            print(f"\nEntry {i} - Errors ({len(issues['errors'])}):")
-            for error in issues["errors"]:
-                print(f"  - {error}")
-        elif issues["warnings"]:
-            warning_only_count += 1
-            print(f"\nEntry {i} - Warnings ({len(issues['warnings'])}):")
-            for warning in issues["warnings"]:
-                print(f"  - {warning}")
-        else:
-            valid_entries.append(entry)
-            clean_count += 1
+    try:
+        for i, entry, issues in iter_validated(file_path, workers, batch_size):
+            total_entries += 1
+            for level, rule in set((level, rule) for level, rule, _, _ in issues["rules"]):
+                rule_counts[rule] += 1
+                rule_levels[rule] = level
+            for _, rule, message, location in issues["rules"]:
+                examples = rule_examples.setdefault(rule, [])
+                if len(examples) < EXAMPLES_PER_RULE:
+                    examples.append({"entry": i, "text": message, **(location or {})})
+            if issues["errors"]:
+                error_count += 1
+                if verbose:
+                    print(f"\nEntry {i} - Errors ({len(issues['errors'])}):")
+                    for error in issues["errors"]:
+                        print(f"  - {error}")
+            elif issues["warnings"]:
+                warning_only_count += 1
+                if verbose:
+                    print(f"\nEntry {i} - Warnings ({len(issues['warnings'])}):")
+                    for warning in issues["warnings"]:
+                        print(f"  - {warning}")
+            else:
+                writer.write(entry)
+                clean_count += 1
+    except FileNotFoundError:
+        writer.abort()
+        print(f"Error: Dataset file '{file_path}' not found.")
+        return None
+    except ValueError as e:
+        writer.abort()
+        print(f"Error: Invalid JSON in '{file_path}': {str(e)}")
+        return None
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    elapsed = time.time() - start_time
 
     # Print summary
-    total_entries = len(dataset)
     print("=" * 50)
     print("Validation Summary:")
     print(f"Total entries: {total_entries}")
@@ -128,26 +217,51 @@ def validate_dataset(file_path: str) -> List[Dict]:
     print(f"Clean entries: {clean_count}")
     print(f"Removed entries: {error_count + warning_only_count}")
     print(f"Kept entries: {clean_count}")
+    for rule, count in rule_counts.most_common():
+        print(f"  {rule} ({rule_levels[rule][:-1]}): {count} entries")
+    print(f"Clean dataset saved to '{output_file}' with {clean_count} entries in {elapsed:.2f} seconds.")
 
-    return valid_entries
+    report = {
+        "input_file": file_path,
+        "output_file": output_file,
+        "total_entries": total_entries,
+        "entries_with_errors": error_count,
+        "entries_with_warnings_only": warning_only_count,
+        "kept_entries": clean_count,
+        "rules": {
+            rule: {"level": rule_levels[rule][:-1], "entries": count, "examples": rule_examples[rule]}
+            for rule, count in sorted(rule_counts.items())
+        },
+        "elapsed_seconds": round(elapsed, 3),
+    }
+    if report_file:
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Validation report saved to '{report_file}'.")
+    return report
 
-def save_dataset(valid_entries: List[Dict], output_file: str) -> None:
-    """
-    Save the valid entries to a new JSON file.
-    """
-    try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(valid_entries, f, indent=2)
-        print(f"Clean dataset saved to '{output_file}' with {len(valid_entries)} entries.")
-    except Exception as e:
-        print(f"Error saving clean dataset: {str(e)}")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Validate a ShareGPT dataset and keep only clean conversations.")
+    parser.add_argument("input_file", nargs="?", default="dataset.json",
+                        help="Dataset to validate, as a JSON array or JSONL (default: dataset.json)")
+    parser.add_argument("--output", default="clean_dataset.json",
+                        help="Where to write clean entries; a .jsonl suffix writes JSONL (default: clean_dataset.json)")
+    parser.add_argument("--report", default="clean_dataset.report.json",
+                        help="Where to write the JSON validation report (default: clean_dataset.report.json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Validation processes (default: number of CPUs)")
+    parser.add_argument("--batch-size", type=int, default=256,
+                        help="Entries sent to a worker at a time (default: 256)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print every issue, not just the summary")
+    return parser.parse_args()
 
 def main():
     """Run the validation and save the clean dataset."""
-    file_path = "dataset.json"
-    valid_entries = validate_dataset(file_path)
-    if valid_entries:
-        save_dataset(valid_entries, "clean_dataset.json")
+    args = parse_args()
+    report = validate_dataset(args.input_file, args.output, args.report, args.workers, args.batch_size, args.verbose)
+    if report is None:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
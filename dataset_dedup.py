@@ -0,0 +1,381 @@
+import os
+import sys
+import re
+import json
+import time
+import struct
+import hashlib
+import argparse
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dataset_io import DatasetWriter, iter_records
+
+HASHES_PER_DIGEST = 16  # 32-bit MinHash values per 64-byte blake2b digest
+MAX_LENGTH = 0xFFFFFFFF
+XQL_TOKEN_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|//[^\n]*|[\w.]+|[^\s\w]')
+PROMPT_TOKEN_RE = re.compile(r'\w+')
+
+def entry_texts(entry) -> Tuple[str, str]:
+    """Return (prompt, xql) from a ShareGPT entry or a prompt/response entry."""
+    if not isinstance(entry, dict):
+        return "", ""
+    if isinstance(entry.get("conversations"), list):
+        prompt = xql = ""
+        for message in entry["conversations"]:
+            if not isinstance(message, dict):
+                continue
+            role = str(message.get("from", "")).lower()
+            if role == "human" and not prompt:
+                prompt = str(message.get("value", ""))
+            elif role == "gpt" and not xql:
+                xql = str(message.get("value", ""))
+        return prompt, xql
+    return str(entry.get("prompt", "")), str(entry.get("response", ""))
+
+def xql_tokens(xql: str) -> List[str]:
+    """Tokenize XQL, dropping // comments and lowercasing everything but string literals."""
+    tokens = []
+    for token in XQL_TOKEN_RE.findall(xql):
+        if token.startswith('//'):
+            continue
+        tokens.append(token if token[0] in '"\'' else token.lower())
+    return tokens
+
+def prompt_tokens(prompt: str) -> List[str]:
+    return PROMPT_TOKEN_RE.findall(prompt.lower())
+
+def shingles(tokens: List[str], size: int) -> set:
+    """Token n-grams of the given size (the whole text if it is shorter), encoded for hashing."""
+    if len(tokens) <= size:
+        return {'\x1f'.join(tokens).encode('utf-8')}
+    return {'\x1f'.join(tokens[i:i + size]).encode('utf-8') for i in range(len(tokens) - size + 1)}
+
+def minhash(shingle_set: set, num_perm: int) -> List[int]:
+    """
+    MinHash signature of a set of shingles. Each group of 16 hash functions is one blake2b digest
+    with its own salt, and the per-function minimum is taken column-wise, which keeps the work per
+    shingle in C instead of one Python expression per permutation.
+    """
+    salts = [struct.pack('<Q', group) for group in range(num_perm // HASHES_PER_DIGEST)]
+    unpack = struct.Struct(f'<{num_perm}I').unpack
+    rows = [
+        unpack(b''.join(hashlib.blake2b(shingle, digest_size=64, salt=salt).digest() for salt in salts))
+        for shingle in shingle_set
+    ]
+    return list(map(min, zip(*rows)))
+
+def signature_batch(entries: List, config: Dict) -> List[Tuple]:
+    """
+    Compute (exact xql hash, prompt length, prompt signature, xql signature) for a batch of entries.
+    Signatures are None for empty texts or fields that near-duplicate matching does not use.
+    """
+    results = []
+    for entry in entries:
+        prompt, xql = entry_texts(entry)
+        tokens = xql_tokens(xql)
+        exact = hashlib.blake2b(' '.join(tokens).encode('utf-8'), digest_size=8).digest() if tokens else None
+        prompt_sig = xql_sig = None
+        if config["near"]:
+            words = prompt_tokens(prompt)
+            if words and config["match"] != "xql":
+                prompt_sig = minhash(shingles(words, config["prompt_shingle"]), config["num_perm"])
+            if tokens and config["match"] != "prompt":
+                xql_sig = minhash(shingles(tokens, config["xql_shingle"]), config["num_perm"])
+        results.append((exact, len(prompt), prompt_sig, xql_sig))
+    return results
+
+def iter_signatures(file_path: str, config: Dict, workers: int, batch_size: int) -> Iterator:
+    """Yield signature tuples in file order, computing batches on a bounded process pool."""
+    def batches():
+        batch = []
+        for entry, _ in iter_records(file_path):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    if workers <= 1:
+        for batch in batches():
+            yield from signature_batch(batch, config)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for batch in batches():
+            in_flight.append(executor.submit(signature_batch, batch, config))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+class UnionFind:
+    """Disjoint sets over entry indices, stored in a compact array."""
+
+    def __init__(self):
+        self.parent = array('q')
+
+    def add(self) -> int:
+        self.parent.append(len(self.parent))
+        return len(self.parent) - 1
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(self, a: int, b: int) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # The earlier entry stays the root, so roots are cluster representatives
+            if root_a < root_b:
+                self.parent[root_b] = root_a
+            else:
+                self.parent[root_a] = root_b
+
+def similarity(sig_a, sig_b) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+class LSHIndex:
+    """
+    Banded MinHash LSH. Each band bucket remembers the first entry that landed in it, and new
+    signatures are only compared with those representatives, so the cost per entry is at most
+    one comparison per band instead of one per entry.
+    """
+
+    def __init__(self, num_perm: int, bands: int):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.rows = num_perm // bands
+        self.buckets = [{} for _ in range(bands)]
+
+    def band_keys(self, sig: List[int]) -> Iterator[int]:
+        for band in range(len(self.buckets)):
+            yield hash(tuple(sig[band * self.rows:(band + 1) * self.rows]))
+
+    def candidates(self, sig: List[int]) -> List[int]:
+        """Return the representatives of the buckets sig falls into."""
+        found = []
+        for buckets, key in zip(self.buckets, self.band_keys(sig)):
+            representative = buckets.get(key)
+            if representative is not None and representative not in found:
+                found.append(representative)
+        return found
+
+    def insert(self, i: int, sig: List[int]) -> bool:
+        """Make entry i the representative of any empty buckets it falls into. Returns True if it became one."""
+        added = False
+        for buckets, key in zip(self.buckets, self.band_keys(sig)):
+            if key not in buckets:
+                buckets[key] = i
+                added = True
+        return added
+
+def is_near_duplicate(sigs: Dict, other: Dict, match: str, threshold: float) -> bool:
+    """Compare two entries' signatures under the configured match mode."""
+    if match == "either":
+        return any(
+            sigs[field] is not None and other[field] is not None and similarity(sigs[field], other[field]) >= threshold
+            for field in ("prompt", "xql")
+        )
+    fields = ("prompt", "xql") if match == "both" else (match,)
+    return all(similarity(sigs[field], other[field]) >= threshold for field in fields)
+
+def find_duplicates(file_path: str, config: Dict, workers: int, batch_size: int):
+    """
+    First pass: cluster entries by exact normalized XQL and, unless disabled, by MinHash/LSH
+    near-duplicate matching. Returns (clusters, exact hashes, prompt lengths, entry count).
+    """
+    clusters = UnionFind()
+    exact_seen = {}
+    exact_hashes = []
+    prompt_lengths = array('I')
+    match = config["match"]
+    # "both" only needs candidates from one field, since a duplicate must be similar in both
+    required = {"both": ("prompt", "xql"), "xql": ("xql",), "prompt": ("prompt",), "either": ()}[match]
+    index_fields = {"both": ("xql",), "xql": ("xql",), "prompt": ("prompt",), "either": ("prompt", "xql")}[match]
+    indexes = {field: LSHIndex(config["num_perm"], config["bands"]) for field in index_fields}
+    representatives = {}  # Signatures of entries that represent at least one LSH bucket
+    count = 0
+
+    for exact, prompt_length, prompt_sig, xql_sig in iter_signatures(file_path, config, workers, batch_size):
+        i = clusters.add()
+        count += 1
+        exact_hashes.append(exact)
+        prompt_lengths.append(min(prompt_length, MAX_LENGTH))
+        if exact is not None:
+            if exact in exact_seen:
+                clusters.union(exact_seen[exact], i)
+            else:
+                exact_seen[exact] = i
+        sigs = {"prompt": prompt_sig, "xql": xql_sig}
+        if not config["near"] or any(sigs[field] is None for field in required):
+            continue
+        is_representative = False
+        for field, index in indexes.items():
+            if sigs[field] is None:
+                continue
+            for candidate in index.candidates(sigs[field]):
+                if is_near_duplicate(sigs, representatives[candidate], match, config["threshold"]):
+                    clusters.union(candidate, i)
+            is_representative |= index.insert(i, sigs[field])
+        if is_representative:
+            representatives[i] = {
+                field: array('I', sig) if sig is not None else None for field, sig in sigs.items()
+            }
+    return clusters, exact_hashes, prompt_lengths, count
+
+def select_kept(clusters: UnionFind, exact_hashes: List, prompt_lengths, count: int, keep: str):
+    """
+    Apply the keep policy to every cluster with more than one entry.
+    Returns (dropped flags, cluster records); record indices are 1-based like the cleaner's entry numbers.
+    """
+    sizes = array('I', bytes(4 * count))
+    for i in range(count):
+        sizes[clusters.find(i)] += 1
+    groups = {}
+    for i in range(count):
+        root = clusters.find(i)
+        if sizes[root] > 1:
+            groups.setdefault(root, []).append(i)
+
+    dropped = bytearray(count)
+    records = []
+    for members in groups.values():
+        if keep == "first":
+            kept = members[0]
+        elif keep == "last":
+            kept = members[-1]
+        else:
+            kept = max(members, key=lambda i: (prompt_lengths[i], -i))
+        for i in members:
+            if i != kept:
+                dropped[i] = 1
+        exact = exact_hashes[members[0]] is not None and all(exact_hashes[i] == exact_hashes[members[0]] for i in members)
+        records.append({
+            "kept": kept + 1,
+            "removed": [i + 1 for i in members if i != kept],
+            "type": "exact" if exact else "near",
+        })
+    records.sort(key=lambda record: record["kept"])
+    return dropped, records
+
+def dedup_dataset(file_path: str, output_file: str, report_file: str = None, keep: str = "first",
+                  match: str = "both", threshold: float = 0.8, near: bool = True, num_perm: int = 64,
+                  bands: int = 16, workers: int = 1, batch_size: int = 512) -> Optional[Dict]:
+    """
+    Remove exact and near-duplicate entries from a dataset, streaming the survivors to output_file
+    in their original order, and return (and optionally save) a report of the duplicate clusters.
+    Returns None, writing nothing, if the dataset is missing or unreadable.
+    """
+    start_time = time.time()
+    config = {
+        "match": match, "threshold": threshold, "near": near, "num_perm": num_perm, "bands": bands,
+        "prompt_shingle": 2, "xql_shingle": 3,
+    }
+    if num_perm % bands or num_perm % HASHES_PER_DIGEST:
+        raise ValueError("num_perm must be a multiple of 16 and of bands")
+    try:
+        clusters, exact_hashes, prompt_lengths, count = find_duplicates(file_path, config, workers, batch_size)
+    except FileNotFoundError:
+        print(f"Error: Dataset file '{file_path}' not found.")
+        return None
+    except ValueError as e:
+        print(f"Error: Invalid JSON in '{file_path}': {str(e)}")
+        return None
+    dropped, records = select_kept(clusters, exact_hashes, prompt_lengths, count, keep)
+    kept_records = {record["kept"] - 1: record for record in records}
+
+    # Second pass: stream the survivors and attach the kept prompt to each cluster record
+    invalid = 0
+    with DatasetWriter(output_file) as writer:
+        for i, (entry, error) in enumerate(iter_records(file_path)):
+            if error is not None:
+                invalid += 1
+                continue
+            if dropped[i]:
+                continue
+            writer.write(entry)
+            if i in kept_records:
+                kept_records[i]["prompt"] = entry_texts(entry)[0][:200]
+    elapsed = time.time() - start_time
+
+    removed = sum(len(record["removed"]) for record in records)
+    exact_removed = sum(len(record["removed"]) for record in records if record["type"] == "exact")
+    print("=" * 50)
+    print("Deduplication Summary:")
+    print(f"Total entries: {count}")
+    print(f"Duplicate clusters: {len(records)}")
+    print(f"Removed entries: {removed} ({exact_removed} in exact-XQL clusters, {removed - exact_removed} in near-duplicate clusters)")
+    if invalid:
+        print(f"Unparseable entries skipped: {invalid}")
+    print(f"Kept entries: {writer.count}")
+    print(f"Deduplicated dataset saved to '{output_file}' in {elapsed:.2f} seconds.")
+
+    report = {
+        "input_file": file_path,
+        "output_file": output_file,
+        "settings": {"keep": keep, "match": match, "threshold": threshold, "near": near,
+                     "num_perm": num_perm, "bands": bands},
+        "total_entries": count,
+        "kept_entries": writer.count,
+        "removed_entries": removed,
+        "exact_cluster_removed": exact_removed,
+        "near_cluster_removed": removed - exact_removed,
+        "invalid_entries": invalid,
+        "elapsed_seconds": round(elapsed, 3),
+        "clusters": records,
+    }
+    if report_file:
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Cluster report saved to '{report_file}'.")
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Remove exact and near-duplicate conversations from a dataset.")
+    parser.add_argument("input_file", nargs="?", default="clean_dataset.json",
+                        help="Dataset to deduplicate, as a JSON array or JSONL (default: clean_dataset.json)")
+    parser.add_argument("--output", default="dedup_dataset.json",
+                        help="Where to write kept entries; a .jsonl suffix writes JSONL (default: dedup_dataset.json)")
+    parser.add_argument("--report", default="dedup_dataset.report.json",
+                        help="Where to write the cluster report (default: dedup_dataset.report.json)")
+    parser.add_argument("--keep", choices=["first", "last", "longest"], default="first",
+                        help="Which entry of a cluster to keep; 'longest' keeps the longest prompt (default: first)")
+    parser.add_argument("--match", choices=["both", "either", "xql", "prompt"], default="both",
+                        help="Fields that must be similar for a near duplicate (default: both)")
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="Estimated Jaccard similarity for near duplicates (default: 0.8)")
+    parser.add_argument("--exact-only", action="store_true",
+                        help="Only remove entries whose normalized XQL is identical")
+    parser.add_argument("--num-perm", type=int, default=64,
+                        help="MinHash hash functions per signature, a multiple of 16 (default: 64)")
+    parser.add_argument("--bands", type=int, default=16,
+                        help="LSH bands; must divide --num-perm (default: 16)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes computing signatures (default: number of CPUs)")
+    parser.add_argument("--batch-size", type=int, default=512,
+                        help="Entries sent to a worker at a time (default: 512)")
+    return parser.parse_args()
+
+def main():
+    """Run deduplication and save the deduplicated dataset."""
+    args = parse_args()
+    if args.num_perm % args.bands or args.num_perm % HASHES_PER_DIGEST:
+        raise SystemExit("--num-perm must be a multiple of 16 and of --bands")
+    report = dedup_dataset(args.input_file, args.output, args.report, args.keep, args.match, args.threshold,
+                           not args.exact_only, args.num_perm, args.bands, args.workers, args.batch_size)
+    if report is None:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
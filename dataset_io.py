@@ -0,0 +1,294 @@
+import os
+import bz2
+import gzip
+import json
+import lzma
+import uuid
+import argparse
+from typing import Dict, Iterator, Optional
+
+READ_CHUNK_SIZE = 1 << 20
+SCHEMAS = ("sharegpt", "prompt_response", "alpaca")
+COMPRESSORS = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+
+def compression_of(path: str) -> Optional[str]:
+    """Return the compression implied by a file suffix (gz, bz2 or xz), or None."""
+    suffix = os.path.splitext(path)[1].lstrip('.').lower()
+    return suffix if suffix in COMPRESSORS else None
+
+def variant_path(output_file: str, name: str) -> str:
+    """Output path for a named variant: dataset.json -> dataset.<name>.json (compression suffix kept last)."""
+    compression = compression_of(output_file)
+    base = output_file[:-len(compression) - 1] if compression else output_file
+    stem, ext = os.path.splitext(base)
+    return f"{stem}.{name}{ext}" + (f".{compression}" if compression else "")
+
+def is_jsonl(path: str) -> bool:
+    """True if path (ignoring a compression suffix) names a JSONL file."""
+    if compression_of(path):
+        path = os.path.splitext(path)[0]
+    return path.lower().endswith('.jsonl')
+
+def open_text(path: str, mode: str, compression: str = None):
+    """Open a UTF-8 text file, compressed according to compression or, by default, the path suffix."""
+    compression = compression or compression_of(path)
+    if compression:
+        return COMPRESSORS[compression](path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def iter_json_array(f, chunk_size: int = READ_CHUNK_SIZE) -> Iterator:
+    """
+    Yield the elements of a top-level JSON array one at a time, reading the file in chunks,
+    so memory use is bounded by the largest entry rather than the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill(need_more: bool = False) -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        chunk = f.read(max(chunk_size, len(buffer) if need_more else 0))
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_whitespace() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ""
+
+    if skip_whitespace() != "[":
+        raise ValueError("Dataset must be a JSON list of conversations.")
+    pos += 1
+    if skip_whitespace() == "]":
+        return
+    while True:
+        skip_whitespace()
+        try:
+            entry, end = decoder.raw_decode(buffer, pos)
+            if end == len(buffer) and not eof:
+                raise json.JSONDecodeError("Entry may continue in the next chunk", buffer, end)
+        except json.JSONDecodeError:
+            if fill(need_more=True):
+                continue
+            raise
+        pos = end
+        yield entry
+        separator = skip_whitespace()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("Expected ',' or ']' after entry", buffer, pos)
+        pos += 1
+        if pos > chunk_size:
+            buffer = buffer[pos:]
+            pos = 0
+
+def iter_records(file_path: str) -> Iterator:
+    """
+    Stream records from a JSON array or a JSONL file (one record per line), optionally compressed.
+    The layout is detected from the first non-whitespace character.
+    Yields (record, error) pairs; error is set instead of record for JSONL lines that fail to parse.
+    """
+    with open_text(file_path, 'r') as f:
+        first = ""
+        while True:
+            char = f.read(1)
+            if not char or not char.isspace():
+                first = char
+                break
+        f.seek(0)
+        if first == "[":
+            for entry in iter_json_array(f):
+                yield entry, None
+            return
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line), None
+            except json.JSONDecodeError as e:
+                yield None, f"Line {line_number}: Invalid JSON: {e}"
+
+class DatasetWriter:
+    """
+    Write records one at a time to a JSON array (same layout as json.dump(records, f, indent=2))
+    or, for .jsonl paths, one record per line, compressed when the path ends in .gz, .bz2 or .xz.
+    Output goes to a temp file that replaces the target on close, so an interrupted run never
+    leaves a truncated dataset behind.
+    """
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.tmp_file = f"{output_file}.{uuid.uuid4().hex[:8]}.tmp"  # Per writer, so concurrent runs don't collide
+        self.jsonl = is_jsonl(output_file)
+        self.count = 0
+        self.file = open_text(self.tmp_file, 'w', compression_of(output_file))
+        if not self.jsonl:
+            self.file.write('[')
+
+    def write(self, record: Dict) -> None:
+        if self.jsonl:
+            self.file.write(json.dumps(record) + '\n')
+        else:
+            self.file.write(',\n  ' if self.count else '\n  ')
+            self.file.write(json.dumps(record, indent=2).replace('\n', '\n  '))
+        self.count += 1
+
+    def close(self) -> None:
+        """Finish the file, flush it to disk and move it into place."""
+        if not self.jsonl:
+            self.file.write('\n]' if self.count else ']')
+        self.file.flush()
+        self.file.close()
+        with open(self.tmp_file, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(self.tmp_file, self.output_file)
+
+    def abort(self) -> None:
+        self.file.close()
+        os.remove(self.tmp_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def detect_schema(record) -> Optional[str]:
+    """Return the schema a record is in, or None if it is not recognised."""
+    if isinstance(record, dict):
+        if "conversations" in record:
+            return "sharegpt"
+        if "prompt" in record and "response" in record:
+            return "prompt_response"
+        if "instruction" in record and "output" in record:
+            return "alpaca"
+    return None
+
+def to_sharegpt(record: Dict, schema: str) -> Dict:
+    """Convert a record of the given schema to a ShareGPT entry."""
+    if schema == "sharegpt":
+        return record
+    turns = []
+    if record.get("system"):
+        turns.append({"from": "system", "value": record["system"]})
+    if schema == "prompt_response":
+        turns.append({"from": "human", "value": record["prompt"]})
+        turns.append({"from": "gpt", "value": record["response"]})
+    elif schema == "alpaca":
+        for prompt, response in record.get("history") or []:
+            turns.append({"from": "human", "value": prompt})
+            turns.append({"from": "gpt", "value": response})
+        instruction = record["instruction"]
+        if record.get("input"):
+            instruction = f"{instruction}\n{record['input']}"
+        turns.append({"from": "human", "value": instruction})
+        turns.append({"from": "gpt", "value": record["output"]})
+    else:
+        raise ValueError(f"Unknown schema '{schema}'")
+    return {"conversations": turns}
+
+def from_sharegpt(entry: Dict, schema: str) -> Optional[Dict]:
+    """
+    Convert a ShareGPT entry to the given schema. prompt_response and alpaca records take the
+    last human/gpt exchange; alpaca keeps earlier exchanges as history, prompt_response drops them.
+    Returns None if the entry has no human/gpt exchange.
+    """
+    if schema == "sharegpt":
+        return entry
+    system = None
+    exchanges = []
+    prompt = None
+    for message in entry.get("conversations") or []:
+        if not isinstance(message, dict):
+            continue
+        role = str(message.get("from", "")).lower()
+        if role == "system":
+            system = message.get("value")
+        elif role == "human":
+            prompt = message.get("value", "")
+        elif role == "gpt" and prompt is not None:
+            exchanges.append((prompt, message.get("value", "")))
+            prompt = None
+    if not exchanges:
+        return None
+    prompt, response = exchanges[-1]
+    if schema == "prompt_response":
+        record = {"prompt": prompt, "response": response}
+    elif schema == "alpaca":
+        record = {"instruction": prompt, "input": "", "output": response}
+        if len(exchanges) > 1:
+            record["history"] = [list(exchange) for exchange in exchanges[:-1]]
+    else:
+        raise ValueError(f"Unknown schema '{schema}'")
+    if system:
+        record["system"] = system
+    return record
+
+def iter_converted(file_path: str, schema: str, stats: Dict = None) -> Iterator[Dict]:
+    """
+    Stream the records of any supported dataset file converted to schema.
+    Records that fail to parse, have an unknown schema or cannot be converted are skipped and
+    counted in stats["skipped"] when a stats dict is given.
+    """
+    skipped = 0
+    for record, error in iter_records(file_path):
+        source_schema = detect_schema(record) if error is None else None
+        converted = None
+        if source_schema is not None:
+            converted = from_sharegpt(to_sharegpt(record, source_schema), schema)
+        if converted is None:
+            skipped += 1
+            continue
+        yield converted
+    if stats is not None:
+        stats["skipped"] = stats.get("skipped", 0) + skipped
+
+def convert(input_file: str, output_file: str, schema: str) -> int:
+    """Convert a dataset file to schema, writing the layout implied by output_file. Returns the record count."""
+    stats = {}
+    with DatasetWriter(output_file) as writer:
+        for record in iter_converted(input_file, schema, stats):
+            writer.write(record)
+    print(f"Converted {writer.count} records from '{input_file}' to {schema} in '{output_file}'")
+    if stats.get("skipped"):
+        print(f"Skipped {stats['skipped']} records that could not be parsed or converted")
+    return writer.count
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Stream a dataset between ShareGPT, prompt/response and Alpaca schemas, "
+                    "as JSON arrays or JSONL, optionally compressed (.gz, .bz2, .xz)."
+    )
+    parser.add_argument("input_file", help="Dataset to convert; the schema and layout are detected")
+    parser.add_argument("output_file", help="Output path; .jsonl writes JSONL, a .gz/.bz2/.xz suffix compresses")
+    parser.add_argument("--to", choices=SCHEMAS, default="prompt_response",
+                        help="Output schema (default: prompt_response, the format train.py reads)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSORS),
+                        help="Compress the output, appending the suffix to output_file if missing")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    output_file = args.output_file
+    if args.compress and compression_of(output_file) != args.compress:
+        output_file = f"{output_file}.{args.compress}"
+    convert(args.input_file, output_file, args.to)
+
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,479 @@
 import asyncio
 import os
+import json
+import time
+import hashlib
+import argparse
+import shutil
+import filecmp
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from crawl4ai import AsyncWebCrawler
-from crawl4ai.async_configs import CrawlerRunConfig, CacheMode
-from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
-from crawl4ai.content_filter_strategy import PruningContentFilter
+from crawl_layout import TOPICS_DIR, count_toc_items, iter_toc, sanitize_filename, topic_level
+from crawl_layout import load_manifest as load_crawl_manifest
+from html_markdown import html_to_markdown, word_count
 
-async def convert_html_recursively(root_dir, out_dir):
-    # Ensure the main output directory exists
-    out_dir = Path(out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
+# Conversion engine: "static" converts the saved HTML in-process, "browser" renders it with crawl4ai
+DEFAULT_ENGINE = os.getenv("FORMATTER_ENGINE", "static")
+
+# Concurrent conversions, the processes static conversions run on, and browser instances
+DEFAULT_CONCURRENCY = int(os.getenv("FORMATTER_CONCURRENCY", "4"))
+DEFAULT_WORKERS = int(os.getenv("FORMATTER_WORKERS", str(os.cpu_count() or 1)))
+DEFAULT_CRAWLERS = int(os.getenv("FORMATTER_CRAWLERS", "1"))
+MANIFEST_FILE = ".formatter_manifest.json"
+
+# Markdown of each document's converted topic fragments, kept next to its Markdown pages
+FRAGMENTS_DIR = ".fragments"
+
+# Conversion settings; they are stored in the manifest so changing them reconverts everything
+CONVERT_SETTINGS = {
+    "word_count_threshold": 200,
+    "pruning_threshold": 0.5,
+    "pruning_threshold_type": "fixed",
+    "min_word_threshold": 50,
+    "js_code": ["document.querySelectorAll('.ft-expanding-block-link').forEach(link => link.click());"],
+}
+
+def build_run_config():
+    # crawl4ai is only needed by the browser engine and the static engine's fallback
+    from crawl4ai.async_configs import CrawlerRunConfig, CacheMode
+    from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+    from crawl4ai.content_filter_strategy import PruningContentFilter
 
     # Build our run_config (non-LLM approach, default Markdown generator)
-    run_config = CrawlerRunConfig(
+    return CrawlerRunConfig(
         cache_mode=CacheMode.ENABLED,
-        word_count_threshold=200,  # Skip extremely small docs if desired
+        word_count_threshold=CONVERT_SETTINGS["word_count_threshold"],  # Skip extremely small docs if desired
         markdown_generator=DefaultMarkdownGenerator(
             content_filter=PruningContentFilter(
-                threshold=0.5,            # Adjust filter sensitivity
-                threshold_type="fixed",
-                min_word_threshold=50
+                threshold=CONVERT_SETTINGS["pruning_threshold"],            # Adjust filter sensitivity
+                threshold_type=CONVERT_SETTINGS["pruning_threshold_type"],
+                min_word_threshold=CONVERT_SETTINGS["min_word_threshold"]
             )
         ),
         # If your docs have collapsible sections, expand them:
-        js_code=["document.querySelectorAll('.ft-expanding-block-link').forEach(link => link.click());"]
+        js_code=CONVERT_SETTINGS["js_code"]
+    )
+
+def convert_fragment(html):
+    """Convert HTML to Markdown without a browser, applying the configured pruning thresholds."""
+    return html_to_markdown(
+        html,
+        threshold=CONVERT_SETTINGS["pruning_threshold"],
+        threshold_type=CONVERT_SETTINGS["pruning_threshold_type"],
+        min_word_threshold=CONVERT_SETTINGS["min_word_threshold"],
     )
 
-    async with AsyncWebCrawler() as crawler:
+def convert_static(html_file):
+    """
+    Convert a saved page without a browser, applying the same pruning thresholds.
+    Returns the Markdown and whether the page looks like it needs a browser: it came out below
+    word_count_threshold words and has scripts that may build its content.
+    """
+    with open(html_file, "r", encoding="utf-8") as f:
+        html = f.read()
+    markdown = convert_fragment(html)
+    needs_browser = word_count(markdown) < CONVERT_SETTINGS["word_count_threshold"] and "<script" in html.lower()
+    return markdown, needs_browser
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(out_dir, settings):
+    """Load the record of converted sources, or an empty one if missing or written with other settings."""
+    manifest_path = Path(out_dir) / MANIFEST_FILE
+    try:
+        with manifest_path.open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get("settings") != settings:
+        print("Conversion settings changed; converting every file again")
+        return {}
+    return manifest.get("files", {})
+
+def save_manifest(out_dir, settings, files):
+    manifest_path = Path(out_dir) / MANIFEST_FILE
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump({"settings": settings, "files": files}, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def is_up_to_date(html_file, md_path, record):
+    """
+    True if md_path exists and was produced from the current contents of html_file.
+    Size and mtime are compared first; the file is only hashed when they changed, and a matching
+    hash refreshes the recorded stat so the next run can skip hashing.
+    """
+    if record is None or not md_path.exists():
+        return False
+    stat = html_file.stat()
+    if record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if record["size"] != stat.st_size or record["sha256"] != hash_file(html_file):
+        return False
+    record["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def report_latencies(latencies, converted, skipped, failed, wall_time, fallbacks=0):
+    """Print conversion counts, throughput and per-file latency percentiles."""
+    print(f"Converted {converted} ({fallbacks} through the browser fallback), skipped {skipped} unchanged, "
+          f"failed {failed} in {wall_time:.2f}s")
+    if not latencies:
+        return
+    latencies = sorted(latencies)
+    print(f"Per-file latency: p50 {percentile(latencies, 0.5):.2f}s, p90 {percentile(latencies, 0.9):.2f}s, "
+          f"p99 {percentile(latencies, 0.99):.2f}s, max {latencies[-1]:.2f}s; "
+          f"{len(latencies) / max(wall_time, 1e-9):.1f} files/s")
+
+async def convert_html_recursively(root_dir, out_dir, concurrency=DEFAULT_CONCURRENCY,
+                                   crawlers=DEFAULT_CRAWLERS, force=False, engine=DEFAULT_ENGINE,
+                                   workers=DEFAULT_WORKERS, browser_fallback=False):
+    """
+    Convert every .html file under root_dir to a mirrored .md file under out_dir.
+    A producer walks the tree into a bounded queue while `concurrency` workers convert files.
+    The "static" engine converts on a pool of `workers` processes and, with browser_fallback, sends
+    pages that need rendering to the browser; the "browser" engine renders every page through a pool
+    of `crawlers` browser instances. Files whose source is unchanged since the last conversion are
+    skipped unless force is set.
+    """
+    if engine not in ("static", "browser"):
+        raise ValueError(f"Unknown conversion engine: {engine}")
+    # Ensure the main output directory exists
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    root_dir = Path(root_dir)
+    use_browser = engine == "browser" or browser_fallback
+    run_config = build_run_config() if use_browser else None
+    settings = dict(CONVERT_SETTINGS, engine=engine, browser_fallback=browser_fallback)
+    manifest = {} if force else load_manifest(out_dir, settings)
+    concurrency = max(1, concurrency)
+    crawlers = max(1, min(crawlers, concurrency))
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    latencies = []
+    counts = {"converted": 0, "skipped": 0, "failed": 0, "fallbacks": 0}
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+
+    async def produce():
         # Recursively find all .html files under root_dir
-        for html_file in Path(root_dir).rglob("*.html"):
-            # Construct file:// URL for the local HTML
-            file_url = f"file://{html_file.resolve()}"
+        for html_file in root_dir.rglob("*.html"):
+            await queue.put(html_file)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def render(crawler, html_file):
+        # Crawl the local HTML file through its file:// URL
+        result = await crawler.arun(url=f"file://{html_file.resolve()}", config=run_config)
+        if not result.success:
+            raise RuntimeError(result.error_message)
+        return str(result.markdown)
+
+    async def consume(executor, crawler):
+        while True:
+            html_file = await queue.get()
+            if html_file is None:
+                return
+            # Build a mirrored output path for the .md
+            relative_path = html_file.relative_to(root_dir)
+            key = relative_path.as_posix()
+            md_path = out_dir / relative_path.with_suffix(".md")
+            if not force and await asyncio.to_thread(is_up_to_date, html_file, md_path, manifest.get(key)):
+                counts["skipped"] += 1
+                continue
 
-            print(f"Processing {html_file.relative_to(root_dir)} ...")
+            print(f"Processing {relative_path} ...")
+            stat = html_file.stat()
+            source_hash = await asyncio.to_thread(hash_file, html_file)
+            request_start = time.time()
+            try:
+                if engine == "static":
+                    markdown, needs_browser = await loop.run_in_executor(executor, convert_static, html_file)
+                    if needs_browser and browser_fallback:
+                        markdown = await render(crawler, html_file)
+                        counts["fallbacks"] += 1
+                else:
+                    markdown = await render(crawler, html_file)
+            except Exception as e:
+                print(f"  !! Failed: {relative_path}: {e}")
+                counts["failed"] += 1
+                continue
+            latencies.append(time.time() - request_start)
 
-            # Crawl the local HTML file
-            result = await crawler.arun(url=file_url, config=run_config)
-            if result.success:
-                # Build a mirrored output path for the .md
-                relative_path = html_file.relative_to(root_dir)
-                md_path = out_dir / relative_path.with_suffix(".md")
+            # Ensure subdirectories exist in out_dir, then write the Markdown atomically
+            md_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = md_path.with_name(md_path.name + ".tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                f.write(markdown)
+            os.replace(tmp_path, md_path)
+            manifest[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": source_hash}
+            counts["converted"] += 1
+            print(f"  -> Saved Markdown to {md_path}")
 
-                # Ensure subdirectories exist in out_dir
-                md_path.parent.mkdir(parents=True, exist_ok=True)
+    async with contextlib.AsyncExitStack() as stack:
+        executor = None
+        if engine == "static":
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=max(1, min(workers, concurrency))))
+        pool = [None]
+        if use_browser:
+            from crawl4ai import AsyncWebCrawler
+            pool = [await stack.enter_async_context(AsyncWebCrawler()) for _ in range(crawlers)]
+        try:
+            await asyncio.gather(produce(), *(consume(executor, pool[i % len(pool)]) for i in range(concurrency)))
+        finally:
+            save_manifest(out_dir, settings, manifest)
 
-                # Write the extracted Markdown
-                with md_path.open("w", encoding="utf-8") as f:
-                    f.write(result.markdown)
+    report_latencies(latencies, counts["converted"], counts["skipped"], counts["failed"],
+                     time.time() - start_time, counts["fallbacks"])
+    return counts
 
-                print(f"  -> Saved Markdown to {md_path}")
+class FragmentCache:
+    """
+    Markdown of topic fragments, converted once per distinct fragment and stored in cache_dir
+    by a hash of the fragment and the conversion settings, so unchanged topics are never
+    converted again. Fragments no topic of the last convert() call uses are pruned.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.salt = json.dumps(CONVERT_SETTINGS, sort_keys=True)
+        self.keys = {}
+        self.converted = 0
+        self.reused = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.md")
+
+    def _store(self, key, markdown):
+        tmp_path = f"{self._path(key)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(markdown)
+        os.replace(tmp_path, self._path(key))
+        self.converted += 1
+
+    def convert(self, fragments, executor=None, max_in_flight=64):
+        """
+        Convert (content_id, fragment HTML) pairs, on executor if given. fragments may be a
+        generator; at most max_in_flight fragments are held at a time.
+        """
+        in_flight = deque()
+        seen = set()
+        for content_id, fragment in fragments:
+            key = hashlib.sha256((self.salt + fragment).encode("utf-8")).hexdigest()
+            self.keys[content_id] = key
+            if key in seen:
+                continue
+            seen.add(key)
+            if os.path.exists(self._path(key)):
+                self.reused += 1
+            elif executor is None:
+                self._store(key, convert_fragment(fragment))
             else:
-                print(f"  !! Failed: {result.error_message}")
+                in_flight.append((key, executor.submit(convert_fragment, fragment)))
+                if len(in_flight) >= max_in_flight:
+                    key, future = in_flight.popleft()
+                    self._store(key, future.result())
+        while in_flight:
+            key, future = in_flight.popleft()
+            self._store(key, future.result())
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".md") and name[:-len(".md")] not in seen:
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def get(self, content_id):
+        with open(self._path(self.keys[content_id]), "r", encoding="utf-8") as f:
+            return f.read()
+
+def write_if_changed(path, parts):
+    """Write the concatenated parts (strings, or paths of files to copy in) to path unless it already has that content."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for part in parts:
+            if isinstance(part, Path):
+                with part.open("r", encoding="utf-8") as src:
+                    shutil.copyfileobj(src, f)
+            else:
+                f.write(part)
+    if os.path.exists(path) and filecmp.cmp(tmp_path, path, shallow=False):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+def write_markdown_tree(toc, cache, parent_path, stats, prefix=""):
+    """
+    Write the Markdown section files of a TOC with the crawler's pages layout. Like the crawler,
+    children are written first and each parent file is its own section followed by its
+    children's files, so topics are only ever converted once. Returns the section file of each item.
+    """
+    files = []
+    for idx, item in enumerate(toc, start=1):
+        number_prefix = f"{prefix}{idx}" if prefix else str(idx)
+        numbered_title = f"{number_prefix}_{sanitize_filename(item['title'])}"
+        current_path = parent_path / numbered_title
+        children = []
+        if item["children"]:
+            children = write_markdown_tree(item["children"], cache, current_path, stats, f"{number_prefix}.")
+
+        # Top-level sections get their own directory; subsections live in their parent's
+        section_dir = current_path if not prefix else parent_path
+        section_dir.mkdir(parents=True, exist_ok=True)
+        section_file = section_dir / f"{numbered_title}.md"
+        heading = "#" * min(topic_level(item, prefix), 6)
+        parts = [f"{heading} {number_prefix} {item['title']}\n\n", cache.get(item["contentId"])]
+        for child_file in children:
+            parts.extend(["\n", child_file])
+        stats["written" if write_if_changed(section_file, parts) else "unchanged"] += 1
+        stats["files"].add(section_file)
+        files.append(section_file)
+    return files
+
+def convert_document(toc, get_fragment, doc_out_dir, doc_name, executor=None):
+    """
+    Write a document's Markdown from its TOC and topic fragments (get_fragment maps a contentId
+    to its fragment HTML, or None if the crawl has no content for it): pages/ mirrors the crawler's
+    section files and full_documentation.md holds every section once. Topics without content are
+    reported and written as a bare heading. Returns the conversion statistics of the document.
+    """
+    start = time.time()
+    doc_out_dir = Path(doc_out_dir)
+    pages_dir = doc_out_dir / "pages"
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    content_ids = list(dict.fromkeys(item["contentId"] for item in iter_toc(toc)))
+    cache = FragmentCache(doc_out_dir / FRAGMENTS_DIR)
+    missing = []
+
+    def fragments():
+        for content_id in content_ids:
+            fragment = get_fragment(content_id)
+            if fragment is None:
+                print(f"Warning: {doc_name}: no crawled content for topic {content_id}; writing its heading only")
+                missing.append(content_id)
+                fragment = ""
+            yield content_id, fragment
+
+    cache.convert(fragments(), executor)
+
+    stats = {"written": 0, "unchanged": 0, "files": set()}
+    top_level = write_markdown_tree(toc, cache, pages_dir, stats)
+    parts = [f"# {doc_name}\n"]
+    for section_file in top_level:
+        parts.extend(["\n", section_file])
+    write_if_changed(doc_out_dir / "full_documentation.md", parts)
+
+    # Remove section files of topics no longer in the TOC
+    for md_path in pages_dir.rglob("*.md"):
+        if md_path not in stats["files"]:
+            md_path.unlink()
+    for dirpath, _, _ in os.walk(pages_dir, topdown=False):
+        if dirpath != str(pages_dir) and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+    elapsed = time.time() - start
+    print(f"{doc_name}: {len(content_ids)} topics ({cache.converted} converted, {cache.reused} unchanged, "
+          f"{len(missing)} missing), {count_toc_items(toc)} section files ({stats['written']} written) in {elapsed:.2f}s")
+    return {"topics": len(content_ids), "converted": cache.converted, "reused": cache.reused, "missing": len(missing),
+            "sections": count_toc_items(toc), "written": stats["written"], "seconds": elapsed}
+
+def convert_doctree(doctree, base_dir, out_dir, products=None, workers=DEFAULT_WORKERS):
+    """
+    Convert every crawled document of the doctree (or of the given products) from the topic
+    fragments and TOC recorded by the crawler under base_dir, instead of from its section files.
+    Documents crawled before the crawler recorded its TOC are reported and skipped.
+    """
+    totals = {"documents": 0, "topics": 0, "converted": 0, "missing": 0, "sections": 0}
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        for product in doctree["children"]:
+            if products and product["name"] not in products:
+                continue
+            product_folder = sanitize_filename(product["name"])
+            for doc in product.get("children", []):
+                if not doc.get("link"):
+                    continue
+                doc_folder = sanitize_filename(doc["name"])
+                doc_dir = os.path.join(base_dir, product_folder, doc_folder)
+                manifest = load_crawl_manifest(doc_dir)
+                if not manifest or "toc" not in manifest:
+                    print(f"Warning: {doc_dir} has no crawl manifest with a TOC (crawl it again). Skipping...")
+                    continue
+                topics_dir = os.path.join(doc_dir, TOPICS_DIR)
+
+                def get_fragment(content_id):
+                    record = manifest["topics"].get(content_id)
+                    if record is None:  # Failed to fetch in the last crawl; the next crawl retries it
+                        return None
+                    with open(os.path.join(topics_dir, f"{record['hash']}.html"), "r", encoding="utf-8") as f:
+                        return f.read()
+
+                stats = convert_document(manifest["toc"], get_fragment, os.path.join(out_dir, product_folder, doc_folder),
+                                         doc["name"], executor)
+                totals["documents"] += 1
+                for key in ("topics", "converted", "missing", "sections"):
+                    totals[key] += stats[key]
+    print(f"Converted {totals['documents']} documents: {totals['converted']} of {totals['topics']} topics "
+          f"converted for {totals['sections']} section files")
+    if totals["missing"]:
+        print(f"Warning: {totals['missing']} topics had no crawled content; crawl again to fetch them")
+    return totals
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert crawled HTML pages to Markdown.")
+    parser.add_argument("--doctree",
+                        help="Convert the crawled documents listed in this doctree.json from their topic fragments")
+    parser.add_argument("--product", action="append", dest="products",
+                        help="With --doctree, only convert this product (repeatable)")
+    parser.add_argument("--input", action="append", dest="inputs",
+                        help="Directory of HTML pages to convert, relative to --base-dir (repeatable)")
+    parser.add_argument("--base-dir", default="cortex_docs", help="Directory the crawler wrote to")
+    parser.add_argument("--output-dir", default="PANW/markdown_output", help="Directory for the Markdown files")
+    parser.add_argument("--engine", choices=["static", "browser"], default=DEFAULT_ENGINE,
+                        help="Convert saved HTML directly (static) or render it in a headless browser "
+                             "(default: FORMATTER_ENGINE or static)")
+    parser.add_argument("--browser-fallback", action="store_true",
+                        help="With the static engine, render pages that look script-built in the browser")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Files converted at once (default: FORMATTER_CONCURRENCY or 4)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Processes used by the static engine (default: FORMATTER_WORKERS or the CPU count)")
+    parser.add_argument("--crawlers", type=int, default=DEFAULT_CRAWLERS,
+                        help="Browser instances the conversions are spread across (default: FORMATTER_CRAWLERS or 1)")
+    parser.add_argument("--force", action="store_true",
+                        help="Convert every file, even if its Markdown is up to date")
+    return parser.parse_args()
 
 async def main():
-    # Base directory under PANW for Cortex products
-    base_dir = "cortex_docs"
-    
-    # List of Cortex products to process
-    cortex_products = [
+    args = parse_args()
+    if args.doctree:
+        with open(args.doctree, "r", encoding="utf-8") as f:
+            doctree = json.load(f)
+        convert_doctree(doctree, args.base_dir, args.output_dir, args.products, args.workers)
+        return
+
+    # Pages directories to process, relative to the crawler's output directory
+    cortex_products = args.inputs or [
         "Cortex XSIAM/Analytics Alert Reference/pages"
     ]
-    
-    # Output directory for all Markdown files
-    output_root = "PANW/markdown_output"
-    
+
     # Process each Cortex product's pages directory
     for product_path in cortex_products:
-        input_root = os.path.join(base_dir, product_path)
+        input_root = os.path.join(args.base_dir, product_path)
         if Path(input_root).exists():
             print(f"Processing {input_root}...")
-            await convert_html_recursively(input_root, output_root)
+            await convert_html_recursively(input_root, args.output_dir, args.concurrency, args.crawlers, args.force,
+                                           args.engine, args.workers, args.browser_fallback)
         else:
             print(f"Warning: Directory {input_root} does not exist. Skipping...")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
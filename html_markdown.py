@@ -0,0 +1,220 @@
+import re
+import sys
+import math
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
+
+# Elements dropped before pruning, matching what the crawler's scraping strategy discards
+EXCLUDED_TAGS = {"nav", "footer", "header", "aside", "script", "style", "form", "iframe", "noscript", "button", "svg"}
+
+# Pruning works on container elements; headings, paragraphs, lists and tables inside a kept
+# container are always kept
+PRUNED_TAGS = {"div", "section", "article", "main"}
+
+# Scoring weights of crawl4ai's PruningContentFilter, so the same thresholds mean the same thing
+METRIC_WEIGHTS = {"text_density": 0.4, "link_density": 0.2, "tag_weight": 0.2, "class_id_weight": 0.1, "text_length": 0.1}
+TAG_WEIGHTS = {
+    "div": 0.5, "p": 1.0, "article": 1.5, "section": 1.0, "span": 0.3, "li": 0.5, "ul": 0.5, "ol": 0.5,
+    "h1": 1.2, "h2": 1.1, "h3": 1.0, "h4": 0.9, "h5": 0.8, "h6": 0.7,
+}
+NEGATIVE_RE = re.compile(r"nav|footer|header|sidebar|ads|comment|promo|advert|social|share", re.I)
+
+HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+BLOCK_TAGS = PRUNED_TAGS | {
+    "body", "html", "p", "pre", "ul", "ol", "dl", "dt", "dd", "table", "blockquote", "hr", "figure",
+    "figcaption", "details", "summary", "li", *HEADINGS,
+}
+_WS_RE = re.compile(r"\s+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+def word_count(text):
+    return len(text.split())
+
+def score_node(node, min_word_threshold):
+    """Composite content score of a node, as PruningContentFilter computes it (-1 below min_word_threshold)."""
+    text = node.get_text(" ", strip=True)
+    if min_word_threshold and word_count(text) < min_word_threshold:
+        return -1.0
+    text_len = len(text)
+    tag_len = len(node.decode_contents())
+    link_text_len = sum(len(a.get_text(strip=True)) for a in node.find_all("a"))
+    class_id = " ".join(node.get("class", [])) + " " + (node.get("id") or "")
+    metrics = {
+        "text_density": text_len / tag_len if tag_len else 0,
+        "link_density": 1 - (link_text_len / text_len if text_len else 0),
+        "tag_weight": TAG_WEIGHTS.get(node.name, 0.5),
+        "class_id_weight": 0.0 if NEGATIVE_RE.search(class_id) else 0.5,
+        "text_length": math.log(text_len + 1),
+    }
+    return sum(METRIC_WEIGHTS[name] * value for name, value in metrics.items()) / sum(METRIC_WEIGHTS.values())
+
+def node_threshold(node, threshold, threshold_type):
+    """The score a node must reach to be kept; "dynamic" relaxes it for important or text-heavy nodes."""
+    if threshold_type == "fixed":
+        return threshold
+    if threshold_type != "dynamic":
+        raise ValueError(f"Unknown threshold type: {threshold_type}")
+    text_len = len(node.get_text(strip=True))
+    tag_len = len(node.decode_contents())
+    link_text_len = sum(len(a.get_text(strip=True)) for a in node.find_all("a"))
+    if TAG_WEIGHTS.get(node.name, 0.7) > 1:
+        threshold *= 0.8
+    if tag_len and text_len / tag_len > 0.4:
+        threshold *= 0.9
+    if text_len and link_text_len / text_len > 0.6:
+        threshold *= 1.2
+    return threshold
+
+def prune(root, threshold=0.5, threshold_type="fixed", min_word_threshold=None):
+    """Remove low-scoring containers below root, top-down; a kept container has its children checked in turn."""
+    for child in list(root.children):
+        if not isinstance(child, Tag):
+            continue
+        if child.name in PRUNED_TAGS:
+            if score_node(child, min_word_threshold) < node_threshold(child, threshold, threshold_type):
+                child.decompose()
+                continue
+        prune(child, threshold, threshold_type, min_word_threshold)
+
+def clean(soup):
+    """Drop comments and excluded elements, and return the element holding the page content."""
+    for comment in soup.find_all(string=lambda s: isinstance(s, Comment)):
+        comment.extract()
+    for tag in soup.find_all(EXCLUDED_TAGS):
+        tag.decompose()
+    return soup.body or soup
+
+def content_root(root):
+    """Descend through lone wrappers (an element that is its parent's only content), which are never pruned."""
+    while True:
+        children = [child for child in root.children if isinstance(child, Tag) or str(child).strip()]
+        if len(children) != 1 or not isinstance(children[0], Tag) or children[0].name not in PRUNED_TAGS:
+            return root
+        root = children[0]
+
+def _inline(node):
+    return "".join(_inline_node(child) for child in node.children)
+
+def _inline_node(node):
+    """Render an element (or string) as inline Markdown on a single logical line."""
+    if isinstance(node, NavigableString):
+        return _WS_RE.sub(" ", str(node))
+    if node.name in ("strong", "b"):
+        text = _inline(node).strip()
+        return f"**{text}**" if text else ""
+    if node.name in ("em", "i"):
+        text = _inline(node).strip()
+        return f"*{text}*" if text else ""
+    if node.name in ("code", "kbd", "samp", "tt"):
+        text = _WS_RE.sub(" ", node.get_text())
+        return f"`{text}`" if text.strip() else ""
+    if node.name == "a":
+        text = _inline(node).strip()
+        href = node.get("href", "")
+        if not text or not href or href.startswith("javascript:"):
+            return text
+        return f"[{text}]({href})"
+    if node.name == "img":
+        src = node.get("src")
+        return f"![{node.get('alt', '')}]({src})" if src else ""
+    if node.name == "br":
+        return "\n"
+    if node.name in BLOCK_TAGS:
+        return f" {_inline(node)} "
+    return _inline(node)
+
+def _list(node):
+    ordered = node.name == "ol"
+    start = int(node.get("start", 1)) if str(node.get("start", 1)).isdigit() else 1
+    lines = []
+    for index, item in enumerate(node.find_all("li", recursive=False)):
+        marker = f"{start + index}." if ordered else "-"
+        blocks = []
+        _blocks(item, blocks)
+        first, *rest = "\n".join(blocks).split("\n")
+        lines.append(f"{marker} {first}".rstrip())
+        lines.extend(" " * (len(marker) + 1) + line if line else "" for line in rest)
+    return "\n".join(lines)
+
+def _cell(node):
+    blocks = []
+    _blocks(node, blocks)
+    return "<br>".join(block.replace("\n", "<br>") for block in blocks).replace("|", "\\|")
+
+def _table(node):
+    rows = []
+    for row in node.find_all("tr"):
+        if row.find_parent("table") is node:
+            rows.append([_cell(cell) for cell in row.find_all(["th", "td"], recursive=False)])
+    rows = [row for row in rows if row]
+    if not rows:
+        return ""
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + " --- |" * width]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return "\n".join(lines)
+
+def _blocks(node, out):
+    """Append the Markdown blocks of node's children to out."""
+    pending = []
+
+    def flush():
+        text = "\n".join(line.strip() for line in "".join(pending).strip().split("\n"))
+        if text:
+            out.append(text)
+        pending.clear()
+
+    for child in node.children:
+        if isinstance(child, NavigableString) or child.name not in BLOCK_TAGS:
+            pending.append(_inline_node(child))
+            continue
+        flush()
+        if child.name in HEADINGS:
+            text = _inline(child).strip()
+            if text:
+                out.append("#" * HEADINGS[child.name] + " " + _WS_RE.sub(" ", text))
+        elif child.name == "p":
+            pending.append(_inline(child))
+            flush()
+        elif child.name == "pre":
+            language = next((c[len("language-"):] for c in child.get("class", []) if c.startswith("language-")), "")
+            out.append(f"```{language}\n{child.get_text().strip(chr(10))}\n```")
+        elif child.name in ("ul", "ol"):
+            out.append(_list(child))
+        elif child.name == "table":
+            out.append(_table(child))
+        elif child.name == "blockquote":
+            inner = []
+            _blocks(child, inner)
+            out.append("\n".join(f"> {line}" if line else ">" for line in "\n\n".join(inner).split("\n")))
+        elif child.name == "hr":
+            out.append("---")
+        elif child.name == "dt":
+            text = _inline(child).strip()
+            if text:
+                out.append(f"**{text}**")
+        else:
+            _blocks(child, out)
+    flush()
+
+def html_to_markdown(html, threshold=0.5, threshold_type="fixed", min_word_threshold=None):
+    """
+    Convert an HTML page to Markdown without a browser: drop boilerplate elements, prune
+    low-scoring containers like PruningContentFilter does, and render what is left.
+    Collapsed sections need no expanding, since their content is already in the static markup.
+    """
+    root = clean(BeautifulSoup(html, "html.parser"))
+    prune(content_root(root), threshold, threshold_type, min_word_threshold)
+    blocks = []
+    _blocks(root, blocks)
+    markdown = _BLANK_LINES_RE.sub("\n\n", "\n\n".join(block for block in blocks if block))
+    return markdown + "\n" if markdown else ""
+
+def main():
+    """Convert HTML files given as arguments (or stdin) and print their Markdown."""
+    for path in sys.argv[1:] or ["-"]:
+        html = sys.stdin.read() if path == "-" else open(path, encoding="utf-8").read()
+        sys.stdout.write(html_to_markdown(html))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dataset_io import DatasetWriter, detect_schema, from_sharegpt, iter_records, to_sharegpt, variant_path
+from token_cache import TEMPLATES, encode_batch, load_tokenizer, resolve_template
+
+PERCENTILES = (50, 75, 90, 95, 99, 99.9, 100)
+CANDIDATE_LENGTHS = (256, 512, 768, 1024, 1536, 2048, 4096)
+FIELDS = ("prompt", "response", "total")
+ACTIONS = ("drop", "route", "bucket")
+
+# Set in each worker process by init_worker
+_tokenizer = None
+_template = None
+
+def init_worker(model_name: str, template: str) -> None:
+    global _tokenizer, _template
+    _tokenizer = load_tokenizer(model_name)
+    _template = template
+
+def as_prompt_response(record) -> Optional[Dict]:
+    """The prompt/response pair train.py would tokenize for a record, or None if it has none."""
+    schema = detect_schema(record)
+    if schema is None:
+        return None
+    return from_sharegpt(to_sharegpt(record, schema), "prompt_response")
+
+def measure_batch(records: List) -> List[Optional[Tuple[int, int]]]:
+    """(prompt, response) token counts of each record in a worker process; None for records with no pair."""
+    pairs = [as_prompt_response(record) for record in records]
+    encoded = iter(encode_batch(_tokenizer, [pair for pair in pairs if pair is not None], _template))
+    results = []
+    for pair in pairs:
+        if pair is None:
+            results.append(None)
+        else:
+            ids, prompt_len = next(encoded)
+            results.append((prompt_len, len(ids) - prompt_len))
+    return results
+
+def iter_batches(file_path: str, batch_size: int) -> Iterator[List]:
+    """Group readable records into batches; unreadable ones become None."""
+    batch = []
+    for record, error in iter_records(file_path):
+        batch.append(record if error is None else None)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_measured(file_path: str, model_name: str, template: str, workers: int, batch_size: int) -> Iterator:
+    """
+    Yield (record, lengths) for every record in file order, lengths being (prompt, response)
+    token counts or None. Batches are tokenized on a process pool with at most 2 * workers
+    batches in flight.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(model_name, template)) as executor:
+        in_flight = deque()
+        for batch in iter_batches(file_path, batch_size):
+            in_flight.append((batch, executor.submit(measure_batch, batch)))
+            if len(in_flight) >= 2 * workers:
+                batch, future = in_flight.popleft()
+                yield from zip(batch, future.result())
+        while in_flight:
+            batch, future = in_flight.popleft()
+            yield from zip(batch, future.result())
+
+def percentile(counts: Counter, total: int, pct: float) -> int:
+    """Nearest-rank percentile of a length histogram holding total values."""
+    rank = max(1, -(-total * pct // 100))
+    seen = 0
+    for length in sorted(counts):
+        seen += counts[length]
+        if seen >= rank:
+            return length
+    return 0
+
+def share_within(counts: Counter, total: int, limit: int) -> float:
+    return sum(count for length, count in counts.items() if length <= limit) / max(total, 1)
+
+def summarize(counts: Counter, total: int, bin_width: int) -> Dict:
+    histogram = Counter()
+    for length, count in counts.items():
+        histogram[length // bin_width * bin_width] += count
+    return {
+        "mean": round(sum(length * count for length, count in counts.items()) / max(total, 1), 1),
+        "percentiles": {f"p{pct:g}": percentile(counts, total, pct) for pct in PERCENTILES},
+        "histogram": {f"{start}-{start + bin_width - 1}": histogram[start] for start in sorted(histogram)},
+    }
+
+def recommend_length(counts: Counter, total: int, coverage: float, round_to: int) -> int:
+    """Smallest multiple of round_to that fits at least the coverage share of rows."""
+    length = percentile(counts, total, coverage * 100)
+    return max(round_to, -(-length // round_to) * round_to)
+
+def open_targets(output_file: str, action: str, budget: int, buckets: List[int], overflow_file: str) -> Dict:
+    """Writers for the filter outputs, keyed by the largest total length they accept (None for overflow)."""
+    if action == "bucket":
+        targets = {limit: DatasetWriter(variant_path(output_file, f"le{limit}")) for limit in buckets}
+    else:
+        targets = {budget: DatasetWriter(output_file)}
+    if action != "drop":
+        targets[None] = DatasetWriter(overflow_file or variant_path(output_file, "over"))
+    return targets
+
+def profile_dataset(file_path: str, model_name: str, template: str = "chat", workers: int = 1, batch_size: int = 512,
+                    report_file: str = None, bin_width: int = 32, coverage: float = 0.99, round_to: int = 64,
+                    output_file: str = None, action: str = "drop", budget: int = None, buckets: List[int] = None,
+                    overflow_file: str = None) -> Dict:
+    """
+    Tokenize the dataset as train.py does and report prompt, response and total length
+    percentiles and histograms, the share of rows that fit common sequence lengths, and the
+    smallest length covering the coverage share of rows. With an output_file, rows are also
+    filtered by total length: "drop" keeps rows within budget, "route" also writes the rest to an
+    overflow file, and "bucket" writes each row to the file of the smallest bucket it fits in
+    (dataset.le512.jsonl, ...), with rows over the largest bucket going to the overflow file.
+    """
+    start_time = time.time()
+    template = resolve_template(load_tokenizer(model_name), template)
+    buckets = sorted(buckets or [])
+    if action == "bucket" and buckets:
+        budget = buckets[-1]
+    counts = {field: Counter() for field in FIELDS}
+    rows = unreadable = no_pair = over_budget = 0
+    targets = open_targets(output_file, action, budget, buckets, overflow_file) if output_file else {}
+    limits = sorted(limit for limit in targets if limit is not None)
+
+    try:
+        for record, lengths in iter_measured(file_path, model_name, template, workers, batch_size):
+            if record is None:
+                unreadable += 1
+                continue
+            if lengths is None:
+                no_pair += 1
+                continue
+            rows += 1
+            prompt_len, response_len = lengths
+            total_len = prompt_len + response_len
+            counts["prompt"][prompt_len] += 1
+            counts["response"][response_len] += 1
+            counts["total"][total_len] += 1
+            if budget is not None and total_len > budget:
+                over_budget += 1
+            if targets:
+                limit = next((limit for limit in limits if total_len <= limit), None)
+                if limit is not None or None in targets:
+                    targets[limit].write(record)
+    except BaseException:
+        for writer in targets.values():
+            writer.abort()
+        raise
+    for writer in targets.values():
+        writer.close()
+    elapsed = time.time() - start_time
+
+    report = {
+        "input_file": file_path,
+        "model_name": model_name,
+        "template": template,
+        "rows": rows,
+        "unreadable_rows": unreadable,
+        "rows_without_exchange": no_pair,
+        "lengths": {field: summarize(counts[field], rows, bin_width) for field in FIELDS},
+        "share_within": {str(limit): round(share_within(counts["total"], rows, limit), 4) for limit in CANDIDATE_LENGTHS},
+        "coverage": coverage,
+        "recommended_max_seq_length": recommend_length(counts["total"], rows, coverage, round_to) if rows else None,
+        "elapsed_seconds": round(elapsed, 3),
+    }
+    if budget is not None:
+        report["budget"] = budget
+        report["over_budget_rows"] = over_budget
+    if targets:
+        report["filter"] = {"action": action, "files": {writer.output_file: writer.count for writer in targets.values()}}
+
+    # Print summary
+    print("=" * 50)
+    print(f"Token lengths of {rows} rows ({model_name}, {template} template):")
+    for field in FIELDS:
+        stats = report["lengths"][field]
+        print(f"  {field:<8} mean {stats['mean']:>7}  " +
+              "  ".join(f"{name} {value}" for name, value in stats["percentiles"].items()))
+    print("Rows within: " + ", ".join(f"{limit}: {share:.1%}" for limit, share in report["share_within"].items()))
+    if rows:
+        print(f"Smallest max_seq_length covering {coverage:.1%} of rows: {report['recommended_max_seq_length']}")
+    if budget is not None:
+        print(f"Rows over {budget} tokens: {over_budget}")
+    if unreadable or no_pair:
+        print(f"Skipped {unreadable} unreadable rows and {no_pair} rows without a prompt/response exchange")
+    for path, count in report.get("filter", {}).get("files", {}).items():
+        print(f"Wrote {count} rows to '{path}'")
+    print(f"Profiled in {elapsed:.2f} seconds.")
+    if report_file:
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Length report saved to '{report_file}'.")
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Profile dataset token lengths and filter or bucket rows by length.")
+    parser.add_argument("input_file", nargs="?", default="dataset.jsonl",
+                        help="Dataset to profile, in any format dataset_io reads (default: dataset.jsonl)")
+    parser.add_argument("--model-name", required=True, help="Model whose tokenizer measures the rows")
+    parser.add_argument("--template", choices=TEMPLATES, default="chat",
+                        help="Prompt layout, as in train.py (default: chat, falling back to plain)")
+    parser.add_argument("--report", default="length_report.json",
+                        help="Where to write the JSON length report (default: length_report.json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Tokenizer processes (default: number of CPUs)")
+    parser.add_argument("--batch-size", type=int, default=512, help="Rows sent to a worker at a time (default: 512)")
+    parser.add_argument("--bin-width", type=int, default=32, help="Histogram bin width in tokens (default: 32)")
+    parser.add_argument("--coverage", type=float, default=0.99,
+                        help="Share of rows the recommended max_seq_length must fit (default: 0.99)")
+    parser.add_argument("--round-to", type=int, default=64,
+                        help="Round the recommended max_seq_length up to a multiple of this (default: 64)")
+    parser.add_argument("--output", help="Write rows filtered by total token length here")
+    parser.add_argument("--action", choices=ACTIONS, default="drop",
+                        help="drop rows over --budget, route them to --overflow, or bucket rows by --buckets")
+    parser.add_argument("--budget", type=int, help="Token budget for drop and route (e.g. train.py's max_seq_length)")
+    parser.add_argument("--buckets", help="Comma-separated bucket lengths for bucket, e.g. 256,512,1024")
+    parser.add_argument("--overflow", help="File for over-budget rows (default: <output>.over.<ext>)")
+    args = parser.parse_args()
+    args.buckets = [int(limit) for limit in args.buckets.split(",")] if args.buckets else []
+    if args.output and args.action == "bucket" and not args.buckets:
+        parser.error("--action bucket needs --buckets")
+    if args.output and args.action != "bucket" and args.budget is None:
+        parser.error(f"--action {args.action} needs --budget")
+    return args
+
+def main():
+    args = parse_args()
+    profile_dataset(args.input_file, args.model_name, args.template, args.workers, args.batch_size, args.report,
+                    args.bin_width, args.coverage, args.round_to, args.output, args.action, args.budget,
+                    args.buckets, args.overflow)
+
+if __name__ == "__main__":
+    main()
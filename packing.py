@@ -0,0 +1,109 @@
+import random
+from bisect import bisect_left, insort
+from typing import Dict, List, Sequence, Tuple
+
+# Label value ignored by the loss (token_cache labels prompt tokens with it too)
+IGNORE_INDEX = -100
+
+def pack_examples(lengths: Sequence[int], max_seq_length: int) -> List[List[int]]:
+    """
+    Group example indices into bins of at most max_seq_length tokens, best fit decreasing:
+    longest examples first, each into the fullest bin that still has room for it.
+    """
+    bins = []
+    free = []  # Sorted (remaining capacity, bin index) of bins that can still take tokens
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        length = lengths[index]
+        position = bisect_left(free, (length, -1))
+        if position < len(free):
+            remaining, bin_index = free.pop(position)
+        else:
+            remaining, bin_index = max_seq_length, len(bins)
+            bins.append([])
+        bins[bin_index].append(index)
+        if remaining - length > 0:
+            insort(free, (remaining - length, bin_index))
+    return bins
+
+class PackedDataset:
+    """
+    Examples of a TokenizedDataset concatenated into sequences of up to max_seq_length tokens.
+    Boundaries are kept the way LLaMA-Factory's neat packing expects: attention_mask holds the
+    1-based index of the example each token belongs to (so attention can be restricted to it),
+    position_ids restart at 0 for every example, and the first token of each example carries no
+    loss, so nothing is learned across a boundary.
+    """
+
+    def __init__(self, dataset, max_seq_length: int):
+        self.dataset = dataset
+        self.max_seq_length = max_seq_length
+        self.bins = pack_examples([dataset.length(i) for i in range(len(dataset))], max_seq_length)
+
+    def __len__(self) -> int:
+        return len(self.bins)
+
+    def length(self, index: int) -> int:
+        return sum(self.dataset.length(i) for i in self.bins[index])
+
+    def __getitem__(self, index: int) -> Dict[str, List[int]]:
+        input_ids, attention_mask, position_ids, labels = [], [], [], []
+        for segment, example_index in enumerate(self.bins[index], start=1):
+            example = self.dataset[example_index]
+            count = len(example["input_ids"])
+            input_ids.extend(example["input_ids"])
+            attention_mask.extend([segment] * count)
+            position_ids.extend(range(count))
+            labels.append(IGNORE_INDEX)
+            labels.extend(example["labels"][1:])
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "position_ids": position_ids,
+                "labels": labels}
+
+class LengthGroupedSampler:
+    """
+    Sampler (usable wherever a torch Sampler is) that yields indices so each batch holds
+    examples of similar length. As in transformers' sampler of the same name, indices are
+    shuffled, split into mega-batches of mega_batch_mult batches, and sorted by length within
+    each, so batches stay random across epochs but need little padding. The batch order is
+    shuffled too.
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, mega_batch_mult: int = 50, seed: int = 0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.mega_batch_mult = mega_batch_mult
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def batches(self) -> List[List[int]]:
+        rng = random.Random(self.seed + self.epoch)
+        indices = list(range(len(self.lengths)))
+        rng.shuffle(indices)
+        mega_size = self.batch_size * self.mega_batch_mult
+        batches = []
+        for start in range(0, len(indices), mega_size):
+            mega_batch = sorted(indices[start:start + mega_size], key=lambda i: self.lengths[i], reverse=True)
+            batches.extend(mega_batch[i:i + self.batch_size] for i in range(0, len(mega_batch), self.batch_size))
+        rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+def padding_stats(batches: List[List[int]], lengths: Sequence[int], pad_to: int = None) -> Tuple[int, int]:
+    """Real and padded token counts of a batch plan, padding to pad_to or else to each batch's longest row."""
+    real = padded = 0
+    for batch in batches:
+        batch_lengths = [lengths[i] for i in batch]
+        real += sum(batch_lengths)
+        padded += (pad_to or max(batch_lengths)) * len(batch_lengths)
+    return real, padded
+
+def describe_plan(name: str, real: int, padded: int) -> str:
+    return f"{name}: {real} real of {padded} padded tokens per epoch ({1 - real / max(padded, 1):.1%} padding)"
@@ -0,0 +1,415 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_VERSION = 1
+DEFAULT_CONFIG_FILE = "pipeline.json"
+DEFAULT_STATE_FILE = os.getenv("PIPELINE_STATE_FILE", ".pipeline_state.json")
+DEFAULT_LOG_DIR = os.getenv("PIPELINE_LOG_DIR", "pipeline_logs")
+DEFAULT_JOBS = int(os.getenv("PIPELINE_JOBS", "2"))  # One per independent branch: docs and dataset
+LOG_TAIL_LINES = 20
+
+# crawler.py always reads doctree.json and writes cortex_docs in the working directory
+DOCTREE_FILE = "doctree.json"
+DOCS_DIR = "cortex_docs"
+
+# Files handed from stage to stage; any of them can be overridden under "paths" in the config
+DEFAULT_PATHS = {
+    "markdown": "PANW/markdown_output",
+    "queries": "xql_queries",
+    "dataset": "dataset.json",
+    "clean": "clean_dataset.json",
+    "clean_report": "clean_dataset.report.json",
+    "system": "dataset_with_system.json",
+    "model": "finetuned_model",
+}
+
+IMPORT_RE = re.compile(r"^\s*(?:from\s+(\w+)\s+import|import\s+(\w+))", re.MULTILINE)
+
+print_lock = threading.Lock()
+
+def report(message: str) -> None:
+    """Print a whole line at a time; stages report from several threads."""
+    with print_lock:
+        print(message, flush=True)
+
+def build_stages(paths: Dict[str, str]) -> Dict[str, Dict]:
+    """
+    The pipeline graph. Each stage names its script and arguments, the stages it runs after,
+    the files or directories it reads and writes, and the environment variables it reads that
+    change its output. Stages are listed in an order that respects "after".
+    """
+    return {
+        "crawler": {
+            "script": "crawler.py", "after": [], "args": [],
+            "inputs": [DOCTREE_FILE], "outputs": [DOCS_DIR],
+            "env_params": ["CRAWLER_BASE_URL", "CRAWLER_EXTRACTOR"],
+            "volatile": True,  # Mirrors a remote site, so only re-run on --refresh; its manifests keep that cheap
+        },
+        "formatter": {
+            "script": "formatter.py", "after": ["crawler"],
+            "args": ["--doctree", DOCTREE_FILE, "--base-dir", DOCS_DIR, "--output-dir", paths["markdown"]],
+            "inputs": [DOCTREE_FILE, DOCS_DIR], "outputs": [paths["markdown"]],
+            "env_params": ["FORMATTER_ENGINE"],
+        },
+        "prompt_generator": {
+            "script": "prompt_generator.py", "after": [], "args": [],
+            "env": {"YAML_DIR": paths["queries"], "OUTPUT_FILE": paths["dataset"]},
+            "inputs": [paths["queries"]], "outputs": [paths["dataset"]],
+            "env_params": ["OLLAMA_MODEL"],
+        },
+        "dataset_cleaner": {
+            "script": "dataset_cleaner.py", "after": ["prompt_generator"],
+            "args": [paths["dataset"], "--output", paths["clean"], "--report", paths["clean_report"]],
+            "inputs": [paths["dataset"]], "outputs": [paths["clean"], paths["clean_report"]],
+        },
+        "add_system_context": {
+            "script": "add_system_context.py", "after": ["dataset_cleaner"],
+            "args": ["--input_file", paths["clean"], "--output_file", paths["system"]],
+            "inputs": [paths["clean"]], "outputs": [paths["system"]],
+            # It would otherwise prompt for one; variants from a --variants_file are written next to the output
+            "required_args": ["--system_message"],
+        },
+        "train": {
+            "script": "train.py", "after": ["add_system_context"],
+            "args": ["--dataset_path", paths["system"], "--output_dir", paths["model"]],
+            "inputs": [paths["system"]], "outputs": [paths["model"]],
+        },
+    }
+
+def load_config(config_file: Optional[str]) -> Dict:
+    """
+    Read the pipeline config: {"paths": {...}, "stages": {"<stage>": {"args": [...], "env": {...}}}}.
+    Stage args are appended to the stage's own and are part of its fingerprint.
+    """
+    if config_file is None:
+        if not os.path.exists(DEFAULT_CONFIG_FILE):
+            return {}
+        config_file = DEFAULT_CONFIG_FILE
+    with open(config_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def configure_stages(config: Dict) -> Dict[str, Dict]:
+    """Build the stage graph with the config's paths and per-stage arguments and environment applied."""
+    paths = {**DEFAULT_PATHS, **config.get("paths", {})}
+    stages = build_stages(paths)
+    for name, overrides in config.get("stages", {}).items():
+        if name not in stages:
+            raise ValueError(f"Unknown stage in config: {name}")
+        stages[name]["args"] = stages[name]["args"] + [str(arg) for arg in overrides.get("args", [])]
+        stages[name]["env"] = {**stages[name].get("env", {}), **overrides.get("env", {})}
+    for stage in stages.values():
+        stage.setdefault("env", {})
+        stage.setdefault("env_params", [])
+        stage["code"] = code_files(stage["script"])
+    return stages
+
+def code_files(script: str, seen: Optional[List[str]] = None) -> List[str]:
+    """The script and the local modules it imports, directly or through each other."""
+    seen = [] if seen is None else seen
+    if script in seen:
+        return seen
+    seen.append(script)
+    with open(os.path.join(SCRIPT_DIR, script), "r", encoding="utf-8") as f:
+        source = f.read()
+    for match in IMPORT_RE.finditer(source):
+        module = f"{match.group(1) or match.group(2)}.py"
+        if os.path.exists(os.path.join(SCRIPT_DIR, module)):
+            code_files(module, seen)
+    return seen
+
+def with_dependencies(stages: Dict[str, Dict], targets: List[str]) -> List[str]:
+    """The targets and every stage they run after, in graph order."""
+    needed = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            needed.add(name)
+            stack.extend(stages[name]["after"])
+    return [name for name in stages if name in needed]
+
+class FileHasher:
+    """sha256 of files and directory trees, reusing a file's digest while its size and mtime are unchanged."""
+
+    def __init__(self, known: Optional[Dict] = None):
+        self.known = known or {}  # Path -> [size, mtime_ns, sha256]
+        self.lock = threading.Lock()
+
+    def file(self, path: str) -> str:
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.known.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        with self.lock:
+            self.known[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def path(self, path: str) -> Optional[str]:
+        """Digest of a file, or of a directory's file names and contents; None if it does not exist."""
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(f"{os.path.relpath(file_path, path)}\0{self.file(file_path)}\n".encode())
+        return digest.hexdigest()
+
+class PipelineState:
+    """
+    Fingerprints of each stage's last successful run and the file digest cache, saved
+    atomically after every stage so an interrupted run resumes from the stage that stopped it.
+    """
+
+    def __init__(self, state_file: str):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        data = {}
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Warning: Ignoring unreadable state file {state_file}: {e}")
+        if data.get("version") != STATE_VERSION:
+            data = {}
+        self.stages = data.get("stages", {})
+        self.hasher = FileHasher(data.get("files", {}))
+
+    def record(self, name: str, record: Dict) -> None:
+        with self.lock:
+            self.stages[name] = record
+            self.save()
+
+    def save(self) -> None:
+        with self.hasher.lock:
+            files = {path: entry for path, entry in self.hasher.known.items() if os.path.exists(path)}
+        temp_file = f"{self.state_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "stages": self.stages, "files": files}, f, indent=2)
+        os.replace(temp_file, self.state_file)
+
+def arg_files(stage: Dict) -> List[str]:
+    """Existing files named in a stage's arguments that are not its outputs, e.g. a --variants_file."""
+    declared = set(stage["inputs"]) | set(stage["outputs"])
+    return [arg for arg in stage["args"] if arg not in declared and os.path.isfile(arg)]
+
+def fingerprint(stage: Dict, hasher: FileHasher) -> Dict:
+    """What a stage's output depends on: its code, parameters and inputs."""
+    return {
+        "code": {name: hasher.file(os.path.join(SCRIPT_DIR, name)) for name in stage["code"]},
+        "params": {
+            "args": stage["args"],
+            "env": stage["env"],
+            "env_params": {name: os.getenv(name) for name in stage["env_params"]},
+        },
+        "inputs": {path: hasher.path(path) for path in stage["inputs"] + arg_files(stage)},
+    }
+
+def stale_reason(stage: Dict, record: Optional[Dict], current: Dict, hasher: FileHasher) -> Optional[str]:
+    """Why a stage must run again, or None if its last run still matches its code, parameters, inputs and outputs."""
+    if record is None:
+        return "never run"
+    changed = [name for name, digest in current["code"].items() if record["code"].get(name) != digest]
+    if changed:
+        return f"code changed: {', '.join(changed)}"
+    if record["params"] != current["params"]:
+        return "parameters changed"
+    changed = [path for path, digest in current["inputs"].items() if record["inputs"].get(path) != digest]
+    if changed:
+        return f"input changed: {', '.join(changed)}"
+    changed = [path for path, digest in record["outputs"].items() if hasher.path(path) != digest]
+    if changed:
+        return f"output missing or modified: {', '.join(changed)}"
+    return None
+
+def run_stage(name: str, stage: Dict, log_dir: str, verbose: bool = False) -> int:
+    """Run a stage's script with stdin closed, writing its output to <log_dir>/<stage>.log. Returns the exit code."""
+    os.makedirs(log_dir, exist_ok=True)
+    command = [sys.executable, os.path.join(SCRIPT_DIR, stage["script"])] + stage["args"]
+    env = {**os.environ, **stage["env"], "PYTHONUNBUFFERED": "1"}
+    with open(os.path.join(log_dir, f"{name}.log"), "w", encoding="utf-8") as log:
+        process = subprocess.Popen(command, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, text=True, encoding="utf-8", errors="replace")
+        for line in process.stdout:
+            log.write(line)
+            if verbose:
+                report(f"[{name}] {line.rstrip()}")
+        return process.wait()
+
+def log_tail(name: str, log_dir: str) -> str:
+    with open(os.path.join(log_dir, f"{name}.log"), "r", encoding="utf-8") as f:
+        return "".join(f.readlines()[-LOG_TAIL_LINES:])
+
+def output_mtime(path: str) -> Optional[int]:
+    """mtime of a file output, or None if it is missing or a directory (crawls may leave those untouched)."""
+    return os.stat(path).st_mtime_ns if os.path.isfile(path) else None
+
+def execute_stage(name: str, stage: Dict, state: PipelineState, log_dir: str, force: bool, refresh: bool,
+                  verbose: bool) -> Dict:
+    """
+    Run a stage if it is stale and record its new fingerprint. Returns its status and run time.
+    A stage fails if it exits non-zero, or exits 0 without writing (or rewriting) its file outputs.
+    """
+    current = fingerprint(stage, state.hasher)
+    reason = stale_reason(stage, state.stages.get(name), current, state.hasher)
+    if reason is None and force:
+        reason = "forced"
+    if reason is None and refresh and stage.get("volatile"):
+        reason = "refresh requested"
+    if reason is None:
+        report(f"{name}: up to date, skipped")
+        return {"status": "skipped"}
+
+    report(f"{name}: running ({reason})")
+    before = {path: output_mtime(path) for path in stage["outputs"]}
+    start = time.time()
+    exit_code = run_stage(name, stage, log_dir, verbose)
+    elapsed = time.time() - start
+    missing = [path for path in stage["outputs"] if not os.path.exists(path)
+               or (os.path.isfile(path) and output_mtime(path) == before[path])]
+    if exit_code != 0 or missing:
+        problem = f"exit code {exit_code}" if exit_code != 0 else f"no new {', '.join(missing)} written"
+        report(f"{name}: failed ({problem}) after {elapsed:.1f}s; last lines of {os.path.join(log_dir, name)}.log:")
+        report(log_tail(name, log_dir).rstrip())
+        return {"status": "failed", "seconds": elapsed}
+
+    record = {**current, "outputs": {path: state.hasher.path(path) for path in stage["outputs"]},
+              "seconds": round(elapsed, 3), "finished": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    state.record(name, record)
+    report(f"{name}: done in {elapsed:.1f}s")
+    return {"status": "ran", "seconds": elapsed}
+
+def run_pipeline(stages: Dict[str, Dict], selected: List[str], state: PipelineState, jobs: int = DEFAULT_JOBS,
+                 force: List[str] = (), refresh: bool = False, log_dir: str = DEFAULT_LOG_DIR,
+                 verbose: bool = False) -> Dict[str, Dict]:
+    """
+    Run the selected stages as soon as the stages they run after have finished, up to jobs at a
+    time, so independent branches overlap. Stages after a failed one are blocked. A stage whose
+    upstream re-ran but wrote identical output is still skipped, since fingerprints hash content.
+    """
+    results = {}
+    pending = list(selected)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while pending or running:
+            for name in list(pending):
+                after = [upstream for upstream in stages[name]["after"] if upstream in selected]
+                failed = [upstream for upstream in after if results.get(upstream, {}).get("status") in ("failed", "blocked")]
+                if failed:
+                    report(f"{name}: blocked by {', '.join(failed)}")
+                    results[name] = {"status": "blocked"}
+                    pending.remove(name)
+                elif all(upstream in results for upstream in after):
+                    pending.remove(name)
+                    future = executor.submit(execute_stage, name, stages[name], state, log_dir, name in force,
+                                             refresh, verbose)
+                    running[future] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    report(f"{name}: failed: {e}")
+                    results[name] = {"status": "failed"}
+    return results
+
+def plan(stages: Dict[str, Dict], selected: List[str], state: PipelineState, force: List[str] = (),
+         refresh: bool = False) -> Dict[str, Optional[str]]:
+    """Why each selected stage would run (None if it would be skipped), without running anything."""
+    reasons = {}
+    for name in selected:
+        stage = stages[name]
+        reason = stale_reason(stage, state.stages.get(name), fingerprint(stage, state.hasher), state.hasher)
+        if reason is None and name in force:
+            reason = "forced"
+        if reason is None and refresh and stage.get("volatile"):
+            reason = "refresh requested"
+        if reason is None:
+            upstream = [after for after in stage["after"] if reasons.get(after)]
+            if upstream:
+                reason = f"if {', '.join(upstream)} changes its output"
+        reasons[name] = reason
+    return reasons
+
+def parse_args():
+    stage_names = list(build_stages(DEFAULT_PATHS))
+    parser = argparse.ArgumentParser(
+        description="Run the docs (crawler, formatter) and dataset (prompt_generator, dataset_cleaner, "
+                    "add_system_context, train) pipelines, re-running only stages whose code, parameters "
+                    "or inputs changed.")
+    parser.add_argument("targets", nargs="*", metavar="stage",
+                        help=f"Stages to bring up to date, with the stages they depend on ({', '.join(stage_names)}; "
+                             "default: formatter and train)")
+    parser.add_argument("--config", help=f"Pipeline config with paths and per-stage args and env "
+                                          f"(default: {DEFAULT_CONFIG_FILE} if present)")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS,
+                        help="Stages run at the same time (default: PIPELINE_JOBS or 2)")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE",
+                        help="Run this stage even if it is up to date (repeatable); later stages re-run if its output changes")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Re-run stages that mirror remote sources (the crawler) to pick up upstream changes")
+    parser.add_argument("--dry-run", action="store_true", help="Show which stages would run and why, then exit")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FILE,
+                        help="Where stage fingerprints are kept (default: PIPELINE_STATE_FILE or .pipeline_state.json)")
+    parser.add_argument("--log-dir", default=DEFAULT_LOG_DIR,
+                        help="Directory for each stage's output log (default: PIPELINE_LOG_DIR or pipeline_logs)")
+    parser.add_argument("--verbose", action="store_true", help="Also stream each stage's output, prefixed with its name")
+    args = parser.parse_args()
+    unknown = [name for name in args.targets + args.force if name not in stage_names]
+    if unknown:
+        parser.error(f"Unknown stage: {', '.join(unknown)} (choose from {', '.join(stage_names)})")
+    return args
+
+def main():
+    args = parse_args()
+    stages = configure_stages(load_config(args.config))
+    targets = args.targets or [name for name in stages if not any(name in stage["after"] for stage in stages.values())]
+    selected = with_dependencies(stages, targets + args.force)
+    for name in selected:
+        missing = [option for option in stages[name].get("required_args", []) if option not in stages[name]["args"]]
+        if missing:
+            sys.exit(f"Error: {name} needs {', '.join(missing)} in its config args "
+                     f"(\"stages\": {{\"{name}\": {{\"args\": [...]}}}})")
+    state = PipelineState(args.state_file)
+
+    if args.dry_run:
+        for name, reason in plan(stages, selected, state, args.force, args.refresh).items():
+            print(f"{name}: {'would run (' + reason + ')' if reason else 'up to date'}")
+        return
+
+    start = time.time()
+    results = run_pipeline(stages, selected, state, args.jobs, args.force, args.refresh, args.log_dir, args.verbose)
+    by_status = {}
+    for name in selected:
+        result = results[name]
+        by_status.setdefault(result["status"], []).append(name)
+    print("=" * 50)
+    print(f"Pipeline finished in {time.time() - start:.1f}s: " +
+          "; ".join(f"{status} {', '.join(names)}" for status, names in by_status.items()))
+    if by_status.get("failed") or by_status.get("blocked"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 import os
+import sys
 import yaml
 import json
 import time
-import shutil
+import hashlib
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 from ollama import Client
 from dotenv import load_dotenv
 
+from dataset_io import DatasetWriter
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -15,18 +22,30 @@ OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3')
 YAML_DIR = os.getenv('YAML_DIR', './xql_queries')
 OUTPUT_FILE = os.getenv('OUTPUT_FILE', 'dataset.json')
-PROCESSED_DIR = os.getenv('PROCESSED_DIR', './processed_xql_queries')
+OLLAMA_PARALLEL = int(os.getenv('OLLAMA_PARALLEL', '4'))
+STATE_INDEX_FILE = os.getenv('STATE_INDEX_FILE', f"{os.path.splitext(OUTPUT_FILE)[0]}.state.sqlite")
+STATE_COMMIT_EVERY = int(os.getenv('STATE_COMMIT_EVERY', '50'))
+STATE_CLAIM_TTL = float(os.getenv('STATE_CLAIM_TTL', '3600'))  # Seconds before another run may take over a claim
+PROMPT_CACHE_FILE = os.getenv('PROMPT_CACHE_FILE', 'prompt_cache.sqlite')  # Empty string disables the cache
+PROMPT_CACHE_MAX_MB = float(os.getenv('PROMPT_CACHE_MAX_MB', '64'))
 
 # Print key info for verification
 print(f"Connecting to Ollama at {OLLAMA_HOST} with model {OLLAMA_MODEL}")
 print(f"YAML directory: {os.path.abspath(YAML_DIR)}")
 print(f"Output file path: {os.path.abspath(OUTPUT_FILE)}")
-print(f"Processed directory: {os.path.abspath(PROCESSED_DIR)}")
+print(f"Parallel generation requests: {OLLAMA_PARALLEL}")
+print(f"State index path: {os.path.abspath(STATE_INDEX_FILE)}")
+print(f"Prompt cache: {os.path.abspath(PROMPT_CACHE_FILE) if PROMPT_CACHE_FILE else 'disabled'}")
 
-# Ensure processed directory exists
-if not os.path.exists(PROCESSED_DIR):
-    os.makedirs(PROCESSED_DIR)
-    print(f"Created processed directory: {PROCESSED_DIR}")
+PROMPT_TEMPLATE = (
+    "Given the following Cortex XQL query details:\n"
+    "- Categories: {categories}\n"
+    "- Description: {description}\n"
+    "- Name: {name}\n"
+    "- Sources: {sources}\n"
+    "- XQL: {xql}\n\n"
+    "Create a concise, natural-sounding user prompt in the user's voice (e.g., 'I want to...') within curly brackets {{}}."
+)
 
 class QueryDetails(BaseModel):
     """Pydantic model to validate and structure XQL query details from YAML."""
@@ -36,17 +55,321 @@ class QueryDetails(BaseModel):
     sources: list[str] = []
     xql: str = ''
 
+class GenerationStats:
+    """Thread-safe collector of per-request Ollama latency and token throughput."""
+
+    def __init__(self):
+        self.latencies = []
+        self.eval_tokens = 0
+        self.eval_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, response) -> None:
+        """Record one generate call; eval_count/eval_duration come from the Ollama response."""
+        eval_count = response.get('eval_count') or 0
+        eval_seconds = (response.get('eval_duration') or 0) / 1e9
+        with self._lock:
+            self.latencies.append(latency)
+            self.eval_tokens += eval_count
+            self.eval_seconds += eval_seconds
+
+    def report(self, wall_time: float) -> None:
+        """Print latency percentiles and tokens/sec for the requests made so far."""
+        if not self.latencies:
+            print("No generation requests were made.")
+            return
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        mean = sum(latencies) / count
+        p50 = latencies[count // 2]
+        p95 = latencies[min(count - 1, int(count * 0.95))]
+        print(f"Generation requests: {count}, latency mean {mean:.2f}s, p50 {p50:.2f}s, p95 {p95:.2f}s, max {latencies[-1]:.2f}s")
+        if self.eval_seconds > 0:
+            print(f"Generated tokens: {self.eval_tokens}, {self.eval_tokens / self.eval_seconds:.1f} tokens/sec per request, "
+                  f"{self.eval_tokens / max(wall_time, 1e-9):.1f} tokens/sec overall")
+
+def hash_file(path: str) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class StateIndex:
+    """
+    SQLite index of YAML files, keyed by path relative to the YAML directory.
+    Each row records the file's content hash, the fingerprint (model, prompt template and code) it was
+    processed with, its status ('done', 'skipped' or 'error') and, for generated files, the dataset
+    entry. Source files are never moved: the work queue is a directory scan diffed against the index.
+    Rows are committed in batches of commit_every, so a crash loses at most one batch.
+
+    Several runs can share an index: a run claims the files it will process in the claims table,
+    and files claimed by another run are left to it. Claims are renewed on every commit and
+    released when their file is recorded; a claim older than claim_ttl (a crashed run) can be taken over.
+    """
+
+    def __init__(self, path: str, fingerprint: str, commit_every: int = STATE_COMMIT_EVERY,
+                 claim_ttl: float = STATE_CLAIM_TTL):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.commit_every = max(1, commit_every)
+        self.claim_ttl = claim_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+        self.pending = 0
+        self.scanned = {}  # Relative path -> (content hash, size, mtime_ns) from the last scan
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, content_hash TEXT NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, fingerprint TEXT NOT NULL, status TEXT NOT NULL, "
+            "entry TEXT, error TEXT, updated REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS claims (path TEXT PRIMARY KEY, owner TEXT NOT NULL, claimed REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def needs_processing(self, row, content_hash: str) -> bool:
+        """True if a file with this content hash and index row (content_hash, ..., fingerprint, status) is due."""
+        return row is None or row[0] != content_hash or row[3] != self.fingerprint or row[4] == 'error'
+
+    def scan(self, yaml_dir: str) -> list:
+        """
+        Diff the YAML files in yaml_dir against the index and return the sorted relative paths that
+        need processing: new or changed files, files processed with another fingerprint and files
+        that failed last time. Files are only re-hashed when their size or mtime changed.
+        Rows of files that no longer exist are dropped. Only the files this run could claim are returned.
+        """
+        known = {
+            row[0]: row[1:]
+            for row in self.db.execute(
+                "SELECT path, content_hash, size, mtime_ns, fingerprint, status FROM files"
+            )
+        }
+        with os.scandir(yaml_dir) as entries:
+            yaml_entries = sorted(
+                (e for e in entries if e.is_file() and e.name.endswith(('.yaml', '.yml'))),
+                key=lambda e: e.name
+            )
+        self.scanned = {}
+        queue = []
+        hashed = 0
+        for dir_entry in yaml_entries:
+            stat = dir_entry.stat()
+            row = known.get(dir_entry.name)
+            if row is not None and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+                content_hash = row[0]
+            else:
+                content_hash = hash_file(dir_entry.path)
+                hashed += 1
+                if row is not None and row[0] == content_hash:
+                    # Touched but unchanged: refresh the stat so the next scan skips hashing it
+                    self.db.execute(
+                        "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                        (stat.st_size, stat.st_mtime_ns, dir_entry.name)
+                    )
+            self.scanned[dir_entry.name] = (content_hash, stat.st_size, stat.st_mtime_ns)
+            if self.needs_processing(row, content_hash):
+                queue.append(dir_entry.name)
+        removed = [path for path in known if path not in self.scanned]
+        self.db.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in removed))
+        self.db.commit()
+        claimed = self.claim(queue)
+        print(f"Scanned {len(yaml_entries)} YAML files ({hashed} hashed): {len(claimed)} to process, "
+              f"{len(yaml_entries) - len(queue)} up to date, {len(queue) - len(claimed)} claimed by another run "
+              f"or done meanwhile, {len(removed)} removed from the index")
+        return claimed
+
+    def claim(self, paths: list) -> list:
+        """
+        Claim paths for this run in one write transaction, skipping those another run holds a live
+        claim on or has recorded since the scan. Returns the claimed paths in order.
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            held = {
+                path for (path,) in self.db.execute(
+                    "SELECT path FROM claims WHERE owner != ? AND claimed > ?", (self.owner, now - self.claim_ttl)
+                )
+            }
+            claimed = []
+            for path in paths:
+                if path in held:
+                    continue
+                row = self.db.execute(
+                    "SELECT content_hash, size, mtime_ns, fingerprint, status FROM files WHERE path = ?", (path,)
+                ).fetchone()
+                if self.needs_processing(row, self.scanned[path][0]):
+                    claimed.append(path)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO claims (path, owner, claimed) VALUES (?, ?, ?)",
+                ((path, self.owner, now) for path in claimed)
+            )
+            self.db.commit()
+        except BaseException:
+            self.db.rollback()
+            raise
+        return claimed
+
+    def record(self, path: str, status: str, entry: dict = None, error: str = None) -> None:
+        """Record the outcome for a scanned file, committing once a batch is complete."""
+        content_hash, size, mtime_ns = self.scanned[path]
+        self.db.execute(
+            "INSERT OR REPLACE INTO files "
+            "(path, content_hash, size, mtime_ns, fingerprint, status, entry, error, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, content_hash, size, mtime_ns, self.fingerprint, status,
+             json.dumps(entry) if entry is not None else None, error, time.time())
+        )
+        self.db.execute("DELETE FROM claims WHERE path = ? AND owner = ?", (path, self.owner))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        """Commit recorded rows and renew this run's remaining claims."""
+        self.db.execute("UPDATE claims SET claimed = ? WHERE owner = ?", (time.time(), self.owner))
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        """Commit, release this run's remaining claims (files it did not get to) and close the index."""
+        self.db.execute("DELETE FROM claims WHERE owner = ?", (self.owner,))
+        self.commit()
+        self.db.close()
+
+    def entry_count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM files WHERE status = 'done'").fetchone()[0]
+
+    def error_count(self) -> int:
+        """Number of files whose last processing attempt failed."""
+        return self.db.execute("SELECT COUNT(*) FROM files WHERE status = 'error'").fetchone()[0]
+
+    def export(self, output_file: str) -> int:
+        """
+        Atomically write the indexed entries to output_file in path order, streaming one entry at a
+        time. A .json file matches json.dump(entries, f, indent=2); .jsonl and compressed suffixes
+        are written as dataset_io.DatasetWriter does. Returns the entry count.
+        """
+        with DatasetWriter(output_file) as writer:
+            for (entry,) in self.db.execute("SELECT entry FROM files WHERE status = 'done' ORDER BY path"):
+                writer.write(json.loads(entry))
+        return writer.count
+
+class PromptCache:
+    """
+    Persistent, content-addressed cache of accepted (bracketed) Ollama responses.
+    Keys hash the model, the prompt template and the normalized query fields, so re-running the
+    generator after edits that don't change what the model sees is served without generate calls.
+    Entries are evicted least-recently-used once the stored responses exceed max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = int(PROMPT_CACHE_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.commit()
+        self.total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def normalize(query_details: QueryDetails) -> dict:
+        """Collapse whitespace-only differences in the fields that are sent to the model."""
+        xql_lines = [line.strip() for line in query_details.xql.splitlines()]
+        return {
+            'categories': [category.strip() for category in query_details.categories],
+            'description': ' '.join(query_details.description.split()),
+            'name': ' '.join(query_details.name.split()),
+            'sources': [source.strip() for source in query_details.sources],
+            'xql': '\n'.join(line for line in xql_lines if line),
+        }
+
+    def key(self, model: str, query_details: QueryDetails) -> str:
+        """Return the cache key for a generate request."""
+        material = json.dumps([model, PROMPT_TEMPLATE, self.normalize(query_details)], sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached response for key, or None on a miss."""
+        with self._lock:
+            row = self._db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key: str, response: str):
+        """Store an accepted response and evict old entries if the cache is over its size limit."""
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.total_bytes -= row[0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            self.total_bytes += size
+            self.stores += 1
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Drop least-recently-used entries until the cache fits in max_bytes. Caller holds the lock."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._db.close()
+
+    def report(self):
+        """Print hit/miss counts and the cache size."""
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        print(f"Prompt cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+              f"{self.stores} stored, {self.evictions} evicted, {self.total_bytes / 1024:.1f} KiB on disk")
+
 class DatasetGenerator:
     """Agent to process YAML files, generate prompts, and create a dataset in ShareGPT format incrementally."""
     
-    def __init__(self, yaml_dir: str, output_file: str, processed_dir: str, ollama_host: str, ollama_model: str):
-        """Initialize with directories, output file, and Ollama config."""
+    def __init__(self, yaml_dir: str, output_file: str, ollama_host: str, ollama_model: str,
+                 parallel: int = 1, state_index_file: str = None, prompt_cache_file: str = None):
+        """
+        Initialize with directories, output file, Ollama config and the number of concurrent generate requests.
+        Processing state is kept in state_index_file (default: <output file>.state.sqlite).
+        Accepted responses are cached in prompt_cache_file when given.
+        """
         self.yaml_dir = yaml_dir
         self.output_file = output_file
-        self.processed_dir = processed_dir
         self.ollama_client = Client(host=ollama_host)
         self.ollama_model = ollama_model
-        self.dataset_entries = []  # List to hold dataset entries incrementally
+        self.parallel = max(1, parallel)
+        self.stats = GenerationStats()
+        self.state_index_file = state_index_file or f"{os.path.splitext(output_file)[0]}.state.sqlite"
+        self.state = None  # Opened by run(); entries live in the index, not in memory
+        self.prompt_cache = PromptCache(prompt_cache_file) if prompt_cache_file else None
 
     def read_yaml(self, file_path: str) -> QueryDetails:
         """Read and parse a YAML file into a QueryDetails object."""
@@ -58,21 +381,30 @@ class DatasetGenerator:
     def generate_prompt(self, query_details: QueryDetails) -> str:
         """Generate a user prompt using Ollama, ensuring curly brackets."""
         print(f"Generating prompt for query: {query_details.name}")
-        prompt = (
-            "Given the following Cortex XQL query details:\n"
-            f"- Categories: {query_details.categories}\n"
-            f"- Description: {query_details.description}\n"
-            f"- Name: {query_details.name}\n"
-            f"- Sources: {query_details.sources}\n"
-            f"- XQL: {query_details.xql}\n\n"
-            "Create a concise, natural-sounding user prompt in the user's voice (e.g., 'I want to...') within curly brackets {}."
+        cache_key = None
+        if self.prompt_cache is not None:
+            cache_key = self.prompt_cache.key(self.ollama_model, query_details)
+            cached = self.prompt_cache.get(cache_key)
+            if cached is not None:
+                print(f"Prompt served from cache: {cached}")
+                return cached
+        prompt = PROMPT_TEMPLATE.format(
+            categories=query_details.categories,
+            description=query_details.description,
+            name=query_details.name,
+            sources=query_details.sources,
+            xql=query_details.xql
         )
         max_attempts = 5
         for attempt in range(max_attempts):
+            request_start = time.time()
             response = self.ollama_client.generate(model=self.ollama_model, prompt=prompt)
+            self.stats.record(time.time() - request_start, response)
             response_text = response['response'].strip()
             if response_text.startswith('{') and response_text.endswith('}'):
                 print(f"Prompt generated: {response_text[1:-1]}")
+                if cache_key is not None:
+                    self.prompt_cache.put(cache_key, response_text[1:-1])
                 return response_text[1:-1]
             else:
                 print(f"Attempt {attempt + 1}/{max_attempts}: No brackets, retrying...")
@@ -94,77 +426,114 @@ class DatasetGenerator:
         print(f"Cleaned XQL query:\n{cleaned_xql}")
         return cleaned_xql
 
-    def move_processed_file(self, source_path: str):
-        """Move a processed YAML file to the processed directory."""
-        filename = os.path.basename(source_path)
-        dest_path = os.path.join(self.processed_dir, filename)
-        try:
-            shutil.move(source_path, dest_path)
-            print(f"Moved {filename} to {dest_path}")
-        except Exception as e:
-            print(f"Failed to move {filename}: {e}")
+    def fingerprint(self) -> str:
+        """
+        Hash of the generation settings and of this script's code (entries are built by clean_xql and
+        friends); files processed with other settings or older code are processed again. Unchanged
+        prompts are still answered from the prompt cache, so a code change costs no Ollama calls.
+        """
+        settings = [self.ollama_model, PROMPT_TEMPLATE, hash_file(os.path.abspath(__file__))]
+        return hashlib.sha256(json.dumps(settings).encode('utf-8')).hexdigest()
 
-    def save_dataset(self):
-        """Save the current dataset entries to the JSON file."""
-        if not self.dataset_entries:
+    def save_dataset(self) -> bool:
+        """Export the indexed entries to the JSON dataset file. Returns False if nothing was written."""
+        entry_count = self.state.entry_count()
+        if not entry_count:
             print("No entries to save.")
-            return
+            return False
         try:
-            print(f"Updating dataset file: {self.output_file} with {len(self.dataset_entries)} entries")
-            with open(self.output_file, 'w') as f:
-                json.dump(self.dataset_entries, f, indent=2)
-            print(f"Dataset updated successfully with {len(self.dataset_entries)} entries")
+            print(f"Updating dataset file: {self.output_file} with {entry_count} entries")
+            count = self.state.export(self.output_file)
+            print(f"Dataset updated successfully with {count} entries")
+            return True
         except Exception as e:
             print(f"Failed to update dataset: {e}")
+            return False
+
+    def build_entry(self, file_path: str):
+        """Read a YAML file and build its ShareGPT entry. Returns None if the XQL query is empty."""
+        query_details = self.read_yaml(file_path)
+        cleaned_xql = self.clean_xql(query_details.xql)
+        if not cleaned_xql:
+            return None
+        generated_prompt = self.generate_prompt(query_details)
+        # Create ShareGPT-structured entry
+        conversation = [
+            {"from": "human", "value": generated_prompt},
+            {"from": "gpt", "value": cleaned_xql}
+        ]
+        return {"conversations": conversation}
 
     def process_files(self):
-        """Process YAML files, generate entries, save incrementally, and move files."""
-        yaml_files = [f for f in os.listdir(self.yaml_dir) if f.endswith(('.yaml', '.yml'))]
+        """
+        Process new or changed YAML files, generate entries and record them in the state index.
+        Up to self.parallel files are generated concurrently to keep the Ollama queue full, while
+        results are recorded in sorted filename order, so the output is deterministic.
+        """
+        yaml_files = self.state.scan(self.yaml_dir)
         total_files = len(yaml_files)
         print(f"Found {total_files} YAML files to process in {self.yaml_dir}")
         
         if total_files == 0:
-            print(f"No YAML files found in {self.yaml_dir}")
+            print(f"No YAML files to process in {self.yaml_dir}")
             return
 
-        for i, filename in enumerate(yaml_files, start=1):
-            file_path = os.path.join(self.yaml_dir, filename)
-            print(f"\nProcessing {i}/{total_files}: {filename}")
+        def build(filename):
             try:
-                query_details = self.read_yaml(file_path)
-                generated_prompt = self.generate_prompt(query_details)
-                cleaned_xql = self.clean_xql(query_details.xql)
-                if not cleaned_xql:
+                return self.build_entry(os.path.join(self.yaml_dir, filename)), None
+            except Exception as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            results = executor.map(build, yaml_files)
+            for i, (filename, (entry, error)) in enumerate(zip(yaml_files, results), start=1):
+                print(f"\nProcessing {i}/{total_files}: {filename}")
+                if error is not None:
+                    print(f"Error processing {filename}: {error}")
+                    self.state.record(filename, 'error', error=str(error))
+                    continue
+                if entry is None:
                     print(f"Skipping {filename}: Empty XQL query.")
-                    self.move_processed_file(file_path)
+                    self.state.record(filename, 'skipped')
                     continue
-                # Create ShareGPT-structured entry
-                conversation = [
-                    {"from": "human", "value": generated_prompt},
-                    {"from": "gpt", "value": cleaned_xql}
-                ]
-                entry = {"conversations": conversation}
-                self.dataset_entries.append(entry)
-                self.save_dataset()  # Save after each entry
-                self.move_processed_file(file_path)
-                print(f"Processed {filename} and updated dataset with entry {len(self.dataset_entries)}")
-            except Exception as e:
-                print(f"Error processing {filename}: {e}")
-                continue
+                self.state.record(filename, 'done', entry)
+                print(f"Processed {filename} and recorded its entry in the state index")
 
-    def run(self):
-        """Execute the dataset creation process."""
+    def run(self) -> bool:
+        """
+        Execute the dataset creation process. Returns False if any file failed to process
+        (now or in an earlier run, until it is fixed) or the dataset could not be written.
+        """
         start_time = time.time()
         print("\nStarting dataset generation...")
-        self.process_files()
-        print(f"\nCompleted in {time.time() - start_time:.2f} seconds.")
+        self.state = StateIndex(self.state_index_file, self.fingerprint())
+        try:
+            self.process_files()
+        finally:
+            self.state.commit()
+            saved = self.save_dataset()
+            error_count = self.state.error_count()
+            self.state.close()
+            if self.prompt_cache is not None:
+                self.prompt_cache.close()
+        elapsed = time.time() - start_time
+        self.stats.report(elapsed)
+        if self.prompt_cache is not None:
+            self.prompt_cache.report()
+        print(f"\nCompleted in {elapsed:.2f} seconds.")
+        if error_count:
+            print(f"{error_count} files failed to process; they are retried on the next run.")
+        return saved and not error_count
 
 if __name__ == '__main__':
     generator = DatasetGenerator(
         yaml_dir=YAML_DIR,
         output_file=OUTPUT_FILE,
-        processed_dir=PROCESSED_DIR,
         ollama_host=OLLAMA_HOST,
-        ollama_model=OLLAMA_MODEL
+        ollama_model=OLLAMA_MODEL,
+        parallel=OLLAMA_PARALLEL,
+        state_index_file=STATE_INDEX_FILE,
+        prompt_cache_file=PROMPT_CACHE_FILE
     )
-    generator.run()
\ No newline at end of file
+    if not generator.run():
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+import crawler
+import benchmark
+from benchmark import FakeKhub, topic_page
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_fixtures")
+
+@pytest.fixture
+def khub():
+    khub = FakeKhub(depth=1, width=2, topic_words=20)
+    yield khub
+    khub.close()
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = crawler.RequestLimiter(rate=0, max_concurrency=4)
+    monkeypatch.setattr(crawler, "request_limiter", limiter)
+    monkeypatch.setattr(crawler, "http_cache", None)
+    return limiter
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Record the backoff attempts make_request asks for and skip the sleeping."""
+    attempts = []
+    monkeypatch.setattr(crawler, "backoff_delay", lambda attempt: attempts.append(attempt) or 0.0)
+    return attempts
+
+def map_url(khub):
+    return f"{khub.url}/api/khub/maps/bench-doc"
+
+def test_retry_after_cools_down_host_and_shrinks_window(khub, limiter, backoffs):
+    khub.throttle(2, status=429, retry_after=0.2)
+    start = time.monotonic()
+    response = crawler.make_request("get", map_url(khub))
+    elapsed = time.monotonic() - start
+
+    assert response.json() == {"fingerprint": khub.fingerprint}
+    assert khub.throttled == 2
+    assert backoffs == []  # Retry-After replaces the backoff
+    assert elapsed >= 0.4
+    host = khub.url.split("//")[1]
+    assert limiter.cooldowns[host] > 0
+    stats = limiter.stats[host]
+    assert (stats["requests"], stats["retries"], stats["throttled"]) == (3, 2, 2)
+    assert limiter.concurrency < limiter.max_concurrency  # Halved twice, then grew back by one slot
+    assert limiter.in_flight == 0
+
+def test_backoff_without_retry_after(khub, limiter, backoffs):
+    khub.throttle(2, status=503)
+    crawler.make_request("get", map_url(khub))
+    assert backoffs == [0, 1]
+    assert limiter.in_flight == 0
+
+def test_gives_up_after_max_attempts(khub, limiter, backoffs, monkeypatch):
+    monkeypatch.setattr(crawler, "MAX_ATTEMPTS", 2)
+    khub.throttle(2, status=429)
+    with pytest.raises(requests.HTTPError):
+        crawler.make_request("get", map_url(khub))
+    assert limiter.in_flight == 0
+
+@pytest.mark.parametrize("error", [requests.exceptions.ChunkedEncodingError, requests.TooManyRedirects,
+                                   requests.exceptions.ContentDecodingError, requests.exceptions.InvalidURL])
+def test_every_failure_releases_its_slot(limiter, backoffs, monkeypatch, error):
+    class FailingSession:
+        def request(self, *args, **kwargs):
+            raise error("injected")
+
+    monkeypatch.setattr(crawler, "get_session", FailingSession)
+    limiter.max_concurrency = 2
+    limiter.concurrency = 2.0
+    raised = []
+
+    def call_three_times():  # A leaked slot per call would block the third call forever
+        for _ in range(3):
+            try:
+                crawler.make_request("get", "http://127.0.0.1:9/unreachable")
+            except error:
+                raised.append(error)
+
+    thread = threading.Thread(target=call_three_times, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive(), "make_request blocked on a leaked limiter slot"
+    assert len(raised) == 3
+    assert limiter.in_flight == 0
+
+def test_window_caps_requests_in_flight(khub, limiter):
+    khub.latency = 0.05
+    limiter.max_concurrency = 2
+    limiter.concurrency = 2.0
+    threads = [threading.Thread(target=crawler.make_request, args=("get", map_url(khub))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert khub.requests == 8
+    assert khub.peak_active <= 2
+    assert limiter.in_flight == 0
+
+@pytest.fixture
+def topic_fixture():
+    with open(os.path.join(FIXTURES_DIR, "khub_topic.html"), "r", encoding="utf-8") as f:
+        return f.read()
+
+def test_extractors_agree_on_fixture_page(topic_fixture):
+    assert crawler.scan_content(topic_fixture) is not None  # The scanner handles it, no fallback
+    scanned = crawler.extract_content(topic_fixture, "scan")
+    assert scanned == crawler.extract_content(topic_fixture, "soup")
+    assert scanned.startswith('<div class="topic content-locale-en-US"')
+    assert "A second content div" not in scanned and "not content" not in scanned
+
+@pytest.mark.parametrize("page", [
+    topic_page("t1", 0, 200),
+    "<html><body><p>No content div</p></body></html>",
+    "<html><body><div class='content-locale-en-US'><p>Never closed</body></html>",
+])
+def test_extractors_agree(page):
+    assert crawler.extract_content(page, "scan") == crawler.extract_content(page, "soup")
+
+@pytest.fixture
+def crawl_site(khub, limiter, tmp_path, monkeypatch):
+    """Point the crawler's endpoints at the fake khub and its output at a temp directory."""
+    for name in ("PRETTY_URL_ENDPOINT", "DOCUMENT_MAP_ENDPOINT", "PAGES_ENDPOINT", "CONTENT_ENDPOINT"):
+        monkeypatch.setattr(crawler, name, getattr(crawler, name).replace(crawler.BASE_URL, khub.url))
+    monkeypatch.chdir(tmp_path)
+    return khub
+
+def test_markdown_reports_topics_that_failed_to_fetch(crawl_site, monkeypatch, capsys):
+    fetch = crawler.fetch_content_response
+
+    def failing_fetch(document_id, topic_id, fingerprint, headers=None):
+        if topic_id == "t1":
+            raise requests.ConnectionError("injected")
+        return fetch(document_id, topic_id, fingerprint, headers=headers)
+
+    monkeypatch.setattr(crawler, "fetch_content_response", failing_fetch)
+    job = crawler.prepare_document(benchmark.PRETTY_URL, benchmark.PRODUCT, benchmark.DOCUMENT)
+    result = crawler.crawl_document(job, workers=1, markdown_dir="markdown")
+
+    assert result["failed_topics"] == 1
+    assert "no crawled content for topic t1" in capsys.readouterr().out
+    markdown_file = os.path.join("markdown", benchmark.PRODUCT, crawler.sanitize_filename(benchmark.DOCUMENT),
+                                 "full_documentation.md")
+    with open(markdown_file, "r", encoding="utf-8") as f:
+        assert "Error fetching content" not in f.read()
@@ -0,0 +1,64 @@
+import json
+import sys
+
+import pytest
+
+import dataset_dedup
+from dataset_dedup import dedup_dataset
+
+QUERY = ('dataset = xdr_data | filter event_type = ENUM.PROCESS and agent_hostname = "alpha" and '
+         'action_process_image_name contains "powershell" | fields _time, agent_hostname, '
+         'action_process_image_command_line, actor_effective_username | sort desc _time | limit 100')
+PROMPT = ("Show the most recent PowerShell process executions on host alpha with their command lines "
+          "and the user that ran them")
+
+def entry(prompt, xql):
+    return {"conversations": [{"from": "human", "value": prompt}, {"from": "gpt", "value": xql}]}
+
+@pytest.fixture
+def dataset(tmp_path):
+    entries = [
+        entry(PROMPT, QUERY),
+        entry("Count alerts by severity", "dataset = alerts | comp count() by severity"),
+        entry(PROMPT + " please", QUERY.replace("limit 100", "limit 50")),  # Near duplicate of 1
+        entry("List failed logins", "dataset = xdr_data | filter event_type = ENUM.LOGIN"),
+        entry("Alerts per severity", "dataset = alerts  |  comp count()  by severity"),  # Same XQL as 2
+    ]
+    path = tmp_path / "dataset.json"
+    path.write_text(json.dumps(entries))
+    return path
+
+def run(dataset, **kwargs):
+    output = dataset.parent / "out.json"
+    report = dedup_dataset(str(dataset), str(output), **{"workers": 1, **kwargs})
+    kept = [item["conversations"][0]["value"] for item in json.loads(output.read_text())]
+    clusters = sorted((cluster["type"], cluster["kept"], cluster["removed"]) for cluster in report["clusters"])
+    return clusters, kept
+
+def test_exact_and_near_duplicates(dataset, capsys):
+    clusters, kept = run(dataset)
+    assert clusters == [("exact", 2, [5]), ("near", 1, [3])]
+    assert kept == [PROMPT, "Count alerts by severity", "List failed logins"]  # Original order
+
+def test_exact_only(dataset, capsys):
+    clusters, _ = run(dataset, near=False)
+    assert clusters == [("exact", 2, [5])]
+
+def test_keep_policies(dataset, capsys):
+    assert run(dataset, keep="last")[0] == [("exact", 5, [2]), ("near", 3, [1])]
+    assert run(dataset, keep="longest")[0] == [("exact", 2, [5]), ("near", 3, [1])]
+
+def test_workers_give_the_same_result(dataset, capsys):
+    assert run(dataset, workers=2, batch_size=2) == run(dataset)
+
+def test_unreadable_input_exits_non_zero(tmp_path, monkeypatch, capsys):
+    broken = tmp_path / "broken.json"
+    broken.write_text('[{"conversations": ')
+    output = tmp_path / "out.json"
+    for path in (tmp_path / "missing.json", broken):
+        assert dedup_dataset(str(path), str(output)) is None
+        monkeypatch.setattr(sys, "argv", ["dataset_dedup.py", str(path), "--output", str(output)])
+        with pytest.raises(SystemExit) as exit_info:
+            dataset_dedup.main()
+        assert exit_info.value.code == 1
+    assert list(tmp_path.iterdir()) == [broken]  # No output or temp file left behind
@@ -0,0 +1,71 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import packing
+from packing import IGNORE_INDEX, LengthGroupedSampler, PackedDataset, pack_examples, padding_stats
+
+class ListDataset:
+    """The part of token_cache.TokenizedDataset that packing uses."""
+
+    def __init__(self, examples):
+        self.examples = examples
+
+    def __len__(self):
+        return len(self.examples)
+
+    def length(self, index):
+        return len(self.examples[index]["input_ids"])
+
+    def __getitem__(self, index):
+        return self.examples[index]
+
+def example(start, length):
+    ids = list(range(start, start + length))
+    return {"input_ids": ids, "labels": ids}
+
+def test_imports_without_transformers():
+    code = "import sys; sys.modules['transformers'] = None; import packing"
+    cwd = os.path.dirname(os.path.abspath(packing.__file__))
+    assert subprocess.run([sys.executable, "-c", code], cwd=cwd).returncode == 0
+
+def test_bins_hold_every_example_once_within_the_limit():
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 100) for _ in range(500)]
+    bins = pack_examples(lengths, 128)
+    assert sorted(i for group in bins for i in group) == list(range(len(lengths)))
+    assert all(sum(lengths[i] for i in group) <= 128 for group in bins)
+    assert len(bins) <= sum(lengths) / 128 * 1.1 + 1  # Best fit decreasing stays close to the bound
+
+def test_packed_rows_keep_example_boundaries():
+    dataset = ListDataset([example(10, 3), example(20, 2), example(30, 4)])
+    packed = PackedDataset(dataset, max_seq_length=6)
+    rows = [packed[i] for i in range(len(packed))]
+    assert sorted(len(row["input_ids"]) for row in rows) == [3, 6]
+    row = next(row for row in rows if len(row["input_ids"]) == 6)  # The 4- and 2-token examples
+    assert row["input_ids"] == [30, 31, 32, 33, 20, 21]
+    assert row["attention_mask"] == [1, 1, 1, 1, 2, 2]
+    assert row["position_ids"] == [0, 1, 2, 3, 0, 1]
+    assert row["labels"] == [IGNORE_INDEX, 31, 32, 33, IGNORE_INDEX, 21]
+
+def test_length_grouping_cuts_padding_and_covers_every_index():
+    rng = random.Random(1)
+    lengths = [rng.randint(1, 512) for _ in range(1000)]
+    sampler = LengthGroupedSampler(lengths, batch_size=8)
+    batches = sampler.batches()
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    shuffled = list(range(len(lengths)))
+    rng.shuffle(shuffled)
+    random_batches = [shuffled[i:i + 8] for i in range(0, len(shuffled), 8)]
+    assert padding_stats(batches, lengths)[1] < padding_stats(random_batches, lengths)[1]
+
+@pytest.mark.parametrize("epoch", [0, 1])
+def test_sampler_is_deterministic_per_epoch(epoch):
+    lengths = list(range(1, 101))
+    first, second = LengthGroupedSampler(lengths, 4), LengthGroupedSampler(lengths, 4)
+    first.set_epoch(epoch)
+    second.set_epoch(epoch)
+    assert list(first) == list(second)
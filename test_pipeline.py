@@ -0,0 +1,114 @@
+import json
+import os
+import sys
+
+import pytest
+
+import pipeline
+
+COPY_SCRIPT = """import sys
+with open(sys.argv[1]) as f:
+    text = f.read()
+with open(sys.argv[2], "w") as f:
+    f.write(text.upper())
+"""
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Stage scripts and their files in a temp directory, with the runner's output kept quiet."""
+    monkeypatch.setattr(pipeline, "SCRIPT_DIR", str(tmp_path))
+    monkeypatch.setattr(pipeline, "report", lambda message: None)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "copy.py").write_text(COPY_SCRIPT)
+    (tmp_path / "source.txt").write_text("hello")
+    return tmp_path
+
+def make_stage(script, inputs, outputs, after=(), args=None):
+    return {"script": script, "after": list(after), "args": inputs + outputs if args is None else args,
+            "env": {}, "env_params": [], "inputs": inputs, "outputs": outputs, "code": [script]}
+
+def chain():
+    """Two copy stages: source.txt -> middle.txt -> final.txt."""
+    return {
+        "first": make_stage("copy.py", ["source.txt"], ["middle.txt"]),
+        "second": make_stage("copy.py", ["middle.txt"], ["final.txt"], after=["first"]),
+    }
+
+def run(stages, state_file=".state.json", **kwargs):
+    state = pipeline.PipelineState(state_file)
+    results = pipeline.run_pipeline(stages, list(stages), state, jobs=2, log_dir="logs", **kwargs)
+    return {name: result["status"] for name, result in results.items()}
+
+def test_second_run_skips_everything(workdir):
+    assert run(chain()) == {"first": "ran", "second": "ran"}
+    assert (workdir / "final.txt").read_text() == "HELLO"
+    assert run(chain()) == {"first": "skipped", "second": "skipped"}
+
+def test_changed_input_reruns_downstream(workdir):
+    run(chain())
+    (workdir / "source.txt").write_text("changed")
+    assert run(chain()) == {"first": "ran", "second": "ran"}
+    assert (workdir / "final.txt").read_text() == "CHANGED"
+
+def test_identical_upstream_output_skips_downstream(workdir):
+    run(chain())
+    (workdir / "source.txt").write_text("HELLO")  # Upper-cases to the same middle.txt
+    assert run(chain()) == {"first": "ran", "second": "skipped"}
+
+def test_code_params_and_outputs_make_a_stage_stale(workdir):
+    stages = chain()
+    run(stages)
+    state = pipeline.PipelineState(".state.json")
+    stage = stages["first"]
+
+    def reason(stage):
+        return pipeline.stale_reason(stage, state.stages["first"], pipeline.fingerprint(stage, state.hasher),
+                                     state.hasher)
+
+    assert reason(stage) is None
+    assert reason({**stage, "args": stage["args"] + ["--flag"]}) == "parameters changed"
+    (workdir / "middle.txt").write_text("edited by hand")
+    assert reason(stage) == "output missing or modified: middle.txt"
+    (workdir / "copy.py").write_text(COPY_SCRIPT + "# edited\n")
+    assert reason(stage) == "code changed: copy.py"
+
+def test_failed_stage_blocks_downstream_and_is_retried(workdir):
+    (workdir / "fail.py").write_text("import sys\nsys.exit(3)\n")
+    stages = chain()
+    stages["first"] = make_stage("fail.py", ["source.txt"], ["middle.txt"])
+    assert run(stages) == {"first": "failed", "second": "blocked"}
+    assert "first" not in pipeline.PipelineState(".state.json").stages
+    assert run(stages)["first"] == "failed"  # Not recorded, so it runs again
+
+def test_exit_zero_without_rewriting_output_fails(workdir):
+    (workdir / "noop.py").write_text("print('did nothing')\n")
+    (workdir / "middle.txt").write_text("stale output from an earlier run")
+    stages = chain()
+    stages["first"] = make_stage("noop.py", ["source.txt"], ["middle.txt"])
+    assert run(stages) == {"first": "failed", "second": "blocked"}
+
+def test_refresh_reruns_volatile_stages_only(workdir):
+    stages = chain()
+    run(stages)
+    stages["first"]["volatile"] = True
+    assert run(stages, refresh=True) == {"first": "ran", "second": "skipped"}
+
+def test_plan_reports_reasons_without_running(workdir):
+    state = pipeline.PipelineState(".state.json")
+    assert pipeline.plan(chain(), ["first", "second"], state) == {"first": "never run", "second": "never run"}
+    assert not (workdir / "middle.txt").exists()
+
+def test_code_files_follow_local_imports(workdir):
+    (workdir / "main.py").write_text("import os\nfrom helper import thing\n")
+    (workdir / "helper.py").write_text("import shared\nthing = 1\n")
+    (workdir / "shared.py").write_text("import helper\n")
+    assert pipeline.code_files("main.py") == ["main.py", "helper.py", "shared.py"]
+
+def test_add_system_context_requires_a_system_message(workdir, monkeypatch):
+    with open("pipeline.json", "w", encoding="utf-8") as f:
+        json.dump({"stages": {"add_system_context": {"args": ["--variants_file", "variants.json"]}}}, f)
+    monkeypatch.setattr(sys, "argv", ["pipeline.py", "--dry-run"])
+    monkeypatch.setattr(pipeline, "SCRIPT_DIR", os.path.dirname(os.path.abspath(pipeline.__file__)))
+    with pytest.raises(SystemExit) as exit_info:
+        pipeline.main()
+    assert "add_system_context needs --system_message" in str(exit_info.value)
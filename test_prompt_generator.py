@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from prompt_generator import StateIndex
+
+@pytest.fixture
+def yaml_dir(tmp_path):
+    queries = tmp_path / "queries"
+    queries.mkdir()
+    for name in ("a", "b", "c"):
+        (queries / f"{name}.yaml").write_text(f"name: {name}\n")
+    (queries / "notes.txt").write_text("not a query")
+    return queries
+
+@pytest.fixture
+def index_file(tmp_path):
+    return str(tmp_path / "state.sqlite")
+
+def process(index, paths):
+    for path in paths:
+        index.record(path, "done", {"conversations": [{"from": "human", "value": path}]})
+
+def test_resumes_after_a_crash(yaml_dir, index_file):
+    first = StateIndex(index_file, "fp", commit_every=1)
+    paths = first.scan(str(yaml_dir))
+    assert paths == ["a.yaml", "b.yaml", "c.yaml"]
+    process(first, paths[:2])
+    first.db.close()  # Crash: c.yaml was claimed but never recorded
+
+    second = StateIndex(index_file, "fp", claim_ttl=0)  # The crashed run's claim has expired
+    assert second.scan(str(yaml_dir)) == ["c.yaml"]
+    process(second, ["c.yaml"])
+    output = yaml_dir.parent / "dataset.json"
+    assert second.export(str(output)) == 3
+    second.close()
+    assert [entry["conversations"][0]["value"] for entry in json.loads(output.read_text())] == \
+        ["a.yaml", "b.yaml", "c.yaml"]
+
+def test_concurrent_runs_split_the_work(yaml_dir, index_file):
+    first = StateIndex(index_file, "fp")
+    second = StateIndex(index_file, "fp")
+    assert first.scan(str(yaml_dir)) == ["a.yaml", "b.yaml", "c.yaml"]
+    assert second.scan(str(yaml_dir)) == []
+    first.close()  # Releases the claims it never recorded
+    assert second.scan(str(yaml_dir)) == ["a.yaml", "b.yaml", "c.yaml"]
+    second.close()
+
+def test_changes_errors_and_fingerprints_make_files_due(yaml_dir, index_file):
+    index = StateIndex(index_file, "fp")
+    process(index, index.scan(str(yaml_dir)))
+    assert index.scan(str(yaml_dir)) == []
+    (yaml_dir / "b.yaml").write_text("name: changed\n")
+    index.record("a.yaml", "error", error="boom")
+    assert index.scan(str(yaml_dir)) == ["a.yaml", "b.yaml"]
+    assert index.error_count() == 1
+    index.close()
+
+    changed = StateIndex(index_file, "other fingerprint")
+    assert changed.scan(str(yaml_dir)) == ["a.yaml", "b.yaml", "c.yaml"]
+    changed.close()
+
+def test_removed_files_leave_the_index(yaml_dir, index_file):
+    index = StateIndex(index_file, "fp")
+    process(index, index.scan(str(yaml_dir)))
+    (yaml_dir / "c.yaml").unlink()
+    index.scan(str(yaml_dir))
+    assert index.entry_count() == 2
+    index.close()
@@ -0,0 +1,26 @@
+import pytest
+
+from xql_validator import tokenize, validate_xql
+
+def rules(query):
+    return [issue.rule for issue in validate_xql(query)]
+
+def test_parameters_are_tokens():
+    tokens = tokenize("filter user = $user_name")
+    assert [(token.kind, token.value) for token in tokens][-1] == ("param", "$user_name")
+
+@pytest.mark.parametrize("query", [
+    "dataset = xdr_data | filter agent_hostname = $host and action_remote_port in ($ports)",
+    "dataset = xdr_data | alter window = $window_start | limit $max_rows",
+    "dataset = xdr_data | filter $field_name != null",
+])
+def test_parameters_are_valid(query):
+    assert rules(query) == []
+
+@pytest.mark.parametrize("query, rule", [
+    ("dataset = xdr_data | filter user = $", "unexpected_character"),
+    ("dataset = xdr_data | filter user = $1", "unexpected_character"),
+    ("dataset = xdr_data | limit $a $b", "bad_limit"),
+])
+def test_malformed_parameters_are_reported(query, rule):
+    assert rule in rules(query)
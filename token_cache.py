@@ -0,0 +1,249 @@
+import os
+import json
+import mmap
+import shutil
+import hashlib
+import argparse
+import tempfile
+from array import array
+from typing import Dict, Iterator, List, Tuple
+
+from transformers import AutoTokenizer
+
+from dataset_io import iter_converted
+from packing import IGNORE_INDEX
+
+# Bump when the cache layout or the way examples are encoded changes
+CACHE_VERSION = 1
+
+# Prompt layout for tokenizers without a chat template (or when --template plain is chosen)
+PLAIN_TEMPLATE = "### Instruction:\n{prompt}\n\n### Response:\n"
+TEMPLATES = ("chat", "plain")
+
+# Examples tokenized per tokenizer call; fast tokenizers encode a batch in parallel
+ENCODE_BATCH_SIZE = 1000
+
+# Dataset digests kept in the cache root, keyed by path, so unchanged datasets are not re-hashed
+DIGESTS_FILE = "dataset_digests.json"
+
+def load_tokenizer(model_name: str):
+    return AutoTokenizer.from_pretrained(model_name)
+
+def resolve_template(tokenizer, template: str) -> str:
+    """The template actually used: "chat" falls back to "plain" for tokenizers without a chat template."""
+    if template not in TEMPLATES:
+        raise ValueError(f"Unknown prompt template: {template}")
+    if template == "chat" and not getattr(tokenizer, "chat_template", None):
+        return "plain"
+    return template
+
+def render_prompt(tokenizer, prompt: str, template: str) -> str:
+    """The prompt text the model sees before its response."""
+    if template == "chat":
+        return tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False,
+                                             add_generation_prompt=True)
+    return PLAIN_TEMPLATE.format(prompt=prompt)
+
+def encode_batch(tokenizer, examples: List[Dict], template: str) -> List[Tuple[List[int], int]]:
+    """
+    Tokenize prompt/response examples, returning for each its untruncated token IDs and the
+    number of leading prompt tokens (which carry no loss). The response ends with EOS.
+    """
+    prompts = [render_prompt(tokenizer, example["prompt"], template) for example in examples]
+    responses = [example["response"] + (tokenizer.eos_token or "") for example in examples]
+    prompt_ids = tokenizer(prompts, add_special_tokens=False)["input_ids"]
+    response_ids = tokenizer(responses, add_special_tokens=False)["input_ids"]
+    return [(p + r, len(p)) for p, r in zip(prompt_ids, response_ids)]
+
+def tokenizer_identity(tokenizer) -> Dict:
+    """What determines how the tokenizer encodes text, for the cache fingerprint."""
+    return {
+        "class": type(tokenizer).__name__,
+        "name_or_path": getattr(tokenizer, "name_or_path", None),
+        "vocab_size": len(tokenizer),
+        "special_tokens": getattr(tokenizer, "special_tokens_map", None),
+        "chat_template": getattr(tokenizer, "chat_template", None),
+    }
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def dataset_digest(dataset_path: str, cache_root: str) -> str:
+    """
+    sha256 of the dataset file. The digest is stored in cache_root and reused while the file's
+    size and mtime are unchanged, so only a new or edited dataset is read in full.
+    """
+    stat = os.stat(dataset_path)
+    key = os.path.abspath(dataset_path)
+    digests_file = os.path.join(cache_root, DIGESTS_FILE)
+    digests = {}
+    if os.path.exists(digests_file):
+        try:
+            with open(digests_file, "r", encoding="utf-8") as f:
+                digests = json.load(f)
+        except (OSError, ValueError):
+            digests = {}
+    entry = digests.get(key)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha256"]
+    digest = hash_file(dataset_path)
+    digests[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+    os.makedirs(cache_root, exist_ok=True)
+    tmp_file = f"{digests_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(digests, f, indent=2)
+    os.replace(tmp_file, digests_file)
+    return digest
+
+def fingerprint(dataset_path: str, tokenizer, template: str, max_seq_length: int, cache_root: str) -> str:
+    """Hash of the dataset contents and everything that affects its tokenization."""
+    key = {
+        "version": CACHE_VERSION,
+        "dataset": dataset_digest(dataset_path, cache_root),
+        "tokenizer": tokenizer_identity(tokenizer),
+        "template": template,
+        "max_seq_length": max_seq_length,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def iter_batches(dataset_path: str, batch_size: int, stats: Dict) -> Iterator[List[Dict]]:
+    batch = []
+    for example in iter_converted(dataset_path, "prompt_response", stats):
+        batch.append(example)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def build_cache(dataset_path: str, tokenizer, template: str, max_seq_length: int, cache_dir: str) -> Dict:
+    """
+    Tokenize the dataset into cache_dir: token IDs (int32), loss masks (one byte per token) and
+    example offsets (int64) as flat binary files, plus meta.json. Examples longer than
+    max_seq_length are truncated and counted. Written to a temporary directory of its own and
+    moved into place, so a cache directory is always complete, even when several launches
+    build the same cache at once; the first to finish wins and the others use its copy.
+    """
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(cache_dir) or ".", prefix=".building-")
+    try:
+        meta = write_cache(dataset_path, tokenizer, template, max_seq_length, tmp_dir)
+        try:
+            os.rename(tmp_dir, cache_dir)
+        except OSError:
+            if not os.path.exists(os.path.join(cache_dir, "meta.json")):
+                raise
+            shutil.rmtree(tmp_dir)  # Another launch built this cache first; theirs is identical
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return meta
+
+def write_cache(dataset_path: str, tokenizer, template: str, max_seq_length: int, tmp_dir: str) -> Dict:
+    """Write the cache files of build_cache into tmp_dir and return the cache metadata."""
+    stats = {}
+    offsets = array("q", [0])
+    truncated = 0
+    with open(os.path.join(tmp_dir, "tokens.bin"), "wb") as tokens_file, \
+            open(os.path.join(tmp_dir, "loss_mask.bin"), "wb") as mask_file:
+        for batch in iter_batches(dataset_path, ENCODE_BATCH_SIZE, stats):
+            for ids, prompt_len in encode_batch(tokenizer, batch, template):
+                if len(ids) > max_seq_length:
+                    ids = ids[:max_seq_length]
+                    truncated += 1
+                prompt_len = min(prompt_len, len(ids))
+                array("i", ids).tofile(tokens_file)
+                mask_file.write(bytes(prompt_len) + b"\x01" * (len(ids) - prompt_len))
+                offsets.append(offsets[-1] + len(ids))
+    with open(os.path.join(tmp_dir, "offsets.bin"), "wb") as f:
+        offsets.tofile(f)
+    meta = {
+        "examples": len(offsets) - 1,
+        "tokens": offsets[-1],
+        "truncated": truncated,
+        "skipped": stats.get("skipped", 0),
+        "template": template,
+        "max_seq_length": max_seq_length,
+        "dataset_path": dataset_path,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+def _map_file(path: str, fmt: str):
+    """Memory-map a binary file as a read-only typed view; empty files give an empty array."""
+    if os.path.getsize(path) == 0:
+        return array(fmt)
+    with open(path, "rb") as f:
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(fmt)
+
+class TokenizedDataset:
+    """
+    Read-only view of a token cache directory. Opening it maps the files without reading
+    them, so loading takes the same time whatever the dataset size; examples are sliced out
+    on access.
+    """
+
+    def __init__(self, cache_dir: str):
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.tokens = _map_file(os.path.join(cache_dir, "tokens.bin"), "i")
+        self.loss_mask = _map_file(os.path.join(cache_dir, "loss_mask.bin"), "B")
+        self.offsets = _map_file(os.path.join(cache_dir, "offsets.bin"), "q")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def length(self, index: int) -> int:
+        return self.offsets[index + 1] - self.offsets[index]
+
+    def __getitem__(self, index: int) -> Dict[str, List[int]]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = self.offsets[index], self.offsets[index + 1]
+        input_ids = self.tokens[start:end].tolist()
+        mask = self.loss_mask[start:end]
+        return {
+            "input_ids": input_ids,
+            "attention_mask": [1] * len(input_ids),
+            "labels": [token if keep else IGNORE_INDEX for token, keep in zip(input_ids, mask)],
+        }
+
+def load_or_build(dataset_path: str, tokenizer, template: str, max_seq_length: int,
+                  cache_root: str = "token_cache") -> TokenizedDataset:
+    """Open the token cache for these settings, building it first if the dataset or settings changed."""
+    template = resolve_template(tokenizer, template)
+    cache_dir = os.path.join(cache_root, fingerprint(dataset_path, tokenizer, template, max_seq_length, cache_root))
+    if os.path.exists(os.path.join(cache_dir, "meta.json")):
+        print(f"Using token cache {cache_dir}")
+    else:
+        print(f"Tokenizing {dataset_path} into {cache_dir} ...")
+        os.makedirs(cache_root, exist_ok=True)
+        meta = build_cache(dataset_path, tokenizer, template, max_seq_length, cache_dir)
+        print(f"Cached {meta['examples']} examples ({meta['tokens']} tokens); "
+              f"{meta['truncated']} truncated to {max_seq_length} tokens, {meta['skipped']} skipped")
+    return TokenizedDataset(cache_dir)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tokenize a dataset once into a memory-mapped token cache.")
+    parser.add_argument("dataset_path", help="Dataset file (any format dataset_io reads)")
+    parser.add_argument("--model_name", required=True, help="Model whose tokenizer is used")
+    parser.add_argument("--template", choices=TEMPLATES, default="chat",
+                        help="Prompt layout: the tokenizer's chat template (falls back to plain) or plain")
+    parser.add_argument("--max_seq_length", type=int, default=512, help="Examples are truncated to this many tokens")
+    parser.add_argument("--token_cache_dir", default="token_cache", help="Directory holding the token caches")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    tokenizer = load_tokenizer(args.model_name)
+    dataset = load_or_build(args.dataset_path, tokenizer, args.template, args.max_seq_length, args.token_cache_dir)
+    print(f"{len(dataset)} examples ready")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 import os
+import time
 import argparse
 from llamafactory import LlamaFactory  # Hypothetical API; adjust if needed
 from transformers import TrainingArguments
-from datasets import load_dataset
+from datasets import Dataset
+
+from dataset_io import iter_converted
+from token_cache import TEMPLATES, load_or_build, load_tokenizer
+from packing import LengthGroupedSampler, PackedDataset, describe_plan, padding_stats
 
 # Default configuration for fine-tuning
 DEFAULT_CONFIG = {
@@ -17,6 +22,8 @@ DEFAULT_CONFIG = {
     "logging_steps": 10,
     "save_steps": 100,
     "gradient_accumulation_steps": 2,
+    "template": "chat",
+    "token_cache_dir": None,  # Opt-in: pre-tokenizing needs a Hugging Face tokenizer, not an Ollama tag
 }
 
 def parse_args():
@@ -25,7 +32,7 @@ def parse_args():
     parser.add_argument("--model_name", type=str, default=DEFAULT_CONFIG["model_name"],
                         help="Model name or path (e.g., deepseek-r1:14b, gemma2:9b)")
     parser.add_argument("--dataset_path", type=str, default=DEFAULT_CONFIG["dataset_path"],
-                        help="Path to the JSONL dataset")
+                        help="Path to the dataset (ShareGPT, prompt/response or Alpaca; JSON or JSONL, optionally compressed)")
     parser.add_argument("--output_dir", type=str, default=DEFAULT_CONFIG["output_dir"],
                         help="Directory to save the fine-tuned model")
     parser.add_argument("--lora_rank", type=int, default=DEFAULT_CONFIG["lora_rank"],
@@ -45,13 +52,40 @@ def parse_args():
     parser.add_argument("--gradient_accumulation_steps", type=int,
                         default=DEFAULT_CONFIG["gradient_accumulation_steps"],
                         help="Steps for gradient accumulation")
-    return parser.parse_args()
+    parser.add_argument("--template", choices=TEMPLATES, default=DEFAULT_CONFIG["template"],
+                        help="Prompt layout for pre-tokenization: the tokenizer's chat template or plain")
+    parser.add_argument("--token_cache_dir", type=str, default=DEFAULT_CONFIG["token_cache_dir"],
+                        help="Pre-tokenize the dataset into caches in this directory (e.g. token_cache); "
+                             "--model_name must then be a Hugging Face model id or path. "
+                             "By default the trainer tokenizes the dataset itself")
+    parser.add_argument("--packing", action="store_true",
+                        help="Concatenate examples into full max_seq_length sequences with per-example attention")
+    parser.add_argument("--group_by_length", action="store_true",
+                        help="Without packing, batch examples of similar length together to cut padding")
+    args = parser.parse_args()
+    if (args.packing or args.group_by_length) and not args.token_cache_dir:
+        parser.error("--packing and --group_by_length need the token cache (--token_cache_dir)")
+    return args
+
+def iter_examples(dataset_path, file_stamp):
+    """Yield prompt/response records; file_stamp only keys the datasets cache so edits are picked up."""
+    stats = {}
+    yield from iter_converted(dataset_path, "prompt_response", stats)
+    if stats.get("skipped"):
+        print(f"Skipped {stats['skipped']} records that could not be converted to prompt/response")
 
 def prepare_dataset(dataset_path):
-    """Load and format the JSONL dataset for Llama Factory."""
+    """
+    Load and format the dataset for Llama Factory. Any format dataset_io reads (ShareGPT,
+    prompt/response or Alpaca; JSON, JSONL or compressed) is streamed, never loaded whole.
+    """
     print(f"Loading dataset from: {dataset_path}")
-    dataset = load_dataset("json", data_files=dataset_path, split="train")
-    # Format for Llama Factory: assumes 'prompt' and 'response' fields
+    stat = os.stat(dataset_path)
+    dataset = Dataset.from_generator(
+        iter_examples,
+        gen_kwargs={"dataset_path": dataset_path, "file_stamp": (stat.st_size, stat.st_mtime_ns)}
+    )
+    # Format for Llama Factory: 'prompt' and 'response' fields
     def format_example(example):
         return {
             "input": example["prompt"],
@@ -61,6 +95,32 @@ def prepare_dataset(dataset_path):
     print(f"Dataset loaded with {len(formatted_dataset)} examples")
     return formatted_dataset
 
+def plan_batches(dataset, args):
+    """
+    Choose the training rows and sampler for the batching mode, and report the padding of
+    that plan next to padding every row to max_seq_length.
+    Returns the dataset, the sampler (None for the trainer's default) and the padding ratio.
+    """
+    lengths = [dataset.length(i) for i in range(len(dataset))]
+    in_order = [list(range(i, min(i + args.batch_size, len(lengths)))) for i in range(0, len(lengths), args.batch_size)]
+    print(describe_plan("Padded to max_seq_length", *padding_stats(in_order, lengths, args.max_seq_length)))
+    sampler = None
+    if args.packing:
+        dataset = PackedDataset(dataset, args.max_seq_length)
+        lengths = [dataset.length(i) for i in range(len(dataset))]
+        batches = [list(range(i, min(i + args.batch_size, len(lengths)))) for i in range(0, len(lengths), args.batch_size)]
+        real, padded = padding_stats(batches, lengths, args.max_seq_length)
+        print(f"Packed {len(dataset.dataset)} examples into {len(dataset)} sequences")
+        print(describe_plan("Packed", real, padded))
+    elif args.group_by_length:
+        sampler = LengthGroupedSampler(lengths, args.batch_size)
+        real, padded = padding_stats(sampler.batches(), lengths)
+        print(describe_plan("Grouped by length", real, padded))
+    else:
+        real, padded = padding_stats(in_order, lengths)
+        print(describe_plan("Padded to longest in batch", real, padded))
+    return dataset, sampler, 1 - real / max(padded, 1)
+
 def main():
     """Main function to fine-tune the model with Llama Factory."""
     args = parse_args()
@@ -69,8 +129,15 @@ def main():
     os.makedirs(args.output_dir, exist_ok=True)
     print(f"Output directory set to: {args.output_dir}")
 
-    # Load and prepare dataset
-    dataset = prepare_dataset(args.dataset_path)
+    # Load and prepare dataset: pre-tokenized once per dataset, tokenizer, template and max_seq_length
+    if args.token_cache_dir:
+        tokenizer = load_tokenizer(args.model_name)
+        dataset = load_or_build(args.dataset_path, tokenizer, args.template, args.max_seq_length, args.token_cache_dir)
+        print(f"Dataset loaded with {len(dataset)} tokenized examples")
+        dataset, sampler, padding_ratio = plan_batches(dataset, args)
+    else:
+        dataset = prepare_dataset(args.dataset_path)
+        sampler, padding_ratio = None, None
 
     # Define training arguments for Llama Factory
     training_args = TrainingArguments(
@@ -94,13 +161,21 @@ def main():
         model_name_or_path=args.model_name,
         training_args=training_args,
         lora_rank=args.lora_rank,
-        data=dataset,
+        data=dataset,  # Pre-tokenized input_ids/attention_mask/labels rows, or input/output text rows
+        sampler=sampler,  # Length-grouped order; None keeps the trainer's random sampler
+        packing=args.packing,  # Rows hold several examples; attention_mask numbers them
         task="text-generation",  # Adjust task if needed
     )
 
     # Start fine-tuning
     print(f"Starting fine-tuning of {args.model_name} with LoRA rank {args.lora_rank}")
+    train_start = time.time()
     trainer.train()
+    train_time = time.time() - train_start
+    if padding_ratio is not None:
+        real_tokens = sum(dataset.length(i) for i in range(len(dataset))) * args.num_train_epochs
+        print(f"Trained on {real_tokens} real tokens in {train_time:.1f}s: {real_tokens / max(train_time, 1e-9):.0f} "
+              f"effective tokens/sec at {padding_ratio:.1%} padding")
 
     # Save the final model
     trainer.save_model(os.path.join(args.output_dir, "final_model"))
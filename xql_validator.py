@@ -0,0 +1,325 @@
+import re
+import sys
+import json
+from bisect import bisect_right
+from typing import Dict, List, NamedTuple
+
+# One compiled pattern tokenizes a whole query in a single pass; group order matters
+# (comments and strings must win over the operators they start with).
+TOKEN_PATTERN = r"""
+    (?P<ws>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<open_comment>/\*)
+  | (?P<string>{strings}|`[^`]*`)
+  | (?P<open_string>["'`])
+  | (?P<number>\d+(?:\.\d+)?(?![\w.]))
+  | (?P<ident>[A-Za-z_][\w.]*|\d[\w.]*)
+  | (?P<param>\$[A-Za-z_]\w*)
+  | (?P<op>!~=|~=|!=|<=|>=|==|=|<|>|\+|-|\*|/|%|:)
+  | (?P<punct>[|,()\[\]{{}}])
+  | (?P<bad>.)
+"""
+# Queries in the wild use backslash both as an escape ("\"") and literally ("\" for a path separator).
+# Strings are read with escapes first; a query that then has issues is re-read with the alternatives
+# (backslash-quote before a delimiter is literal, or no escapes at all) and the cleanest reading wins.
+TOKEN_RES = [
+    re.compile(TOKEN_PATTERN.format(strings=pattern), re.VERBOSE | re.DOTALL)
+    for pattern in (
+        r""""(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'""",
+        r""""(?:\\"(?![\s,)\]]|$)|\\(?!")|\\(?=")|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'""",
+        r""""[^"\n]*"|'[^'\n]*'""",
+    )
+]
+
+SOURCE_STAGES = {"dataset", "datamodel", "preset"}
+STAGES = SOURCE_STAGES | {
+    "alter", "arrayexpand", "bin", "call", "comp", "config", "dedup", "fields", "filter", "getrole",
+    "iploc", "join", "limit", "replacenull", "search", "sort", "tag", "target", "top", "transaction",
+    "union", "view", "windowcomp",
+}
+CLOSING = {")": "(", "]": "[", "}": "{"}
+BOOLEAN_OPS = {"and", "or", "not", "in", "contains", "incidr"}
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+    pos: int
+
+class XQLIssue(NamedTuple):
+    rule: str
+    severity: str  # "error" or "warning"
+    message: str
+    line: int
+    column: int
+
+class _Stage(NamedTuple):
+    keyword: Token  # First token of the stage, or the pipe token for an empty stage
+    args: List[Token]
+    subqueries: int
+
+class _Checker:
+    """Collects issues for one query, resolving token positions to line/column only when needed."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.issues = []
+        self._line_starts = None
+
+    def add(self, rule: str, severity: str, message: str, pos: int) -> None:
+        if self._line_starts is None:
+            self._line_starts = [0] + [m.end() for m in re.finditer(r"\n", self.text)]
+        line = bisect_right(self._line_starts, pos)
+        column = pos - self._line_starts[line - 1] + 1
+        self.issues.append(XQLIssue(rule, severity, message, line, column))
+
+def tokenize(text: str, checker: _Checker = None, string_mode: int = 0) -> List[Token]:
+    """
+    Split a query into tokens, dropping whitespace and comments and reporting lexical errors.
+    string_mode selects how backslashes in strings are read (an index into TOKEN_RES).
+    """
+    tokens = []
+    token_match = TOKEN_RES[string_mode].match
+    pos = 0
+    while pos < len(text):
+        match = token_match(text, pos)
+        kind = match.lastgroup
+        pos = match.end()
+        if kind in ("ws", "comment"):
+            continue
+        if kind == "open_comment":
+            if checker is not None:
+                checker.add("unterminated_comment", "error", "Block comment is never closed", match.start())
+            break
+        if kind == "open_string":
+            # Close the string at the end of the line so one bad literal doesn't swallow the query
+            if checker is not None:
+                checker.add("unterminated_string", "error", "String literal is never closed", match.start())
+            line_end = text.find("\n", pos)
+            pos = len(text) if line_end == -1 else line_end
+            tokens.append(Token("string", text[match.start():pos], match.start()))
+            continue
+        if kind == "bad":
+            if checker is not None:
+                checker.add("unexpected_character", "error", f"Unexpected character {match.group()!r}", match.start())
+            continue
+        value = match.group()
+        tokens.append(Token(value if kind == "punct" else kind, value, match.start()))
+    return tokens
+
+def _split_top_level(args: List[Token], separator: str) -> List[List[Token]]:
+    """Split stage arguments on a separator outside brackets."""
+    parts, current, depth = [], [], 0
+    for token in args:
+        if token.kind in ("(", "[", "{"):
+            depth += 1
+        elif token.kind in CLOSING:
+            depth -= 1
+        if token.kind == separator and depth == 0:
+            parts.append(current)
+            current = []
+        else:
+            current.append(token)
+    parts.append(current)
+    return parts
+
+def _ends_with_operator(args: List[Token]) -> bool:
+    last = args[-1]
+    return last.kind == "op" or (last.kind == "ident" and last.value.lower() in BOOLEAN_OPS)
+
+def _check_source(stage: _Stage, checker: _Checker) -> None:
+    args = stage.args
+    if stage.keyword.value.lower() == "datamodel":
+        # Only the 'datamodel dataset ...' form names a source; a bare datamodel stage is valid
+        if not args or args[0].kind != "ident" or args[0].value.lower() != "dataset":
+            return
+        args = args[1:]
+    if not args or not (args[0].value == "=" or (args[0].kind == "ident" and args[0].value.lower() == "in")):
+        checker.add("bad_source", "error", f"'{stage.keyword.value}' must be followed by '= <name>' or 'in (...)'",
+                    args[0].pos if args else stage.keyword.pos)
+    elif len(args) < 2:
+        checker.add("bad_source", "error", f"'{stage.keyword.value}' has no dataset name", args[0].pos)
+
+def _check_expression(stage: _Stage, checker: _Checker) -> None:
+    if _ends_with_operator(stage.args):
+        checker.add("dangling_operator", "error",
+                    f"'{stage.keyword.value}' expression ends with '{stage.args[-1].value}'", stage.args[-1].pos)
+
+def _check_assignments(stage: _Stage, checker: _Checker) -> None:
+    parts = _split_top_level(stage.args, ",") if stage.keyword.value.lower() == "alter" else [stage.args]
+    for part in parts:
+        if not part:
+            checker.add("empty_assignment", "error", f"Empty assignment in '{stage.keyword.value}'", stage.keyword.pos)
+        elif len(part) < 3 or part[0].kind != "ident" or part[1].value != "=":
+            checker.add("bad_assignment", "error",
+                        f"'{stage.keyword.value}' expects '<field> = <expression>'", part[0].pos)
+        elif _ends_with_operator(part):
+            checker.add("dangling_operator", "error",
+                        f"'{stage.keyword.value}' expression ends with '{part[-1].value}'", part[-1].pos)
+
+def _check_comp(stage: _Stage, checker: _Checker) -> None:
+    calls = any(a.kind == "ident" and b.kind == "(" for a, b in zip(stage.args, stage.args[1:]))
+    if not calls:
+        checker.add("bad_comp", "error", f"'{stage.keyword.value}' needs at least one aggregate function call",
+                    stage.args[0].pos)
+
+def _check_join(stage: _Stage, checker: _Checker) -> None:
+    if not stage.subqueries:
+        checker.add("bad_join", "error", "'join' needs a subquery in parentheses", stage.args[0].pos)
+    elif not any(t.kind == "ident" and t.value.lower() == "as" for t in stage.args):
+        checker.add("bad_join", "error", "'join' subquery needs an 'as <alias>'", stage.args[-1].pos)
+
+def _check_limit(stage: _Stage, checker: _Checker) -> None:
+    if len(stage.args) != 1 or stage.args[0].kind not in ("number", "param"):
+        checker.add("bad_limit", "error", "'limit' expects a single number or parameter", stage.args[0].pos)
+
+def _check_sort(stage: _Stage, checker: _Checker) -> None:
+    if stage.args[0].kind != "ident" or stage.args[0].value.lower() not in ("asc", "desc"):
+        checker.add("bad_sort", "error", "'sort' expects 'asc' or 'desc' before the fields", stage.args[0].pos)
+
+def _check_list(stage: _Stage, checker: _Checker) -> None:
+    previous = None
+    for token in stage.args + [None]:
+        if (token is None or token.kind == ",") and (previous is None or previous.kind == ","):
+            position = token.pos if token is not None else previous.pos
+            checker.add("empty_field", "error", f"Empty item in '{stage.keyword.value}' list", position)
+            return
+        previous = token
+
+# Per-stage rules, built once at import: stage keyword -> (needs arguments, argument checks)
+STAGE_RULES: Dict[str, tuple] = {
+    "dataset": (True, [_check_source]),
+    "preset": (True, [_check_source]),
+    "datamodel": (False, [_check_source]),
+    "config": (True, [_check_assignments]),
+    "filter": (True, [_check_expression]),
+    "alter": (True, [_check_assignments]),
+    "comp": (True, [_check_comp]),
+    "windowcomp": (True, [_check_comp]),
+    "join": (True, [_check_join]),
+    "union": (True, []),
+    "limit": (True, [_check_limit]),
+    "sort": (True, [_check_sort]),
+    "fields": (True, [_check_list]),
+    "dedup": (True, [_check_list]),
+    "arrayexpand": (True, []),
+    "bin": (True, []),
+    "iploc": (True, []),
+    "replacenull": (True, []),
+    "top": (True, []),
+    "view": (True, []),
+}
+
+def _check_stages(stages: List[_Stage], checker: _Checker) -> None:
+    source_seen = False
+    for stage in stages:
+        keyword = stage.keyword
+        if keyword.kind == "|":
+            checker.add("empty_stage", "error", "Empty stage between pipes", keyword.pos)
+            continue
+        name = keyword.value.lower()
+        if keyword.kind != "ident" or name not in STAGES:
+            severity = "warning" if keyword.kind == "ident" else "error"
+            checker.add("unknown_stage", severity, f"Unknown stage '{keyword.value}'", keyword.pos)
+            continue
+        if not source_seen and name != "config":
+            if name not in SOURCE_STAGES:
+                checker.add("missing_source", "error",
+                            f"Query must start with dataset, datamodel or preset, not '{keyword.value}'", keyword.pos)
+            source_seen = True
+        needs_args, checks = STAGE_RULES.get(name, (False, []))
+        if not stage.args:
+            if needs_args:
+                checker.add("missing_arguments", "error", f"'{keyword.value}' stage has no arguments", keyword.pos)
+            continue
+        for check in checks:
+            check(stage, checker)
+
+def _parse_query(tokens: List[Token], i: int, checker: _Checker, nested: bool) -> int:
+    """
+    Parse a pipeline starting at tokens[i], recursing into parenthesized subqueries.
+    Returns the index of the token that ended the query: len(tokens), or the ')' closing a subquery.
+    """
+    stages = []
+    keyword, args, subqueries = None, [], 0
+    pipe = None
+    brackets = []
+
+    def end_stage():
+        if keyword is not None:
+            stages.append(_Stage(keyword, args, subqueries))
+        elif pipe is not None:
+            stages.append(_Stage(pipe, [], 0))
+
+    while i < len(tokens):
+        token = tokens[i]
+        kind = token.kind
+        if kind == "|" and not brackets:
+            end_stage()
+            keyword, args, subqueries, pipe = None, [], 0, token
+            i += 1
+            continue
+        if kind == ")" and not brackets and nested:
+            break
+        if keyword is None:
+            keyword = token
+            i += 1
+            continue
+        args.append(token)
+        if kind == "(" and i + 1 < len(tokens) and tokens[i + 1].kind == "ident" \
+                and tokens[i + 1].value.lower() in SOURCE_STAGES | {"config"}:
+            subqueries += 1
+            i = _parse_query(tokens, i + 1, checker, nested=True)
+            if i < len(tokens):
+                args.append(tokens[i])
+                i += 1
+            else:
+                checker.add("unclosed_bracket", "error", "Subquery '(' is never closed", token.pos)
+            continue
+        if kind in ("(", "[", "{"):
+            brackets.append(token)
+        elif kind in CLOSING:
+            if not brackets:
+                checker.add("unmatched_bracket", "error", f"Unmatched '{kind}'", token.pos)
+            elif brackets[-1].kind != CLOSING[kind]:
+                checker.add("unmatched_bracket", "error",
+                            f"'{kind}' closes '{brackets[-1].kind}'", token.pos)
+                brackets.pop()
+            else:
+                brackets.pop()
+        elif kind == "|":
+            checker.add("unexpected_pipe", "error", "'|' inside brackets", token.pos)
+        i += 1
+    end_stage()
+    for bracket in brackets:
+        checker.add("unclosed_bracket", "error", f"'{bracket.kind}' is never closed", bracket.pos)
+    if not stages:
+        checker.add("empty_query", "error", "Query is empty", tokens[i - 1].pos if i else 0)
+        return i
+    _check_stages(stages, checker)
+    return i
+
+def validate_xql(text: str) -> List[XQLIssue]:
+    """Tokenize and parse an XQL query, returning its issues ordered by position."""
+    best = None
+    for string_mode in range(len(TOKEN_RES)):
+        checker = _Checker(text)
+        _parse_query(tokenize(text, checker, string_mode), 0, checker, nested=False)
+        if best is None or len(checker.issues) < len(best.issues):
+            best = checker
+        if not best.issues:
+            break
+    return sorted(best.issues, key=lambda issue: (issue.line, issue.column))
+
+def main():
+    """Validate queries given as files (or stdin) and print their issues as JSON lines."""
+    paths = sys.argv[1:] or ["-"]
+    failed = False
+    for path in paths:
+        text = sys.stdin.read() if path == "-" else open(path, encoding="utf-8").read()
+        for issue in validate_xql(text):
+            failed |= issue.severity == "error"
+            print(json.dumps({"file": path, **issue._asdict()}))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()